@@ -7,20 +7,16 @@ Contains the functions used to import budget and forecast data as produced by th
 import datetime
 
 from dateutil import parser
-from sqlalchemy.orm import aliased
 
 import utils.console_output
 from customobjects import error_objects
 from customobjects.database_objects import \
     TableFinModelExtract, \
-    TableCompanies, \
-    TableChartOfAccounts, \
-    TableNodeHierarchy, \
-    TableCostCentres, \
     TableConsolidatedBudget, \
-    TableBudgetAllocationsData, \
-    TableAllocationAccounts
+    TableBudgetAllocationsData
+from utils.db_bulk_write import bulk_insert_rows
 from utils.db_connect import db_sessionmaker
+import utils.master_data
 import utils.misc_functions
 
 def import_budget_data_to_database(filepath, overwrite_data=False):
@@ -46,9 +42,9 @@ def import_budget_data_to_database(filepath, overwrite_data=False):
                                                       .format(import_tag))
 
     # Import the data to the database
-    session = db_sessionmaker()
+    rows = []
     for row in file_as_lists:
-        new_row = TableFinModelExtract(
+        new_row = dict(
                                         TimeStamp = convert_string_to_datetime(row[1]),
                                         Period = convert_string_to_datetime(row[2]),
                                         CompanyCode = row[3],
@@ -58,8 +54,10 @@ def import_budget_data_to_database(filepath, overwrite_data=False):
                                         Label = row[7],
                                         Comments = row[8]
                                         )
-        session.add(new_row)
+        rows.append(new_row)
 
+    session = db_sessionmaker()
+    bulk_insert_rows(session=session, table=TableFinModelExtract, rows=rows)
     session.commit()
     session.close()
 
@@ -130,37 +128,13 @@ def create_consolidated_budget_data(label):
     session = db_sessionmaker()
 
     # Get unallocated data
-    unalloc_data = session.query(TableFinModelExtract,
-                           TableCompanies,
-                           TableChartOfAccounts,
-                           TableNodeHierarchy,
-                           TableCostCentres)\
+    unalloc_data = session.query(TableFinModelExtract)\
         .filter(TableFinModelExtract.Label==label)\
-        .filter(TableFinModelExtract.CompanyCode==TableCompanies.CompanyCode)\
-        .filter(TableFinModelExtract.CostCentreCode==TableCostCentres.CostCentreCode)\
-        .filter(TableFinModelExtract.GLCode==TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code==TableNodeHierarchy.L3Code)\
         .all()
 
-    # To reference a table more than once (sender, receiver cost centres) we need to alias the table
-    cc_alias_sending = aliased(TableCostCentres)
-    cc_alias_receiving = aliased(TableCostCentres)
-    comp_alias_sending = aliased(TableCompanies)
-    comp_alias_receiving = aliased(TableCompanies)
-
     # Get allocated data
-    alloc_qry = session.query(TableBudgetAllocationsData,
-                              comp_alias_sending,
-                              comp_alias_receiving,
-                              cc_alias_sending,
-                              cc_alias_receiving,
-                              TableAllocationAccounts)\
+    alloc_qry = session.query(TableBudgetAllocationsData)\
         .filter(TableBudgetAllocationsData.Label==label)\
-        .filter(TableBudgetAllocationsData.SendingCompany==comp_alias_sending.CompanyCode)\
-        .filter(TableBudgetAllocationsData.ReceivingCompany==comp_alias_receiving.CompanyCode)\
-        .filter(TableBudgetAllocationsData.SendingCostCentre==cc_alias_sending.CostCentreCode)\
-        .filter(TableBudgetAllocationsData.ReceivingCostCentre==cc_alias_receiving.CostCentreCode)\
-        .filter(TableBudgetAllocationsData.GLAccount == TableAllocationAccounts.GLCode)\
         .all()
 
     session.close()
@@ -169,7 +143,16 @@ def create_consolidated_budget_data(label):
     consol_table_rows = []
     time_stamp = datetime.datetime.now()
 
-    for budget, comp, coa, node, cc in unalloc_data:
+    # The master data is looked up in memory, rows that aren't mapped in the master data are excluded
+    master_data = utils.master_data.get_master_data_snapshot()
+
+    for budget in unalloc_data:
+        comp = master_data.get_company(budget.CompanyCode)
+        cc = master_data.get_cost_centre(budget.CostCentreCode)
+        account_node = master_data.get_account_node(budget.GLCode)
+        if comp is None or cc is None or account_node is None:
+            continue
+        coa, node = account_node
 
         consol_row = TableConsolidatedBudget(
                                         Period = budget.Period,
@@ -198,7 +181,14 @@ def create_consolidated_budget_data(label):
         consol_table_rows.append(consol_row)
 
     # Append the data from the cost allocations table
-    for data, comp_send, comp_rec, cc_send, cc_rec, alloc_accounts in alloc_qry:
+    for data in alloc_qry:
+        comp_send = master_data.get_company(data.SendingCompany)
+        comp_rec = master_data.get_company(data.ReceivingCompany)
+        cc_send = master_data.get_cost_centre(data.SendingCostCentre)
+        cc_rec = master_data.get_cost_centre(data.ReceivingCostCentre)
+        alloc_accounts = master_data.allocation_accounts.get(data.GLAccount)
+        if None in (comp_send, comp_rec, cc_send, cc_rec, alloc_accounts):
+            continue
         alloc_row = TableConsolidatedBudget(
                                             Period = data.Period,
                                             CompanyCode = comp_rec.CompanyCode,
@@ -234,8 +224,7 @@ def create_consolidated_budget_data(label):
 
     # Add the new data
     session = db_sessionmaker()
-    for row in consol_table_rows:
-        session. add(row)
+    bulk_insert_rows(session=session, table=TableConsolidatedBudget, rows=consol_table_rows)
     session.commit()
     session.close()
 
@@ -416,6 +416,19 @@ class TablePeriods(Base):
     IsPublished = Column(Integer)
 
 
+class TableSchemaVersion(Base):
+    '''
+    SQLAlchemy ORM class for the tbl_MASTER_schemaversion table
+    '''
+
+    __tablename__ = r.TBL_MASTER_SCHEMAVERSION
+
+    ID = Column(Integer, primary_key=True)
+    Version = Column(Integer)
+    Description = Column(String(255))
+    DateApplied = Column(DateTime)
+
+
 class TableXeroExtract(Base):
     '''
     SQLAlchemy ORM class for the tbl_DATA_xeroextract table
@@ -453,5 +466,51 @@ class TableXeroExtract(Base):
                                      self.Value)
 
 
+class TableXeroExtractChangeLog(Base):
+    '''
+    SQLAlchemy ORM class for the tbl_DATA_extract_xero_changelog table
+    '''
+
+    __tablename__ = r.TBL_DATA_EXTRACT_XERO_CHANGELOG
+
+    ID = Column(Integer, primary_key=True)
+    DateChanged = Column(DateTime)
+    ChangeType = Column(String)
+    ReportName = Column(String)
+    CompanyName = Column(String)
+    CostCentreCode = Column(String, nullable=True)
+    AccountCode = Column(String)
+    Period = Column(DateTime)
+    OldValue = Column(Float, nullable=True)
+    NewValue = Column(Float, nullable=True)
+
+
+class TableXeroValidation(Base):
+    '''
+    SQLAlchemy ORM class for the tbl_DATA_validation_xero table
+    '''
+
+    __tablename__ = r.TBL_DATA_VALIDATION_XERO
+
+    ID = Column(Integer, primary_key=True)
+    DateChecked = Column(DateTime)
+    Period = Column(DateTime)
+    ReportName = Column(String(64))
+    CompanyName = Column(String(255))
+    AccountCode = Column(String(64))
+    AccountName = Column(String(255))
+    Value = Column(Float)
+    UnassignedValue = Column(Float)
+
+
+class TableXeroJournalSync(Base):
+    '''
+    SQLAlchemy ORM class for the tbl_DATA_xero_journal_sync table
+    '''
 
+    __tablename__ = r.TBL_DATA_XERO_JOURNAL_SYNC
 
+    ID = Column(Integer, primary_key=True)
+    CompanyName = Column(String)
+    LastJournalNumber = Column(Integer)
+    DateSynced = Column(DateTime)
@@ -67,4 +67,12 @@ class BudgetDataExistsError(AttributeError):
     Customer error class raised Budget data already exists and the user attempts to overwrite it
     '''
     def __init__(self, *args, **kwargs):
-        Exception.__init__(self, *args, **kwargs)
\ No newline at end of file
+        Exception.__init__(self, *args, **kwargs)
+
+
+class XeroRateLimitError(AttributeError):
+    '''
+    Customer error class raised when the Xero API rate limits can't be met by waiting and retrying
+    '''
+    def __init__(self, *args, **kwargs):
+        Exception.__init__(self, *args, **kwargs)
@@ -7,6 +7,10 @@ Contains user-defined objects used by the program
 
 '''
 
+import numpy as np
+
+from customobjects.error_objects import MasterDataIncompleteError
+
 
 class Employee(object):
 
@@ -116,3 +120,149 @@ class CostCentre(object):
     def __repr__(self):
         return "<CostCentre: Name: {}, Code: {}, Tier: {}>"\
             .format(self.master_name, self.master_code, self.hierarchy_tier)
+
+
+class XeroReportMatrix(object):
+    ''' Balances of one Xero report of a company for a period, one row per account and one column per cost centre '''
+
+    def __init__(self, values, report_name, company_name, period, account_codes, cost_centre_codes):
+
+        self.values = values                            # 2D numpy array, one row per account, one column per cost centre
+        self.report_name = report_name                  # Xero report the balances are from (P&L or Balance Sheet)
+        self.company_name = company_name                # Company name as given in the Xero reports
+        self.period = period
+        self.account_codes = account_codes              # Row index: numpy array of Xero account codes
+        self.cost_centre_codes = cost_centre_codes      # Column index: numpy array of Xero cost centre codes (None if unassigned)
+
+    def shape(self):
+        return self.values.shape
+
+    def __repr__(self):
+        return "<XeroReportMatrix: Report: {}, Company: {}, Accounts: {}, CostCentres: {}>"\
+            .format(self.report_name, self.company_name, self.values.shape[0], self.values.shape[1])
+
+
+class MasterDataSnapshot(object):
+    ''' In-memory copy of the master data tables, with dictionary lookups in place of joins to the tables '''
+
+    def __init__(self, version, accounts, nodes, allocation_accounts, cost_centres, companies):
+
+        self.version = version                          # Fingerprint of the master data tables the snapshot was loaded from
+
+        self.accounts = {coa.GLCode: coa for coa in accounts}                       # GLCode: Chart of Accounts row
+        self.accounts_by_xero_code = self.get_unique_lookup(rows=accounts, column_name='XeroCode')
+        self.nodes = {node.L3Code: node for node in nodes}                         # L3Code: Node Hierarchy row
+        self.allocation_accounts = {alloc.GLCode: alloc for alloc in allocation_accounts}
+        self.allocation_accounts_by_node = self.get_unique_lookup(rows=allocation_accounts, column_name='L2Hierarchy')
+        self.cost_centres = {cc.CostCentreCode: cc for cc in cost_centres}
+        self.cost_centres_by_xero_code = self.get_unique_lookup(rows=cost_centres, column_name='XeroCode')
+        self.companies = {comp.CompanyCode: comp for comp in companies}
+        self.companies_by_xero_name = self.get_unique_lookup(rows=companies, column_name='XeroName')
+
+    @staticmethod
+    def get_unique_lookup(rows, column_name):
+        ''' Returns a dictionary of the rows of a master data table keyed by a column that replaces a join on that
+            column. A join would match every row with the same value, so duplicate values can't be looked up
+
+        :param rows: List of ORM rows of a master data table
+        :param column_name: Name of the column the rows are looked up by (rows where it is None are left out)
+        :return: Dictionary of {column value: row}
+        '''
+
+        lookup = {}
+        duplicates = set()
+        for row in rows:
+            key = getattr(row, column_name)
+            if key is None:
+                continue
+            if key in lookup:
+                duplicates.add(key)
+            lookup[key] = row
+
+        if duplicates:
+            raise MasterDataIncompleteError("Table {} has duplicate values in column {}: {}"
+                                            .format(rows[0].__tablename__, column_name,
+                                                    ", ".join(str(key) for key in sorted(duplicates))))
+        return lookup
+
+    @staticmethod
+    def get_integer_code(code):
+        ''' GL and company codes are held as text in some tables (e.g. the Budget data), as integers in others
+
+        :param code:
+        :return: Integer code, or None if the code isn't a number
+        '''
+
+        try:
+            return int(code)
+        except (TypeError, ValueError):
+            return None
+
+    def get_account(self, gl_code):
+        return self.accounts.get(self.get_integer_code(gl_code))
+
+    def get_account_node(self, gl_code):
+        ''' Returns the Chart of Accounts and Node Hierarchy rows of a GL account
+
+        :param gl_code:
+        :return: Tuple of (account, node), or None if the account or its L3 node isn't in the master data
+        '''
+
+        coa = self.get_account(gl_code)
+        if coa is None or coa.L3Code not in self.nodes:
+            return None
+        return coa, self.nodes[coa.L3Code]
+
+    def get_allocation_account(self, gl_code):
+        ''' Returns the allocation account that the costs of a GL account are allocated through, via its L2 node
+
+        :param gl_code:
+        :return: Allocation Accounts row, or None if the costs of the account aren't allocated
+        '''
+
+        account_node = self.get_account_node(gl_code)
+        if account_node is None:
+            return None
+        return self.allocation_accounts_by_node.get(account_node[1].L2Code)
+
+    def get_company(self, company_code):
+        return self.companies.get(self.get_integer_code(company_code))
+
+    def get_cost_centre(self, cost_centre_code):
+        return self.cost_centres.get(cost_centre_code)
+
+    def __repr__(self):
+        return "<MasterDataSnapshot: Version: {}, Accounts: {}, CostCentres: {}, Companies: {}>"\
+            .format(self.version, len(self.accounts), len(self.cost_centres), len(self.companies))
+
+
+class AllocatedCostMatrix(object):
+    ''' Costs allocated by one tier of cost centres, one row per cost allocated and one column per receiving cost
+        centre '''
+
+    def __init__(self, values, sender_codes, ledger_codes, periods, receiver_codes, cost_hierarchy):
+
+        self.values = values                            # 2D numpy array, one row per cost, one column per receiver
+        self.sender_codes = sender_codes                # Row index: numpy array of the codes of the sending cost centres
+        self.ledger_codes = ledger_codes                # Row index: numpy array of the GL codes the costs are allocated via
+        self.periods = periods                          # Row index: numpy array of the periods of the costs
+        self.receiver_codes = receiver_codes            # Column index: numpy array of the codes of the receiving cost centres
+        self.cost_hierarchy = cost_hierarchy            # Hierarchy level the allocated costs are reported against
+
+    def shape(self):
+        return self.values.shape
+
+    def iter_nonzero(self):
+        ''' Yields (sender_code, receiver_code, ledger_code, period, value) for each cost allocated to a receiving
+            cost centre, ordered by cost and then by receiving cost centre
+
+        :return:
+        '''
+
+        cost_idx, receiver_idx = np.nonzero(self.values)
+        for i, j, value in zip(cost_idx.tolist(), receiver_idx.tolist(), self.values[cost_idx, receiver_idx].tolist()):
+            yield self.sender_codes[i], self.receiver_codes[j], self.ledger_codes[i], self.periods[i], value
+
+    def __repr__(self):
+        return "<AllocatedCostMatrix: Costs: {}, Receivers: {}, CostHierarchy: {}>"\
+            .format(self.values.shape[0], self.values.shape[1], self.cost_hierarchy)
@@ -104,6 +104,7 @@ CREATE TABLE `tbl_DATA_extract_xero` (
   `DateExtracted` datetime NOT NULL COMMENT 'DateTime for when the extract was taken from Xero',
   `ReportName` text NOT NULL COMMENT 'The name of the report as defined in Xero',
   `CompanyName` text NOT NULL COMMENT 'The company name as defined in the xero extract',
+  `CostCentreCode` varchar(64) DEFAULT NULL COMMENT 'The ID mapped to the cost centre by Xero',
   `CostCentreName` text COMMENT 'The name of the cost centre as defined in Xero',
   `AccountCode` text NOT NULL COMMENT 'The ID mapped to the account by Xero',
   `AccountName` text NOT NULL COMMENT 'The name of the account as defined in Xero',
@@ -113,6 +114,25 @@ CREATE TABLE `tbl_DATA_extract_xero` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_DATA_extract_xero_changelog`
+--
+
+CREATE TABLE `tbl_DATA_extract_xero_changelog` (
+  `ID` int(11) NOT NULL COMMENT 'Auto-incremented row IDs',
+  `DateChanged` datetime NOT NULL COMMENT 'DateTime for when the change was applied to tbl_DATA_extract_xero',
+  `ChangeType` varchar(10) NOT NULL COMMENT 'INSERTED, UPDATED or DELETED',
+  `ReportName` text NOT NULL COMMENT 'The name of the report as defined in Xero',
+  `CompanyName` text NOT NULL COMMENT 'The company name as defined in the xero extract',
+  `CostCentreCode` text COMMENT 'The ID mapped to the cost centre by Xero',
+  `AccountCode` text NOT NULL COMMENT 'The ID mapped to the account by Xero',
+  `Period` datetime NOT NULL COMMENT 'The accounting period the item is posted in',
+  `OldValue` decimal(10,3) DEFAULT NULL COMMENT 'Balance before the change (NULL if the balance is new)',
+  `NewValue` decimal(10,3) DEFAULT NULL COMMENT 'Balance after the change (NULL if the balance was deleted)'
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_DATA_headcount_actuals`
 --
@@ -132,6 +152,37 @@ CREATE TABLE `tbl_DATA_headcount_actuals` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_DATA_validation_xero`
+--
+
+CREATE TABLE `tbl_DATA_validation_xero` (
+  `ID` int(11) NOT NULL COMMENT 'Auto-incremented row IDs',
+  `DateChecked` datetime NOT NULL COMMENT 'DateTime for when the facts were recorded',
+  `Period` datetime NOT NULL COMMENT 'The accounting period the balances are posted in',
+  `ReportName` varchar(64) NOT NULL COMMENT 'The name of the report as defined in Xero',
+  `CompanyName` varchar(255) NOT NULL COMMENT 'The company name as defined in the xero extract',
+  `AccountCode` varchar(64) NOT NULL COMMENT 'The ID mapped to the account by Xero',
+  `AccountName` varchar(255) NOT NULL COMMENT 'The name of the account as defined in Xero',
+  `Value` decimal(10,3) NOT NULL COMMENT 'Total balance of the account in the report',
+  `UnassignedValue` decimal(10,3) NOT NULL COMMENT 'Balance of the account not assigned to a cost centre'
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `tbl_DATA_xero_journal_sync`
+--
+
+CREATE TABLE `tbl_DATA_xero_journal_sync` (
+  `ID` int(11) NOT NULL COMMENT 'Auto-incremented row IDs',
+  `CompanyName` varchar(255) NOT NULL COMMENT 'The company name as defined in the xero extract',
+  `LastJournalNumber` int(11) NOT NULL COMMENT 'The highest Xero journal number applied to tbl_DATA_extract_xero',
+  `DateSynced` datetime NOT NULL COMMENT 'DateTime for when the journals were last synced'
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_MASTER_allocationaccounts`
 --
@@ -229,6 +280,19 @@ CREATE TABLE `tbl_MASTER_periods` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `tbl_MASTER_schemaversion`
+--
+
+CREATE TABLE `tbl_MASTER_schemaversion` (
+  `ID` int(11) NOT NULL,
+  `Version` int(11) NOT NULL COMMENT 'Version of the migration applied (see utils/db_migrations.py)',
+  `Description` varchar(255) NOT NULL,
+  `DateApplied` datetime NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `tbl_OUTPUT_consolidated_actuals`
 --
@@ -325,12 +389,33 @@ ALTER TABLE `tbl_DATA_extract_finmodel`
 ALTER TABLE `tbl_DATA_extract_xero`
   ADD PRIMARY KEY (`ID`);
 
+--
+-- Indexes for table `tbl_DATA_extract_xero_changelog`
+--
+ALTER TABLE `tbl_DATA_extract_xero_changelog`
+  ADD PRIMARY KEY (`ID`),
+  ADD KEY `Period` (`Period`);
+
 --
 -- Indexes for table `tbl_DATA_headcount_actuals`
 --
 ALTER TABLE `tbl_DATA_headcount_actuals`
   ADD PRIMARY KEY (`EmployeeID`);
 
+--
+-- Indexes for table `tbl_DATA_validation_xero`
+--
+ALTER TABLE `tbl_DATA_validation_xero`
+  ADD PRIMARY KEY (`ID`),
+  ADD KEY `idx_tbl_DATA_validation_xero_Period_CompanyName` (`Period`,`CompanyName`);
+
+--
+-- Indexes for table `tbl_DATA_xero_journal_sync`
+--
+ALTER TABLE `tbl_DATA_xero_journal_sync`
+  ADD PRIMARY KEY (`ID`),
+  ADD UNIQUE KEY `CompanyName` (`CompanyName`);
+
 --
 -- Indexes for table `tbl_MASTER_allocationaccounts`
 --
@@ -367,6 +452,12 @@ ALTER TABLE `tbl_MASTER_nodehierarchy`
 ALTER TABLE `tbl_MASTER_periods`
   ADD PRIMARY KEY (`ID`);
 
+--
+-- Indexes for table `tbl_MASTER_schemaversion`
+--
+ALTER TABLE `tbl_MASTER_schemaversion`
+  ADD PRIMARY KEY (`ID`);
+
 --
 -- Indexes for table `tbl_OUTPUT_consolidated_actuals`
 --
@@ -409,6 +500,21 @@ ALTER TABLE `tbl_DATA_extract_finmodel`
 ALTER TABLE `tbl_DATA_extract_xero`
   MODIFY `ID` int(11) NOT NULL AUTO_INCREMENT COMMENT 'Auto-incremented row IDs';
 --
+-- AUTO_INCREMENT for table `tbl_DATA_extract_xero_changelog`
+--
+ALTER TABLE `tbl_DATA_extract_xero_changelog`
+  MODIFY `ID` int(11) NOT NULL AUTO_INCREMENT COMMENT 'Auto-incremented row IDs';
+--
+-- AUTO_INCREMENT for table `tbl_DATA_validation_xero`
+--
+ALTER TABLE `tbl_DATA_validation_xero`
+  MODIFY `ID` int(11) NOT NULL AUTO_INCREMENT COMMENT 'Auto-incremented row IDs';
+--
+-- AUTO_INCREMENT for table `tbl_DATA_xero_journal_sync`
+--
+ALTER TABLE `tbl_DATA_xero_journal_sync`
+  MODIFY `ID` int(11) NOT NULL AUTO_INCREMENT COMMENT 'Auto-incremented row IDs';
+--
 -- AUTO_INCREMENT for table `tbl_MASTER_allocationaccounts`
 --
 ALTER TABLE `tbl_MASTER_allocationaccounts`
@@ -439,6 +545,11 @@ ALTER TABLE `tbl_MASTER_nodehierarchy`
 ALTER TABLE `tbl_MASTER_periods`
   MODIFY `ID` int(11) NOT NULL AUTO_INCREMENT;
 --
+-- AUTO_INCREMENT for table `tbl_MASTER_schemaversion`
+--
+ALTER TABLE `tbl_MASTER_schemaversion`
+  MODIFY `ID` int(11) NOT NULL AUTO_INCREMENT;
+--
 -- AUTO_INCREMENT for table `tbl_OUTPUT_consolidated_actuals`
 --
 ALTER TABLE `tbl_OUTPUT_consolidated_actuals`
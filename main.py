@@ -5,18 +5,31 @@
 Command Line Interface for the management reporting database and associated functions
 '''
 
+import time
+
 import click
 import requests
 
+import references as r
 import utils.data_integrity
+import utils.db_benchmark
+import utils.db_migrations
 import utils.misc_functions
+import utils.xero_cache
+import utils.xero_files
+import utils.xero_journals
+import utils.xero_standin
 from budget import budget_import
 from customobjects import error_objects, database_objects
+from management_accounting.actuals_pipeline import run_actuals_pipeline
 from management_accounting.allocations import allocate_actuals_data, allocate_budget_data
-from management_accounting.data_import import create_internal_financial_statements, create_consolidated_financial_statements
+from management_accounting.data_import import create_internal_financial_statements_for_periods, \
+    create_consolidated_financial_statements
 from utils.console_output import util_output, display_status_table
+from utils.db_bulk_write import get_bulk_write_statistics
 from utils.misc_functions import user_confirm_action_on_period
-from utils.xero_connect import pull_xero_data_to_database
+from utils.xero_connect import get_request_counters, get_xero_company_codes, pull_xero_data_to_database, \
+    pull_xero_data_to_database_for_periods
 
 @click.group()
 def fin_reporting():
@@ -97,25 +110,55 @@ def actuals_publish_period(year, month, publish):
 @fin_reporting.command(help="Retrieves financial data from Xero")
 @click.option('--year', type=int, help="The year of the period to get Xero data for")
 @click.option('--month', type=int, help="The month of the period to get Xero data for")
-def actuals_get_data(year, month):
+@click.option('--from', 'from_period', help="The first period (YYYY.MM) of a range of periods to get Xero data for")
+@click.option('--to', 'to_period', help="The last period (YYYY.MM) of a range of periods to get Xero data for")
+@click.option('--workers', type=int, default=r.XERO_MAX_CONCURRENT_PERIODS,
+              help="The number of periods to retrieve from each Xero organisation at the same time")
+@click.option('--refresh', type=bool, default=False,
+              help="True/False whether to retrieve the data from Xero rather than the local Xero cache")
+@click.option('--incremental', type=bool, default=False,
+              help="True/False whether to write only the balances that have changed since the last pull (the data "
+                   "is always retrieved from Xero rather than the local Xero cache)")
+@click.option('--company', type=int, help="The company code of the Xero organisation to get data for")
+@click.option('--all_companies', type=bool, default=False,
+              help="True/False whether to get data for every Xero organisation at the same time")
+def actuals_get_data(year, month, from_period, to_period, workers, refresh, incremental, company, all_companies):
     ''' Pulls data from the company Xero instance and imports it into the reporting
         database using standardised master data
 
     :param year:
     :param month:
+    :param from_period: First period of a range of periods to pull (YYYY.MM)
+    :param to_period: Last period of a range of periods to pull (YYYY.MM)
+    :param workers: Number of periods pulled concurrently from each organisation when a range is given
+    :param refresh: True/False whether to bypass the local cache of Xero responses
+    :param incremental: True/False whether to write only the balances that have changed since the last pull
+    :param company: Company code of the Xero organisation to pull (optional if only one organisation is set up)
+    :param all_companies: True/False whether to pull every Xero organisation concurrently
     :return:
     '''
 
+    if from_period or to_period or all_companies:
+        actuals_get_data_for_range(year=year, month=month, from_period=from_period, to_period=to_period,
+                                   workers=workers, refresh=refresh, incremental=incremental, company=company,
+                                   all_companies=all_companies)
+        return
+
     try:
-        util_output("Retrieving Xero data for period {}.{}...".format(year, month))
-        pull_xero_data_to_database(year=year, month=month)
-        util_output("Pull of Xero data for period {}.{} is complete".format(year, month))
+        util_output("Retrieving Xero data for {}...".format(get_pull_description(company, year, month)))
+        change_counts = pull_xero_data_to_database(year=year, month=month, refresh=refresh, incremental=incremental,
+                                                   company_code=company)
+        if incremental:
+            util_output("{} balances inserted, {} updated and {} deleted".format(*change_counts))
+        util_output("Pull of Xero data for {} is complete".format(get_pull_description(company, year, month)))
+        output_bulk_write_statistics()
 
     except (error_objects.PeriodIsLockedError,
             error_objects.PeriodNotFoundError,
             error_objects.MasterDataIncompleteError,
             error_objects.BalanceSheetImbalanceError,
-            error_objects.UnallocatedCostsNotNilError), e:
+            error_objects.UnallocatedCostsNotNilError,
+            error_objects.XeroRateLimitError), e:
         util_output("ERROR: {}".format(e.message))
         util_output("ERROR: Import of Xero data aborted")
 
@@ -123,22 +166,288 @@ def actuals_get_data(year, month):
         util_output("ERROR: Unable to establish connection to Xero API. Check network connectivity.")
         util_output("ERROR: Import of Xero data aborted")
 
+    except requests.exceptions.HTTPError, e:
+        util_output("ERROR: Xero API request failed: {}".format(e))
+        util_output("ERROR: Import of Xero data aborted")
+
+
+def output_bulk_write_statistics():
+    ''' Outputs the number of rows written to each table since the last output, and the rate they were written at
+
+    :return:
+    '''
+
+    for table_name, row_count, seconds, rows_per_second in get_bulk_write_statistics(reset=True):
+        util_output("{} rows written to {} in {:.2f} seconds ({:.0f} rows/sec)"
+                    .format(row_count, table_name, seconds, rows_per_second))
+
+def get_pull_description(company_code, year, month):
+    ''' Returns a description of a pull of Xero data for use in console output
+
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :param year:
+    :param month:
+    :return:
+    '''
+
+    if company_code is None:
+        return "period {}.{}".format(year, month)
+    return "period {}.{} of company {}".format(year, month, company_code)
+
+
+def actuals_get_data_for_range(year, month, from_period, to_period, workers, refresh, incremental=False,
+                               company=None, all_companies=False):
+    ''' Pulls data from Xero for a range of periods and/or for every Xero organisation, retrieving several
+        periods and organisations concurrently
+
+    :param year: Year of the period to pull if no range is given
+    :param month: Month of the period to pull if no range is given
+    :param from_period: First period of the range (YYYY.MM)
+    :param to_period: Last period of the range (YYYY.MM)
+    :param workers: Number of periods pulled concurrently from each organisation
+    :param refresh: True/False whether to bypass the local cache of Xero responses
+    :param incremental: True/False whether to write only the balances that have changed since the last pull
+    :param company: Company code of the Xero organisation to pull (ignored if all_companies is True)
+    :param all_companies: True/False whether to pull every Xero organisation
+    :return:
+    '''
+
+    try:
+        if from_period or to_period:
+            if not (from_period and to_period):
+                raise error_objects.PeriodNotFoundError("Both --from and --to must be given to pull a range of periods")
+            from_year, from_month = utils.misc_functions.convert_period_string_to_year_month(from_period)
+            to_year, to_month = utils.misc_functions.convert_period_string_to_year_month(to_period)
+        else:
+            from_year, from_month, to_year, to_month = year, month, year, month
+        periods = utils.misc_functions.get_periods_in_range(from_year=from_year, from_month=from_month,
+                                                            to_year=to_year, to_month=to_month)
+
+    except error_objects.PeriodNotFoundError, e:
+        util_output("ERROR: {}".format(e.message))
+        util_output("ERROR: Import of Xero data aborted")
+
+    else:
+        company_codes = get_xero_company_codes() if all_companies else [company]
+
+        util_output("Retrieving Xero data for {} periods from {}.{} to {}.{} for {} organisations ({} periods at a"
+                    " time per organisation)...".format(len(periods), from_year, from_month, to_year, to_month,
+                                                        len(company_codes), workers))
+        start_time = time.time()
+        failed_pulls = []
+
+        for company_code, year, month, error_message in pull_xero_data_to_database_for_periods(
+                periods=periods, max_workers=workers, refresh=refresh, incremental=incremental,
+                company_codes=company_codes):
+            if error_message:
+                failed_pulls.append((company_code, year, month))
+                util_output("ERROR: Pull of Xero data for {} aborted: {}"
+                            .format(get_pull_description(company_code, year, month), error_message))
+            else:
+                util_output("Pull of Xero data for {} is complete".format(get_pull_description(company_code, year, month)))
+
+        util_output("Pull of Xero data for {} periods finished in {:.1f} seconds ({} failed)"
+                    .format(len(periods) * len(company_codes), time.time() - start_time, len(failed_pulls)))
+        util_output("Xero API requests: {requests} sent, {queued} queued, {throttled} throttled, {retried} retried"
+                    .format(**get_request_counters()))
+        output_bulk_write_statistics()
+        for company_code, year, month in sorted(failed_pulls):
+            util_output("ERROR: {} must be re-run".format(get_pull_description(company_code, year, month).capitalize()))
+
+
+@fin_reporting.command(help="Imports a folder of reports previously exported from Xero")
+@click.option('--folder', help="The folder containing the exported reports (prompts for a folder if not given)")
+@click.option('--company_name', help="The company name, if not included in the titles of the exported reports")
+@click.option('--workers', type=int, default=r.XERO_REPORT_FILE_WORKERS,
+              help="The number of files to parse at the same time")
+def actuals_import_files(folder, company_name, workers):
+    ''' Imports reports previously exported from Xero (named e.g. ProfitAndLoss-2017-03.json or
+        BalanceSheet-2017-03.csv) into the reporting database without calling the Xero API
+
+    :param folder: Folder containing the exported reports
+    :param company_name: Company name used for CSV reports whose titles don't include it
+    :param workers: Number of files parsed at the same time
+    :return:
+    '''
+
+    if not folder:
+        util_output("Select the folder of exported Xero reports to import:")
+        folder = utils.misc_functions.get_directoryname_from_gui()
+
+    if not folder or not utils.data_integrity.check_directory_exists(folder):
+        util_output("ERROR: Folder '{}' not found, import of Xero reports aborted".format(folder))
+        return
+
+    util_output("Importing Xero reports from {} ({} files at a time)...".format(folder, workers))
+    start_time = time.time()
+    file_count = 0
+    row_count = 0
+    failed_files = []
+
+    for filepath, year, month, file_row_count, error_message in utils.xero_files.import_xero_report_files(
+            directory=folder, company_name=company_name, workers=workers):
+        file_count += 1
+        row_count += file_row_count
+        if error_message:
+            failed_files.append(filepath)
+            util_output("ERROR: Import of {} aborted: {}".format(filepath, error_message))
+        else:
+            util_output("Imported {} rows for period {}.{} from {}".format(file_row_count, year, month, filepath))
+
+    util_output("Import of {} Xero reports ({} rows) finished in {:.1f} seconds ({} failed)"
+                .format(file_count, row_count, time.time() - start_time, len(failed_files)))
+    output_bulk_write_statistics()
+    for filepath in sorted(failed_files):
+        util_output("ERROR: {} must be re-imported".format(filepath))
+
+
+@fin_reporting.command(help="Applies the journals posted in Xero since the last sync to the Xero data")
+@click.option('--company', type=int, help="The company code of the Xero organisation to sync")
+@click.option('--all_companies', type=bool, default=False,
+              help="True/False whether to sync every Xero organisation")
+def actuals_sync_journals(company, all_companies):
+    ''' Applies the journals posted in Xero since the last sync to the Xero data already in the reporting
+        database, so that late postings into previously pulled periods are picked up without a full re-pull
+
+    :param company: Company code of the Xero organisation to sync (optional if only one organisation is set up)
+    :param all_companies: True/False whether to sync every Xero organisation
+    :return:
+    '''
+
+    company_codes = get_xero_company_codes() if all_companies else [company]
+
+    for company_code in company_codes:
+        description = "company {}".format(company_code) if company_code is not None else "Xero"
+        try:
+            util_output("Syncing Xero journals for {}...".format(description))
+            results = utils.xero_journals.sync_xero_journals(company_code=company_code)
+            util_output("{journals} new journals for {company_name}: {inserted} balances inserted, {updated} updated"
+                        " and {deleted} deleted".format(**results))
+            for period in results['stale_periods']:
+                util_output("WARNING: The Balance Sheet for period {}.{} is affected by journals posted into a"
+                            " previous financial year and must be pulled again with actuals_get_data".format(period.year, period.month))
+            for period in results['locked_periods']:
+                util_output("WARNING: Period {}.{} is LOCKED so the journals posted into it were not applied. Pull it"
+                            " again with actuals_get_data once it is unlocked".format(period.year, period.month))
+            output_bulk_write_statistics()
+
+        except (error_objects.PeriodIsLockedError,
+                error_objects.PeriodNotFoundError,
+                error_objects.MasterDataIncompleteError,
+                error_objects.XeroRateLimitError), e:
+            util_output("ERROR: {}".format(e.message))
+            util_output("ERROR: Sync of Xero journals for {} aborted".format(description))
+
+        except requests.exceptions.ConnectionError:
+            util_output("ERROR: Unable to establish connection to Xero API. Check network connectivity.")
+            util_output("ERROR: Sync of Xero journals for {} aborted".format(description))
+
+        except requests.exceptions.HTTPError, e:
+            util_output("ERROR: Xero API request failed: {}".format(e))
+            util_output("ERROR: Sync of Xero journals for {} aborted".format(description))
+
+
+@fin_reporting.command(help="Clears the local cache of Xero data")
+@click.option('--mapping_only', type=bool, default=False,
+              help="True/False whether to clear only the cached cost centre mapping")
+def xero_clear_cache(mapping_only):
+    ''' Clears the local cache of Xero responses and the cached cost centre mapping, so that the next pull
+        retrieves the data from Xero
+
+    :param mapping_only: True/False whether to clear only the cached cost centre mapping
+    :return:
+    '''
+
+    utils.xero_cache.invalidate_cost_centre_mapping()
+    util_output("Cached Xero cost centre mapping cleared")
+    if not mapping_only:
+        utils.xero_cache.clear_xero_cache()
+        util_output("Cached Xero responses cleared")
+
+
+@fin_reporting.command(help="Benchmarks the Xero extraction against a local stand-in for the Xero API")
+@click.option('--year', type=int, default=2017, help="The year of the period to extract")
+@click.option('--month', type=int, default=1, help="The month of the period to extract")
+@click.option('--iterations', type=int, default=10, help="The number of times to run the extraction")
+@click.option('--accounts', type=int, default=r.XERO_STANDIN_ACCOUNTS, help="The number of accounts in each report")
+@click.option('--cost_centres', type=int, default=r.XERO_STANDIN_COST_CENTRES,
+              help="The number of cost centres in the Profit & Loss")
+@click.option('--latency', type=float, default=0.0, help="Seconds the stand-in waits before each response")
+@click.option('--rate_limit_every', type=int, default=0,
+              help="Respond to every n-th request with a 429 rate limit error (0 to disable)")
+@click.option('--calls_per_minute', type=int, default=r.XERO_RATE_LIMIT_PER_MINUTE,
+              help="The per-minute call limit the requests are scheduled within")
+@click.option('--insert', type=bool, default=True,
+              help="True/False whether to time the database insert (the inserted rows are rolled back)")
+def xero_benchmark(year, month, iterations, accounts, cost_centres, latency, rate_limit_every, calls_per_minute,
+                   insert):
+    ''' Times the fetch, parse and insert stages of the Xero extraction against synthetic reports served by a
+        local stand-in for the Xero API
+
+    :param year:
+    :param month:
+    :param iterations: Number of times to run the extraction
+    :param accounts: Number of accounts in each synthetic report
+    :param cost_centres: Number of cost centres in the synthetic Profit & Loss
+    :param latency: Seconds the stand-in waits before each response
+    :param rate_limit_every: Respond to every n-th request with a 429 (0 to disable)
+    :param calls_per_minute: Per-minute call limit the requests are scheduled within
+    :param insert: True/False whether to time the database insert
+    :return:
+    '''
+
+    util_output("Benchmarking Xero extraction: {} accounts x {} cost centres, {} iterations..."
+                .format(accounts, cost_centres, iterations))
+    results = utils.xero_standin.benchmark_xero_extraction(year=year, month=month, iterations=iterations,
+                                                           insert_rows=insert, account_count=accounts,
+                                                           cost_centre_count=cost_centres, latency=latency,
+                                                           rate_limit_every=rate_limit_every,
+                                                           rate_limit_per_minute=calls_per_minute)
+
+    for stage in ['fetch', 'parse', 'insert', 'total']:
+        summary = utils.xero_standin.summarise_timings(results[stage])
+        if summary['mean'] is not None:
+            util_output("{:<6}: mean {:.3f}s, p50 {:.3f}s, p95 {:.3f}s, max {:.3f}s"
+                        .format(stage, summary['mean'], summary['p50'], summary['p95'], summary['max']))
+
+    if results['total']:
+        util_output("{} rows per extraction ({:.0f} rows/sec)"
+                    .format(results['rows'], results['rows'] / utils.xero_standin.summarise_timings(results['total'])['mean']))
+    util_output("{requests} requests sent, {queued} queued, {throttled} throttled, {retried} retried"
+                .format(**results['requests']))
+    for error_message in results['failed']:
+        util_output("ERROR: Extraction failed: {}".format(error_message))
+
 
 @fin_reporting.command(help="Converts Xero data into standard Clearmatics format")
 @click.option('--year', type=int, help="The year of the period of Xero data to convert")
 @click.option('--month', type=int, help="The month of the period of Xero data to convert")
-def actuals_convert_data(year, month):
+@click.option('--from', 'from_period', help="The first period (YYYY.MM) of a range of periods of Xero data to convert")
+@click.option('--to', 'to_period', help="The last period (YYYY.MM) of a range of periods of Xero data to convert")
+def actuals_convert_data(year, month, from_period, to_period):
     ''' Converts imported Xero data into the standardised internal format
 
     :param year: Year to convert (Integer)
     :param month: Month of the year to convert (Integer)
+    :param from_period: First period of a range of periods to convert (YYYY.MM)
+    :param to_period: Last period of a range of periods to convert (YYYY.MM)
     :return:
     '''
 
     try:
-        util_output("Converting Xero data for period {}.{}".format(year, month))
-        create_internal_financial_statements(year=year, month=month)
+        if from_period or to_period:
+            if not (from_period and to_period):
+                raise error_objects.PeriodNotFoundError("Both --from and --to must be given to convert a range of periods")
+            from_year, from_month = utils.misc_functions.convert_period_string_to_year_month(from_period)
+            to_year, to_month = utils.misc_functions.convert_period_string_to_year_month(to_period)
+            util_output("Converting Xero data for periods {}.{} to {}.{}".format(from_year, from_month, to_year, to_month))
+        else:
+            from_year, from_month, to_year, to_month = year, month, year, month
+            util_output("Converting Xero data for period {}.{}".format(year, month))
+        create_internal_financial_statements_for_periods(from_year=from_year, from_month=from_month,
+                                                         to_year=to_year, to_month=to_month)
         util_output("Conversion of Xero data complete")
+        output_bulk_write_statistics()
 
     except (error_objects.PeriodIsLockedError,
             error_objects.PeriodNotFoundError,
@@ -153,19 +462,27 @@ def actuals_convert_data(year, month):
 @fin_reporting.command(help="Runs indirect cost allocations")
 @click.option('--year', type=int, help="The year of the period to run allocations on")
 @click.option('--month', type=int, help="The month of the period to run allocations on")
-def actuals_run_allocations(year, month):
+@click.option('--engine', type=click.Choice(r.ALLOCATION_ENGINES), default=r.ALLOCATION_ENGINE_OBJECTS,
+              help="The engine to calculate the allocations with ('matrix' allocates each tier as a matrix, "
+                   "'transfer' allocates costs directly to the cost centres that bear them)")
+@click.option('--audit_rows', type=bool, default=False,
+              help="True/False whether the 'transfer' engine writes the costs allocated by each tier")
+def actuals_run_allocations(year, month, engine, audit_rows):
     ''' Runs the allocation process on extracted Xero data following its conversion to
         standardised company master data
 
     :param year: Year of the period to run allocations on (Integer)
     :param month: Month of the period to run allocations on (Integer)
+    :param engine: Allocation engine to use ('objects', 'matrix' or 'transfer')
+    :param audit_rows: True/False whether the 'transfer' engine writes the costs allocated by each tier
     :return:
     '''
 
     try:
         util_output("Starting allocations process for period {}.{}...".format(year,month))
-        allocate_actuals_data(year=year, month=month)
+        allocate_actuals_data(year=year, month=month, engine=engine, audit_rows=audit_rows)
         util_output("Allocation process for period {}.{} is complete".format(year, month))
+        output_bulk_write_statistics()
 
     except (error_objects.PeriodIsLockedError,
             error_objects.PeriodNotFoundError,
@@ -191,6 +508,7 @@ def actuals_create_consol_table(year, month):
         util_output("Creating consolidated Financial Statements for period {}.{}...".format(year, month))
         create_consolidated_financial_statements(year=year, month=month)
         util_output("Creation of consolidated Financial Statements complete")
+        output_bulk_write_statistics()
 
     except (error_objects.PeriodIsLockedError,
             error_objects.PeriodNotFoundError,
@@ -202,6 +520,63 @@ def actuals_create_consol_table(year, month):
         util_output("ERROR: Creation of consolidated Financial Statements aborted")
 
 
+@fin_reporting.command(help="Closes a period of actuals, running every stage from the Xero pull to the consolidated "
+                            "Financial Statements in memory")
+@click.option('--year', type=int, help="The year of the period to close")
+@click.option('--month', type=int, help="The month of the period to close")
+@click.option('--refresh', type=bool, default=False,
+              help="True/False whether to retrieve the data from Xero rather than the local Xero cache")
+@click.option('--company', type=int, help="The company code of the Xero organisation to get data for")
+@click.option('--all_companies', type=bool, default=False,
+              help="True/False whether to get data for every Xero organisation")
+@click.option('--engine', type=click.Choice(r.ALLOCATION_ENGINES), default=r.ALLOCATION_ENGINE_OBJECTS,
+              help="The engine to calculate the allocations with ('matrix' allocates each tier as a matrix, "
+                   "'transfer' allocates costs directly to the cost centres that bear them)")
+@click.option('--audit_rows', type=bool, default=False,
+              help="True/False whether the 'transfer' engine writes the costs allocated by each tier")
+def actuals_run_all(year, month, refresh, company, all_companies, engine, audit_rows):
+    ''' Pulls a period of data from Xero, converts it, runs the allocations and creates the consolidated
+        Financial Statements without writing the output of each stage to the database in between. The output of
+        every stage is written at the end in a single transaction
+
+    :param year: Year of the period to close (Integer)
+    :param month: Month of the period to close (Integer)
+    :param refresh: True/False whether to bypass the local cache of Xero responses
+    :param company: Company code of the Xero organisation to pull (optional if only one organisation is set up)
+    :param all_companies: True/False whether to pull every Xero organisation
+    :param engine: Allocation engine to use ('objects', 'matrix' or 'transfer')
+    :param audit_rows: True/False whether the 'transfer' engine writes the costs allocated by each tier
+    :return:
+    '''
+
+    try:
+        util_output("Closing period {}.{}...".format(year, month))
+        company_codes = get_xero_company_codes() if all_companies else [company]
+        run_actuals_pipeline(year=year, month=month, refresh=refresh, company_codes=company_codes, engine=engine,
+                             audit_rows=audit_rows)
+        util_output("Period {}.{} is closed: Xero data converted, allocated and consolidated".format(year, month))
+        output_bulk_write_statistics()
+
+    except (error_objects.PeriodIsLockedError,
+            error_objects.PeriodNotFoundError,
+            error_objects.TableEmptyForPeriodError,
+            error_objects.MasterDataIncompleteError,
+            error_objects.BalanceSheetImbalanceError,
+            error_objects.UnallocatedCostsNotNilError,
+            error_objects.CashFlowCalculationError,
+            error_objects.XeroRateLimitError), e:
+        util_output("ERROR: {}".format(e.message))
+        util_output("ERROR: Closing of period {}.{} aborted, no data has been written".format(year, month))
+
+    except requests.exceptions.ConnectionError:
+        util_output("ERROR: Unable to establish connection to Xero API. Check network connectivity.")
+        util_output("ERROR: Closing of period {}.{} aborted, no data has been written".format(year, month))
+
+    except requests.exceptions.HTTPError, e:
+        util_output("ERROR: Xero API request failed: {}".format(e))
+        util_output("ERROR: Closing of period {}.{} aborted, no data has been written".format(year, month))
+
+
 @fin_reporting.command(help="Imports a flatfile of Budget data")
 @click.option('--overwrite', type=bool, default=False, help="True/False whether to overwrite previously imported data")
 def budget_get_data(overwrite):
@@ -221,6 +596,7 @@ def budget_get_data(overwrite):
             util_output("ERROR: Import of Budget data is aborted")
         else:
             util_output("File import successful.")
+            output_bulk_write_statistics()
     else:
         util_output("No file selected by user, import process aborted.")
 
@@ -229,20 +605,29 @@ def budget_get_data(overwrite):
 @click.option('--label', help="Label of budget data to allocate")
 @click.option('--max_year', type=int, default=9999, help="The last year of the data to run allocations on")
 @click.option('--max_month', type=int, default=13, help="The last month of the data to run allocations on")
-def budget_run_allocations(label, max_year=9999, max_month=13):
+@click.option('--engine', type=click.Choice(r.ALLOCATION_ENGINES), default=r.ALLOCATION_ENGINE_OBJECTS,
+              help="The engine to calculate the allocations with ('matrix' allocates each tier as a matrix, "
+                   "'transfer' allocates costs directly to the cost centres that bear them)")
+@click.option('--audit_rows', type=bool, default=False,
+              help="True/False whether the 'transfer' engine writes the costs allocated by each tier")
+def budget_run_allocations(label, max_year=9999, max_month=13, engine=r.ALLOCATION_ENGINE_OBJECTS, audit_rows=False):
     ''' Runs the allocation process on extracted Xero data following its conversion to
         standardised company master data
 
     :param year: Year of the period to run allocations on (Integer)
     :param month: Month of the period to run allocations on (Integer)
+    :param engine: Allocation engine to use ('objects', 'matrix' or 'transfer')
+    :param audit_rows: True/False whether the 'transfer' engine writes the costs allocated by each tier
     :return:
     '''
 
     try:
         # ToDo: add check that the input dates are valid
         util_output("Starting budget allocation process for {} up to period {}.{}...".format(label, max_year, max_month))
-        allocate_budget_data(label=label, max_year=max_year, max_month=max_month)
+        allocate_budget_data(label=label, max_year=max_year, max_month=max_month, engine=engine,
+                             audit_rows=audit_rows)
         util_output("Budget allocation process for dataset {} is complete".format(label))
+        output_bulk_write_statistics()
 
     except (error_objects.PeriodIsLockedError,
             error_objects.PeriodNotFoundError,
@@ -267,6 +652,7 @@ def budget_create_consol_table(label):
         util_output("Creating consolidated Budget Financial Statements for {}...".format(label))
         budget_import.create_consolidated_budget_data(label=label)
         util_output("Creation of consolidated Budget Financial Statements complete")
+        output_bulk_write_statistics()
 
     except (error_objects.PeriodIsLockedError,
             error_objects.PeriodNotFoundError,
@@ -316,6 +702,71 @@ def output_to_csv():
         util_output("No folder selected by user. Output process aborted.")
 
 
+@fin_reporting.command(help="Upgrades the schema of the reporting database to the latest version")
+def database_migrate():
+    ''' Applies any schema migrations that haven't been applied to the reporting database yet
+
+    :return:
+    '''
+
+    util_output("Upgrading the schema of the reporting database...")
+    migrations_applied, partitions_added = utils.db_migrations.apply_schema_migrations()
+    for version, description in migrations_applied:
+        util_output("Applied migration {}: {}".format(version, description))
+    if partitions_added:
+        util_output("Added {} monthly partitions".format(len(partitions_added)))
+    util_output("Schema of the reporting database is up to date")
+
+
+@fin_reporting.command(help="Benchmarks the database queries of each stage of the reporting process")
+@click.option('--year', type=int, help="The year of the period to benchmark")
+@click.option('--month', type=int, help="The month of the period to benchmark")
+@click.option('--iterations', type=int, default=5, help="The number of times to run the queries of each stage")
+@click.option('--label', help="The label of the Budget data to benchmark the Budget stages on")
+@click.option('--output', help="The filepath to save the timings to (e.g. before running database_migrate)")
+@click.option('--baseline', help="The filepath of saved timings to compare the timings against")
+def database_benchmark(year, month, iterations, label, output, baseline):
+    ''' Times the database queries of each stage of the reporting process, optionally comparing them against the
+        timings of an earlier benchmark (e.g. to measure the effect of a schema migration)
+
+    :param year:
+    :param month:
+    :param iterations: Number of times to run the queries of each stage
+    :param label: Label of the Budget data to benchmark the Budget stages on (the Budget stages are skipped if None)
+    :param output: Filepath to save the timings to
+    :param baseline: Filepath of saved timings to compare the timings against
+    :return:
+    '''
+
+    try:
+        baseline_results = utils.db_benchmark.load_benchmark_results(filepath=baseline) if baseline else {}
+    except (IOError, ValueError), e:
+        util_output("ERROR: Baseline timings could not be loaded: {}".format(e))
+        return
+
+    try:
+        util_output("Benchmarking database queries for {}.{}, {} iterations...".format(year, month, iterations))
+        results = utils.db_benchmark.benchmark_stage_queries(year=year, month=month, iterations=iterations,
+                                                             label=label)
+    except error_objects.PeriodNotFoundError, e:
+        util_output("ERROR: {}".format(e.message))
+        util_output("ERROR: Benchmark of database queries aborted")
+        return
+
+    for stage, stage_function in utils.db_benchmark.get_benchmark_stages(year=year, month=month, label=label):
+        summary = utils.xero_standin.summarise_timings(results[stage])
+        message = "{:<27}: mean {:.3f}s, p50 {:.3f}s, p95 {:.3f}s, max {:.3f}s"\
+            .format(stage, summary['mean'], summary['p50'], summary['p95'], summary['max'])
+        if baseline_results.get(stage):
+            baseline_mean = utils.xero_standin.summarise_timings(baseline_results[stage])['mean']
+            message += " (baseline mean {:.3f}s, {:.1f}x)".format(baseline_mean, baseline_mean / summary['mean'])
+        util_output(message)
+
+    if output:
+        utils.db_benchmark.save_benchmark_results(results=results, filepath=output)
+        util_output("Timings saved to {}".format(output))
+
+
 @fin_reporting.command(help="Displays the current status of the reporting data in the database")
 def status():
     ''' Displays the summary status table in the console that displays which the status of the financial data
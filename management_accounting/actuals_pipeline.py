@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to close a period of actuals in a single run. The Xero data is extracted, converted,
+extended with the cash flow statement, allocated and consolidated in memory, with each stage passing its rows
+directly to the next, and the output of every stage is then written to the database in a single transaction
+'''
+
+import datetime
+
+from dateutil.relativedelta import relativedelta
+
+from customobjects import error_objects
+from customobjects.database_objects import \
+    TableXeroExtract, \
+    TableFinancialStatements, \
+    TableAllocationsData, \
+    TableConsolidatedFinStatements
+from management_accounting import allocations, data_import
+from management_accounting.cashflow_calcs import create_internal_cashflow_statements_for_periods
+from management_accounting.headcount import create_headcount_rows_actuals
+import references as r
+import utils.data_integrity
+from utils.db_bulk_write import bulk_insert_rows
+from utils.db_connect import db_sessionmaker
+import utils.misc_functions
+import utils.xero_connect
+import utils.xero_validation
+
+
+def extract_xero_period_rows(year, month, company_codes, refresh=False, timestamp=None):
+    ''' Retrieves the Xero data of a period for each Xero organisation and parses it into rows of the Xero extract
+        table, recording the validation facts of the rows as they are parsed
+
+    :param year:
+    :param month:
+    :param company_codes: Company codes of the Xero organisations to pull ([None] if only one organisation is set up)
+    :param refresh: If True, retrieve the data from the API rather than replaying it from the local Xero cache
+    :param timestamp: Time the data was extracted
+    :return: Tuple of (names of the companies pulled, list of row tuples with values in the order of
+             utils.xero_connect.XERO_EXTRACT_COLUMNS, dictionary of validation facts)
+    '''
+
+    company_names = []
+    xero_rows = []
+    validation_facts = {}
+    for company_code in company_codes:
+        pulled_company_names, pnl_data_rows, bs_data_rows = utils.xero_connect.get_xero_extract_rows(
+            year=year, month=month, refresh=refresh, company_code=company_code, timestamp=timestamp)
+
+        pnl_data_rows = list(utils.xero_connect.iter_xero_rows_recording_validation_facts(rows=pnl_data_rows,
+                                                                                          facts=validation_facts))
+        bs_data_rows = list(utils.xero_connect.iter_xero_rows_recording_validation_facts(rows=bs_data_rows,
+                                                                                         facts=validation_facts))
+        utils.xero_connect.check_xero_row_counts(year=year, month=month, pnl_row_count=len(pnl_data_rows),
+                                                 bs_row_count=len(bs_data_rows))
+
+        company_names += pulled_company_names
+        xero_rows += pnl_data_rows + bs_data_rows
+
+    return company_names, xero_rows, validation_facts
+
+def get_xero_extract_rows_of_other_companies(period, company_names):
+    ''' Returns the Xero data of a period already held in the database for the companies that aren't being pulled
+
+    :param period: Datetime of the period
+    :param company_names: Names of the companies being pulled (as named in the Xero reports)
+    :return: List of row tuples with values in the order of utils.xero_connect.XERO_EXTRACT_COLUMNS
+    '''
+
+    session = db_sessionmaker()
+    xero_rows = session.query(*[getattr(TableXeroExtract, column)
+                                for column in utils.xero_connect.XERO_EXTRACT_COLUMNS])\
+        .filter(TableXeroExtract.Period == period)\
+        .filter(~TableXeroExtract.CompanyName.in_(company_names))\
+        .all()
+    session.close()
+
+    return [tuple(row) for row in xero_rows]
+
+def check_xero_validation_facts(year, month, facts):
+    ''' Checks the unassigned balances and the Balance Sheet of a period from validation facts held in memory, as
+        done from the stored validation facts before the Xero data is converted
+
+    :param year:
+    :param month:
+    :param facts: List of ((period, report name, company name, account code), [account name, total balance,
+                  unassigned balance]) items of the validation facts of the period
+    :return:
+    '''
+
+    period = datetime.datetime(year=year, month=month, day=1)
+
+    utils.data_integrity.check_unassigned_costcentres_is_nil(
+        year=year, month=month,
+        unassigned_rows=[(account_code, unassigned_value)
+                         for (fact_period, report_name, company_name, account_code),
+                             (account_name, value, unassigned_value) in facts
+                         if unassigned_value != 0])
+
+    utils.data_integrity.check_xero_balance_sheet_is_nil(
+        from_period=period, to_period=period,
+        fact_rows=[(fact_period, company_name, account_code, value)
+                   for (fact_period, report_name, company_name, account_code),
+                       (account_name, value, unassigned_value) in facts
+                   if report_name == r.XERO_DATA_BALANCESHEET])
+
+def run_actuals_pipeline(year, month, refresh=False, company_codes=None, engine=r.ALLOCATION_ENGINE_OBJECTS,
+                         audit_rows=False):
+    ''' Pulls a period of data from Xero and creates the converted Financial Statements (incl. the Cash Flow
+        Statement), the indirect cost allocations and the consolidated Financial Statements of the period, without
+        reading back the output of any stage from the database. Nothing is written unless every stage succeeds
+
+    :param year:
+    :param month:
+    :param refresh: If True, retrieve the data from the API rather than replaying it from the local Xero cache
+    :param company_codes: Company codes of the Xero organisations to pull (defaults to the only organisation). The
+                          Xero data of any other organisation already held in the database is included
+    :param engine: Allocation engine to use (see allocations.allocate_indirect_costs_to_rows)
+    :param audit_rows: If True, the transfer engine creates the rows of the costs allocated by each tier
+    :return: Dictionary of {table name: number of rows written}
+    '''
+
+    period = datetime.datetime(year=year, month=month, day=1)
+    prior_period = period - relativedelta(months=1)
+
+    # Check that the period exists and is valid (the Xero data itself is checked once it has been extracted), and
+    # that the opening balances of the cash flow calculations are available
+    utils.data_integrity.master_data_integrity_check_actuals(year=year, month=month,
+                                                             check_balance_sheet=False, check_unassigned_balances=False)
+    utils.data_integrity.check_period_exists(year=prior_period.year, month=prior_period.month)
+
+    # 1) Extract the Xero data of the organisations being pulled, alongside the data already held for the others
+    timestamp = datetime.datetime.now()
+    company_names, xero_rows, validation_facts = extract_xero_period_rows(
+        year=year, month=month, company_codes=company_codes if company_codes else [None], refresh=refresh,
+        timestamp=timestamp)
+
+    other_validation_facts = {}
+    other_xero_rows = list(utils.xero_connect.iter_xero_rows_recording_validation_facts(
+        rows=get_xero_extract_rows_of_other_companies(period=period, company_names=company_names),
+        facts=other_validation_facts))
+
+    check_xero_validation_facts(year=year, month=month,
+                                facts=validation_facts.items() + other_validation_facts.items())
+
+    # 2) Convert the Xero data to the master data
+    fin_statement_rows = data_import.convert_xero_rows_to_internal_rows(xero_rows=xero_rows + other_xero_rows,
+                                                                        timestamp=timestamp)
+    if not [row for row in fin_statement_rows if row.CostCentreCode is not None] \
+            or not [row for row in fin_statement_rows if row.CostCentreCode is None]:
+        raise error_objects.TableEmptyForPeriodError(
+            "No data returned from table {} for period {}.{}".format(r.TBL_DATA_EXTRACT_XERO, year, month))
+
+    # 3) Calculate the Cash Flow Statement from the movement on the Balance Sheet of the prior period
+    session = db_sessionmaker()
+    opening_rows = session.query(TableFinancialStatements)\
+        .filter(TableFinancialStatements.Period == prior_period)\
+        .all()
+    session.close()
+
+    cf_rows = create_internal_cashflow_statements_for_periods(periods=[(year, month)],
+                                                              data=opening_rows + fin_statement_rows)
+    for row in cf_rows:
+        row.TimeStamp = timestamp
+    fin_statement_rows += cf_rows
+
+    # 4) Allocate the indirect costs
+    unprocessed_costcentres = allocations.get_populated_costcentres_actuals(
+        year=year, month=month,
+        cost_rows=[(row.CostCentreCode, row.AccountCode, row.Value) for row in fin_statement_rows])
+    alloc_rows = allocations.allocate_indirect_costs_to_rows(unprocessed_costcentres=unprocessed_costcentres,
+                                                             upload_time=timestamp, engine=engine,
+                                                             audit_rows=audit_rows)
+
+    # 5) Consolidate the converted data and the allocated costs
+    row_counts = {}
+    consol_rows = list(data_import.create_consolidated_actuals_rows(
+        period=period, time_stamp=timestamp,
+        fin_statement_rows=[(row.CompanyCode, row.CostCentreCode, row.AccountCode, row.Value)
+                            for row in fin_statement_rows],
+        alloc_rows=[(row['SendingCompany'], row['ReceivingCompany'], row['SendingCostCentre'],
+                     row['ReceivingCostCentre'], row['GLAccount'], row['CostHierarchy'], row['Value'])
+                    for row in alloc_rows],
+        row_counts=row_counts))
+    consol_rows += create_headcount_rows_actuals(year=year, month=month, time_stamp=timestamp)
+
+    assert row_counts.get('cc'), "Query of financial statement (with costcentres) data produced no results"
+    assert row_counts.get('alloc'), "Allocation query produced no results"
+    assert row_counts.get('nocc'), "Query of financial statement data (no cost centres) produced no results"
+
+    # The old data of every stage is deleted and the new rows written in one transaction, so the period is left
+    # untouched if any write fails
+    written_row_counts = {}
+    session = db_sessionmaker.session_factory()
+    try:
+        utils.xero_connect.delete_xero_extract_rows(session=session, year=year, month=month,
+                                                    company_names=company_names)
+        written_row_counts[TableXeroExtract.__tablename__] = \
+            utils.xero_connect.insert_xero_extract_rows(session=session, rows=xero_rows)
+        utils.xero_validation.write_xero_validation_facts(session=session, facts=validation_facts, periods=[period],
+                                                          company_names=company_names)
+
+        for table, rows in [(TableFinancialStatements, fin_statement_rows),
+                            (TableAllocationsData, alloc_rows),
+                            (TableConsolidatedFinStatements, consol_rows)]:
+            utils.misc_functions.delete_table_data_for_period(table=table, year=year, month=month, session=session)
+            written_row_counts[table.__tablename__] = bulk_insert_rows(session=session, table=table, rows=rows)
+    except Exception:
+        session.rollback()
+        raise
+    else:
+        session.commit()
+    finally:
+        session.close()
+
+    return written_row_counts
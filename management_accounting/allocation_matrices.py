@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains an alternative engine for the indirect cost allocations. Each tier is represented as a matrix of the
+percentages each sender allocates to each receiver, and the costs allocated by the tier as a matrix of costs by
+receiving cost centre, rather than as a pair of Cost objects for every sender, receiver and cost.
+
+The allocations (and the rows created from them) are identical to those of
+allocations.allocate_indirect_cost_for_period.
+'''
+
+import numpy as np
+
+from customobjects.helper_objects import AllocatedCostMatrix
+import references as r
+
+
+def get_allocation_percentages(receiving_costcentres):
+    ''' Calculates the percentage of the costs of a tier allocated to each receiving cost centre based on FTE of
+        each receiving cost centre (see allocations.get_allocation_percentages_for_hierarchy_level)
+
+    :param receiving_costcentres: A list of CostCentre objects who are having costs allocated to them
+    :return: 1D numpy array, one value per receiving cost centre
+    '''
+
+    receiving_fte = [cc.fte() for cc in receiving_costcentres]
+
+    total_receiving_fte = 0
+    for fte in receiving_fte:
+        total_receiving_fte += fte
+
+    assert total_receiving_fte !=0
+
+    percentages = np.array(receiving_fte, dtype=np.float64) / total_receiving_fte
+
+    # Sense check that the sending cost centres are allocating 100% of their costs
+    total_alloc_percs = sum(percentages.tolist())
+    assert abs((total_alloc_percs - 1.0))<0.00000001,\
+        "Sum of allocation percentages {} is != 1.0:\n{}".format(total_alloc_percs, percentages)
+
+    return percentages
+
+def get_allocation_percentage_matrix(sender_costcentres, receiving_costcentres):
+    ''' Calculates the percentages each sender cost centre must allocate to each receiving cost centre (every sender
+        of a tier allocates the same percentages)
+
+    :param sender_costcentres: A list of CostCentre objects who are having their costs allocated from them
+    :param receiving_costcentres: A list of CostCentre objects who are having costs allocated to them
+    :return: 2D numpy array, one row per sender cost centre and one column per receiving cost centre
+    '''
+
+    percentages = get_allocation_percentages(receiving_costcentres=receiving_costcentres)
+    return np.tile(percentages, (len(sender_costcentres), 1))
+
+def allocate_costs_for_tier(sender_costcentres, receiving_costcentres, previously_allocated_costs, level):
+    ''' For a given allocation tier, allocates the direct costs of the sender cost centres and the costs allocated to
+        them by the tier below, to the receiving cost centres
+
+    :param sender_costcentres: A list of CostCentre objects who are having their costs allocated from them
+    :param receiving_costcentres: A list of CostCentre objects who are having costs allocated to them
+    :param previously_allocated_costs: AllocatedCostMatrix of the costs allocated at the hierarchy level of the
+                                       sender cost centres (None if no costs were allocated at that level)
+    :param level: The hierarchy level of the sender cost centres
+    :return: AllocatedCostMatrix of the costs allocated by the tier
+    '''
+
+    percentages = get_allocation_percentage_matrix(sender_costcentres=sender_costcentres,
+                                                   receiving_costcentres=receiving_costcentres)
+    sender_codes = [cc.master_code for cc in sender_costcentres]
+
+    # The direct costs of the sender cost centres
+    direct_costs = [(sender_idx, cost) for sender_idx, cc in enumerate(sender_costcentres)
+                    for cost in cc.direct_costs if cost.amount != 0]
+    cost_sender_idx = [sender_idx for sender_idx, cost in direct_costs]
+    amounts = [float(cost.amount) for sender_idx, cost in direct_costs]
+    ledger_codes = [cost.allocation_account_code for sender_idx, cost in direct_costs]
+    periods = [cost.period for sender_idx, cost in direct_costs]
+
+    # Costs allocated to the sender cost centres by the previous allocation cycle are allocated onwards, so that the
+    # sender cost centres are still net nil
+    if previously_allocated_costs is not None:
+        sender_index = dict((code, sender_idx) for sender_idx, code in enumerate(sender_codes))
+        columns = [receiver_idx for receiver_idx, code in enumerate(previously_allocated_costs.receiver_codes)
+                   if code in sender_index]
+        received_costs = previously_allocated_costs.values[:, columns]
+        cost_idx, column_idx = np.nonzero(received_costs)
+
+        cost_sender_idx += [sender_index[previously_allocated_costs.receiver_codes[columns[column]]]
+                            for column in column_idx.tolist()]
+        amounts += received_costs[cost_idx, column_idx].tolist()
+        ledger_codes += previously_allocated_costs.ledger_codes[cost_idx].tolist()
+        periods += previously_allocated_costs.periods[cost_idx].tolist()
+
+    cost_sender_idx = np.array(cost_sender_idx, dtype=np.int64)
+    values = np.array(amounts, dtype=np.float64).reshape(-1, 1) * percentages[cost_sender_idx, :]
+
+    # Check that the direct costs are completely allocated, so that the whole process is net-flat at a company level
+    allocated_direct_costs = np.bincount(cost_sender_idx[:len(direct_costs)],
+                                         weights=values[:len(direct_costs)].sum(axis=1),
+                                         minlength=len(sender_costcentres))
+    for cc, allocated_cost in zip(sender_costcentres, allocated_direct_costs.tolist()):
+        total_direct_costs = sum([cost.amount for cost in cc.direct_costs])
+        assert abs(float(total_direct_costs)-allocated_cost)<r.DEFAULT_MAX_CALC_ERROR, \
+            "Total direct costs {} not equal allocated costs {} for cc \n{}".format(total_direct_costs,
+                                                                                   allocated_cost * -1.0, cc)
+
+    return AllocatedCostMatrix(values=values,
+                               sender_codes=np.array([sender_codes[sender_idx] for sender_idx in cost_sender_idx],
+                                                     dtype=object),
+                               ledger_codes=np.array(ledger_codes, dtype=object),
+                               periods=np.array(periods, dtype=object),
+                               receiver_codes=np.array([cc.master_code for cc in receiving_costcentres], dtype=object),
+                               cost_hierarchy=level - 1)  # Matches the level the costs will be reported against
+
+def allocate_indirect_cost_for_period(unprocessed_costcentres):
+    ''' Calculates the indirect cost allocations based on headcount, allocating the tiers in the same order as
+        allocations.allocate_indirect_cost_for_period
+
+    :param unprocessed_costcentres: A list of CostCentre objects, populated with headcount and direct cost information
+    :return: List of AllocatedCostMatrix objects, one per tier in the order the tiers are allocated
+    '''
+
+    allocated_cost_matrices = []
+    allocated_costs_by_hierarchy = {}
+
+    # L1 is excluded as this is the final destination for all allocated costs
+    hierarchy_levels = list(set([cc.hierarchy_tier for cc in unprocessed_costcentres if cc.hierarchy_tier != 1]))
+    hierarchy_levels.sort()
+
+    while hierarchy_levels: # Iterate through all the hierarchy levels from the highest number upwards
+        hierarchy_level = hierarchy_levels.pop()
+
+        sender_costcentres = [cc for cc in unprocessed_costcentres if cc.hierarchy_tier == hierarchy_level]
+        receiving_costcentres = [cc for cc in unprocessed_costcentres if cc.hierarchy_tier < hierarchy_level]
+
+        allocated_costs = allocate_costs_for_tier(
+            sender_costcentres=sender_costcentres,
+            receiving_costcentres=receiving_costcentres,
+            previously_allocated_costs=allocated_costs_by_hierarchy.get(hierarchy_level),
+            level=hierarchy_level)
+
+        allocated_cost_matrices.append(allocated_costs)
+        allocated_costs_by_hierarchy[allocated_costs.cost_hierarchy] = allocated_costs
+        unprocessed_costcentres = receiving_costcentres[:]
+
+    return allocated_cost_matrices
+
+def create_allocated_costs_rows(allocated_cost_matrices, upload_time, label=None):
+    ''' Creates the rows of the allocated costs table from the costs allocated by each tier. Each allocated cost is
+        recorded as received by the receiving cost centre, and reversed in the sending cost centre
+
+    :param allocated_cost_matrices: List of AllocatedCostMatrix objects
+    :param upload_time: Time recorded as the DateAllocationsRun of the rows
+    :param label: Label of the Budget data the costs are allocated for (None for Actuals)
+    :return: List of dictionaries of {column name: value} of TableAllocationsData (or TableBudgetAllocationsData)
+    '''
+
+    rows = []
+    for allocated_costs in allocated_cost_matrices:
+        for sender_code, receiver_code, ledger_code, period, value in allocated_costs.iter_nonzero():
+            for sending_code, receiving_code, amount in [(sender_code, receiver_code, value),
+                                                         (receiver_code, sender_code, value * -1.0)]:
+                row = dict(
+                    DateAllocationsRun = upload_time,
+                    SendingCostCentre = sending_code,
+                    ReceivingCostCentre = receiving_code,
+                    SendingCompany = r.COMPANY_CODE_MAINCO, # ToDo: Refactor to make this dynamic
+                    ReceivingCompany = r.COMPANY_CODE_MAINCO, # ToDo: Refactor to make this dynamic
+                    Period = period,
+                    GLAccount = ledger_code,
+                    CostHierarchy = allocated_costs.cost_hierarchy,
+                    Value = round(amount,3)    # Rounded as database field is configured as decimal
+                    )
+                if label is not None:
+                    row['Label'] = label
+                rows.append(row)
+
+    return rows
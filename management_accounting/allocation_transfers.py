@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains a closed-form engine for the indirect cost allocations. The allocation percentages of every tier are
+composed into a single transfer matrix of the share of the direct costs of each cost centre that is borne by each
+cost centre once every tier has been allocated, so the final indirect costs of every cost centre are calculated in
+one product rather than by allocating the costs onwards one tier at a time.
+
+The costs are allocated by the same rules as allocations.allocate_indirect_cost_for_period: a tier allocates onwards
+only the costs allocated to it at its own hierarchy level (i.e. by the tier immediately above it), and any other
+costs it receives are borne by the tier itself.
+'''
+
+import numpy as np
+
+from customobjects.helper_objects import AllocatedCostMatrix
+from management_accounting import allocation_matrices
+import references as r
+
+
+def get_hierarchy_levels(costcentres):
+    ''' Returns the hierarchy levels that allocate their costs, in the order they are allocated
+
+    :param costcentres: A list of CostCentre objects
+    :return: List of hierarchy levels, from the highest number downwards (L1 is excluded as this is the final
+             destination for all allocated costs)
+    '''
+
+    hierarchy_levels = list(set([cc.hierarchy_tier for cc in costcentres if cc.hierarchy_tier != 1]))
+    hierarchy_levels.sort(reverse=True)
+
+    return hierarchy_levels
+
+def get_allocation_transfer_matrix(costcentres):
+    ''' Composes the allocation percentages of every tier into a transfer matrix of the share of the direct costs of
+        each cost centre that is borne by each cost centre once every tier has been allocated
+
+    :param costcentres: A list of CostCentre objects, populated with headcount information
+    :return: 2D numpy array, one row per cost centre bearing the costs and one column per cost centre allocating its
+             direct costs (both in the order of costcentres). The columns of L1 cost centres are nil
+    '''
+
+    tiers = np.array([cc.hierarchy_tier for cc in costcentres])
+    transfer = np.zeros((len(costcentres), len(costcentres)), dtype=np.float64)
+
+    previous_level = None
+    for hierarchy_level in get_hierarchy_levels(costcentres=costcentres):
+        is_sender = tiers == hierarchy_level
+        is_receiver = tiers < hierarchy_level
+
+        percentages = np.zeros(len(costcentres), dtype=np.float64)
+        percentages[is_receiver] = allocation_matrices.get_allocation_percentages(
+            receiving_costcentres=[cc for cc, receiver in zip(costcentres, is_receiver.tolist()) if receiver])
+
+        # The share of the direct costs of each cost centre allocated by the tier: its own direct costs, plus the
+        # costs allocated to it by the previous tier, which are only allocated onwards if they were allocated at the
+        # hierarchy level of the tier
+        allocated_shares = is_sender.astype(np.float64)
+        if previous_level == hierarchy_level + 1:
+            allocated_shares += previous_percentages[is_sender].sum() * previous_allocated_shares
+
+        # The costs are borne by the receiving cost centres, unless they are allocated onwards by the next tier
+        is_allocated_onwards = (tiers == hierarchy_level - 1) & (hierarchy_level - 1 != 1)
+        transfer += np.outer(np.where(is_allocated_onwards, 0.0, percentages), allocated_shares)
+
+        previous_level = hierarchy_level
+        previous_percentages = percentages
+        previous_allocated_shares = allocated_shares
+
+    # Sense check that every cost centre below L1 has all of its direct costs borne by other cost centres
+    for cc, total_transfer_percs in zip(costcentres, transfer.sum(axis=0).tolist()):
+        expected_transfer_percs = 0.0 if cc.hierarchy_tier == 1 else 1.0
+        assert abs(total_transfer_percs - expected_transfer_percs)<0.00000001, \
+            "Sum of transfer percentages {} is != {} for cc \n{}".format(total_transfer_percs,
+                                                                         expected_transfer_percs, cc)
+
+    return transfer
+
+def get_direct_cost_matrix(costcentres):
+    ''' Returns the direct costs of cost centres as a matrix of costs by allocation account and period
+
+    :param costcentres: A list of CostCentre objects, populated with direct cost information
+    :return: Tuple of (2D numpy array, one row per cost centre in the order of costcentres and one column per cost
+             column, list of (ledger code, period) tuples of each column)
+    '''
+
+    cost_columns = sorted(set([(cost.allocation_account_code, cost.period)
+                               for cc in costcentres for cost in cc.direct_costs]))
+    column_index = dict((cost_column, column_idx) for column_idx, cost_column in enumerate(cost_columns))
+
+    direct_costs = np.zeros((len(costcentres), len(cost_columns)), dtype=np.float64)
+    for cc_idx, cc in enumerate(costcentres):
+        for cost in cc.direct_costs:
+            direct_costs[cc_idx, column_index[(cost.allocation_account_code, cost.period)]] += float(cost.amount)
+
+    return direct_costs, cost_columns
+
+def get_allocated_cost_totals(costcentres, transfer=None):
+    ''' Calculates the net indirect costs of every cost centre once every tier has been allocated, in a single
+        product of the transfer matrix and the direct costs. For L1 cost centres this is the total of the costs
+        allocated to them, and for other cost centres it is their direct costs reversed, less any costs they bear
+
+    :param costcentres: A list of CostCentre objects, populated with headcount and direct cost information
+    :param transfer: Transfer matrix of the cost centres (calculated if not provided)
+    :return: Tuple of (2D numpy array, one row per cost centre in the order of costcentres and one column per cost
+             column, list of (ledger code, period) tuples of each column)
+    '''
+
+    if transfer is None:
+        transfer = get_allocation_transfer_matrix(costcentres=costcentres)
+
+    direct_costs, cost_columns = get_direct_cost_matrix(costcentres=costcentres)
+    direct_costs[[cc.hierarchy_tier == 1 for cc in costcentres], :] = 0.0   # L1 direct costs aren't allocated
+
+    return transfer.dot(direct_costs) - direct_costs, cost_columns
+
+def get_allocated_cost_matrix_totals(allocated_cost_matrices, costcentres, cost_columns):
+    ''' Totals the net indirect costs of every cost centre from the costs allocated by each tier
+
+    :param allocated_cost_matrices: List of AllocatedCostMatrix objects
+    :param costcentres: A list of CostCentre objects
+    :param cost_columns: List of (ledger code, period) tuples of the columns of the totals
+    :return: 2D numpy array, one row per cost centre in the order of costcentres and one column per cost column
+    '''
+
+    cc_index = dict((cc.master_code, cc_idx) for cc_idx, cc in enumerate(costcentres))
+    column_index = dict((cost_column, column_idx) for column_idx, cost_column in enumerate(cost_columns))
+
+    totals = np.zeros((len(costcentres), len(cost_columns)), dtype=np.float64)
+    for allocated_costs in allocated_cost_matrices:
+        sender_idx = np.array([cc_index[code] for code in allocated_costs.sender_codes], dtype=np.int64)
+        receiver_idx = np.array([cc_index[code] for code in allocated_costs.receiver_codes], dtype=np.int64)
+        cost_column_idx = np.array([column_index[cost_column] for cost_column
+                                    in zip(allocated_costs.ledger_codes, allocated_costs.periods)], dtype=np.int64)
+
+        # Each cost is received by the receiving cost centres and reversed in the sending cost centre
+        np.add.at(totals, (receiver_idx.reshape(1, -1), cost_column_idx.reshape(-1, 1)), allocated_costs.values)
+        np.add.at(totals, (sender_idx, cost_column_idx), allocated_costs.values.sum(axis=1) * -1.0)
+
+    return totals
+
+def allocate_indirect_cost_for_period(unprocessed_costcentres):
+    ''' Allocates the direct costs of each cost centre directly to the cost centres that bear them once every tier
+        has been allocated, without allocating them via the tiers in between
+
+    :param unprocessed_costcentres: A list of CostCentre objects, populated with headcount and direct cost information
+    :return: List of AllocatedCostMatrix objects, one per tier in the order the tiers are allocated, of the direct
+             costs of the tier allocated to the cost centres that bear them
+    '''
+
+    transfer = get_allocation_transfer_matrix(costcentres=unprocessed_costcentres)
+
+    # Only the cost centres that bear some of the costs are included as receivers
+    receiver_idx = np.nonzero(transfer.any(axis=1))[0]
+    receiver_codes = np.array([unprocessed_costcentres[cc_idx].master_code for cc_idx in receiver_idx.tolist()],
+                              dtype=object)
+
+    allocated_cost_matrices = []
+    for hierarchy_level in get_hierarchy_levels(costcentres=unprocessed_costcentres):
+        direct_costs = [(cc_idx, cost) for cc_idx, cc in enumerate(unprocessed_costcentres)
+                        if cc.hierarchy_tier == hierarchy_level
+                        for cost in cc.direct_costs if cost.amount != 0]
+        cost_sender_idx = np.array([cc_idx for cc_idx, cost in direct_costs], dtype=np.int64)
+        amounts = np.array([float(cost.amount) for cc_idx, cost in direct_costs], dtype=np.float64)
+
+        values = amounts.reshape(-1, 1) * transfer[np.ix_(receiver_idx, cost_sender_idx)].T
+
+        allocated_cost_matrices.append(AllocatedCostMatrix(
+            values=values,
+            sender_codes=np.array([unprocessed_costcentres[cc_idx].master_code for cc_idx, cost in direct_costs],
+                                  dtype=object),
+            ledger_codes=np.array([cost.allocation_account_code for cc_idx, cost in direct_costs], dtype=object),
+            periods=np.array([cost.period for cc_idx, cost in direct_costs], dtype=object),
+            receiver_codes=receiver_codes,
+            cost_hierarchy=hierarchy_level - 1))    # Matches the level the tier's costs are first reported against
+
+    return allocated_cost_matrices
+
+def allocate_indirect_cost_for_period_by_tier(unprocessed_costcentres):
+    ''' Calculates the indirect cost allocations of each tier (see allocation_matrices.allocate_indirect_cost_for_period),
+        checking that they reconcile to the indirect costs calculated from the transfer matrix
+
+    :param unprocessed_costcentres: A list of CostCentre objects, populated with headcount and direct cost information
+    :return: List of AllocatedCostMatrix objects, one per tier in the order the tiers are allocated
+    '''
+
+    allocated_cost_totals, cost_columns = get_allocated_cost_totals(costcentres=unprocessed_costcentres)
+
+    allocated_cost_matrices = allocation_matrices.allocate_indirect_cost_for_period(
+        unprocessed_costcentres=unprocessed_costcentres)
+    allocated_cost_matrix_totals = get_allocated_cost_matrix_totals(allocated_cost_matrices=allocated_cost_matrices,
+                                                                    costcentres=unprocessed_costcentres,
+                                                                    cost_columns=cost_columns)
+
+    max_difference = np.abs(allocated_cost_totals - allocated_cost_matrix_totals).max() \
+        if allocated_cost_totals.size else 0.0
+    assert max_difference<r.DEFAULT_MAX_CALC_ERROR, \
+        "Allocations of each tier differ from the transfer matrix allocations by up to {}".format(max_difference)
+
+    return allocated_cost_matrices
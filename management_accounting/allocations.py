@@ -12,19 +12,19 @@ import datetime
 from sqlalchemy import or_
 
 from customobjects.database_objects import \
-    TableCostCentres, \
     TableFinancialStatements, \
-    TableChartOfAccounts, \
-    TableAllocationAccounts, \
     TableAllocationsData, \
     TableHeadcount,\
-    TableNodeHierarchy, \
     TableFinModelExtract, \
     TableBudgetAllocationsData
 from customobjects.helper_objects import CostCentre, Employee, Cost
+from management_accounting import allocation_matrices, allocation_transfers
 import references as r
+from utils.db_bulk_write import bulk_insert_rows
 from utils.db_connect import db_sessionmaker
+import utils.db_staging
 import utils.data_integrity
+import utils.master_data
 import utils.misc_functions
 
 
@@ -36,12 +36,10 @@ def get_all_cost_centres_from_database():
     :return:
     '''
 
-    session = db_sessionmaker()
-    qry_costcentres = session.query(TableCostCentres).all()
-    session.close()
+    master_data = utils.master_data.get_master_data_snapshot()
 
     list_of_costcentres = []
-    for row in qry_costcentres:
+    for row in sorted(master_data.cost_centres.values(), key=lambda row: row.ID):
         cc = CostCentre()
         cc.master_name = row.CostCentreName
         cc.master_code = row.CostCentreCode
@@ -52,6 +50,46 @@ def get_all_cost_centres_from_database():
 
     return list_of_costcentres
 
+def create_direct_costs_by_cc_by_node(period, cost_rows):
+    ''' Totals direct costs by cost centre and L2 hierarchy level, for the accounts whose costs are allocated
+
+    :param period:
+    :param cost_rows: List of (cost centre code, GL code, value) tuples
+    :return: Dictionary of {cost centre code: list of Cost objects}
+    '''
+
+    master_data = utils.master_data.get_master_data_snapshot()
+
+    # Total the costs by cost centre and L2 node, mapped to the GL account each L2 node is allocated through
+    cost_totals = {}
+    list_of_costcategories = set()
+    for cost_centre_code, gl_code, value in cost_rows:
+        alloc = master_data.get_allocation_account(gl_code)
+        if alloc is None:
+            continue
+        costcategory = (alloc.L2Hierarchy, alloc.GLCode)
+        list_of_costcategories.add(costcategory)
+        cost_totals[(cost_centre_code, costcategory)] = cost_totals.get((cost_centre_code, costcategory), 0) + value
+
+    if not cost_totals:
+        return {}
+
+    # Create cost objects for each cost centre for each hierarchy node
+    output_dict = {}
+    for cc in set([cost_centre_code for cost_centre_code, costcategory in cost_totals]): # e.g. C000001, C000002, etc
+        list_of_costs = []
+        for costcategory in list_of_costcategories: # e.g. L2-FIN, L2-STAFF, etc
+            cost = Cost()
+            cost.period = period
+            cost.master_code = costcategory[0]
+            cost.allocation_account_code = costcategory[1]
+            cost.amount = cost_totals.get((cc, costcategory), 0)
+            if abs(cost.amount) > r.DEFAULT_MAX_CALC_ERROR:    # Filter out near-zero costs to reduce number of records up-stream
+                list_of_costs.append(cost)
+        output_dict[cc]=list_of_costs
+
+    return output_dict
+
 ### Actuals Data
 
 def get_all_actuals_employees_from_database(year, month):
@@ -92,58 +130,44 @@ def get_all_actuals_employees_from_database(year, month):
 
     return list_of_employees
 
-def get_direct_costs_actuals_by_cc_by_node(year, month):
+def get_direct_costs_actuals_by_cc_by_node(year, month, cost_rows=None):
     ''' Get the direct costs (actuals) split by cost centre and L2 hierarchy level for a given period
 
     :param year:
     :param month:
+    :param cost_rows: List of (cost centre code, GL code, value) tuples of the converted data of the period, if
+                      already held in memory (read from the database if not given)
     :return:
     '''
 
-    session = db_sessionmaker()
     period = datetime.datetime(year=year, month=month, day=1)
-    qry_costs = session.query(TableFinancialStatements, TableChartOfAccounts, TableNodeHierarchy, TableAllocationAccounts)\
-        .filter(TableFinancialStatements.AccountCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code == TableNodeHierarchy.L3Code)\
-        .filter(TableNodeHierarchy.L2Code == TableAllocationAccounts.L2Hierarchy)\
-        .filter(TableFinancialStatements.Period == period)\
-        .all()
-    session.close()
-
-    assert qry_costs != [], "Query in get_direct_costs_actuals_by_cc_by_node returned no results for period {}.{}".format(year, month)
-    output_dict = {}
-    # Get all cost centres in the extracted data
-    list_of_costcentres = list(set([pnl.CostCentreCode for pnl, coa, node, alloc in qry_costs]))
-    # Get all cost categories in the extracted data
-    list_of_costcategories = list(set([(node.L2Code, alloc.GLCode) for pnl, coa, node, alloc in qry_costs]))
-
-    # Create cost objects for each cost centre for each hierarchy node
-    output_dict = {}
-    for cc in list_of_costcentres: # e.g. C000001, C000002, etc
-        list_of_costs = []
-        for costcategory in list_of_costcategories: # e.g. L2-FIN, L2-STAFF, etc
-            cost = Cost()
-            cost.period = period
-            cost.master_code = costcategory[0]
-            cost.allocation_account_code = costcategory[1]
-            cost.amount = sum([pnl.Value for pnl, coa, node, alloc in qry_costs if pnl.CostCentreCode == cc and node.L2Code == costcategory[0]])
-            if abs(cost.amount) > r.DEFAULT_MAX_CALC_ERROR:    # Filter out near-zero costs to reduce number of records up-stream
-                list_of_costs.append(cost)
-        output_dict[cc]=list_of_costs
+    if cost_rows is None:
+        session = db_sessionmaker()
+        cost_rows = session.query(TableFinancialStatements.CostCentreCode,
+                                  TableFinancialStatements.AccountCode,
+                                  TableFinancialStatements.Value)\
+            .filter(TableFinancialStatements.Period == period)\
+            .all()
+        session.close()
+
+    output_dict = create_direct_costs_by_cc_by_node(period=period, cost_rows=cost_rows)
+    assert output_dict != {}, "Query in get_direct_costs_actuals_by_cc_by_node returned no results for period {}.{}".format(year, month)
 
     return output_dict
 
-def get_populated_costcentres_actuals(year=None, month=None):
+def get_populated_costcentres_actuals(year=None, month=None, cost_rows=None):
     ''' Returns a list of cost centres populated with actuals direct costs and employees in each cost centre
 
     :param year:
     :param month:
+    :param cost_rows: List of (cost centre code, GL code, value) tuples of the converted data of the period, if
+                      already held in memory
     :return:
     '''
 
     list_of_costcentres = get_all_cost_centres_from_database()
     list_of_employees = get_all_actuals_employees_from_database(year=year, month=month)
-    direct_costs_for_period = get_direct_costs_actuals_by_cc_by_node(year=year, month=month)
+    direct_costs_for_period = get_direct_costs_actuals_by_cc_by_node(year=year, month=month, cost_rows=cost_rows)
 
     for cc in list_of_costcentres:
         cc.employees = [emp for emp in list_of_employees if emp.cost_centre==cc.master_code]
@@ -224,35 +248,18 @@ def get_direct_costs_budget_by_cc_by_node(year, month, label):
     period = datetime.datetime(year=year, month=month, day=1)
 
     session = db_sessionmaker()
-    qry_costs = session.query(TableFinModelExtract, TableChartOfAccounts, TableNodeHierarchy, TableAllocationAccounts)\
-        .filter(TableFinModelExtract.GLCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code == TableNodeHierarchy.L3Code)\
-        .filter(TableNodeHierarchy.L2Code == TableAllocationAccounts.L2Hierarchy)\
+    qry_costs = session.query(TableFinModelExtract.CostCentreCode,
+                              TableFinModelExtract.GLCode,
+                              TableFinModelExtract.Value)\
         .filter(TableFinModelExtract.Period == period)\
         .filter(TableFinModelExtract.Label == label)\
         .all()
     session.close()
 
-    assert qry_costs != [], "Query in get_direct_costs_budget_by_cc_by_node for {} returned no results for period {}.{}"\
+    output_dict = create_direct_costs_by_cc_by_node(period=period, cost_rows=qry_costs)
+    assert output_dict != {}, "Query in get_direct_costs_budget_by_cc_by_node for {} returned no results for period {}.{}"\
         .format(label,year, month)
 
-    list_of_costcentres = list(set([fin.CostCentreCode for fin, coa, node, alloc in qry_costs]))
-    list_of_costcategories = list(set([(node.L2Code, alloc.GLCode) for fin, coa, node, alloc in qry_costs]))
-
-    # Create cost objects for each cost centre for each hierarchy node
-    output_dict = {}
-    for cc in list_of_costcentres: # e.g. C000001, C000002, etc
-        list_of_costs = []
-        for costcategory in list_of_costcategories: # e.g. L2-FIN, L2-STAFF, etc
-            cost = Cost()
-            cost.period = period
-            cost.master_code = costcategory[0]
-            cost.allocation_account_code = costcategory[1]
-            cost.amount = sum([pnl.Value for pnl, coa, node, alloc in qry_costs if pnl.CostCentreCode == cc and node.L2Code == costcategory[0]])
-            if abs(cost.amount) > r.DEFAULT_MAX_CALC_ERROR:    # Filter out near-zero costs to reduce number of records up-stream
-                list_of_costs.append(cost)
-        output_dict[cc]=list_of_costs
-
     return output_dict
 
 def get_populated_costcentres_budget(year, month, label):
@@ -476,21 +483,20 @@ def allocate_indirect_cost_for_period(unprocessed_costcentres):
 
 ### Data Upload
 
-def upload_allocated_costs_actuals(costcentres):
-    '''
+def create_allocated_costs_rows(costcentres, upload_time, label=None):
+    ''' Creates the rows of the allocated costs table from the allocations of the cost centres
 
     :param costcentres: Cost centre objects populated with direct costs and indirect cost allocations
-    :return:
+    :param upload_time: Time recorded as the DateAllocationsRun of the rows
+    :param label: Label of the Budget data the costs are allocated for (None for Actuals)
+    :return: List of dictionaries of {column name: value} of TableAllocationsData (or TableBudgetAllocationsData)
     '''
 
-    upload_time = datetime.datetime.now()   # Create timestamp
-
-    session = db_sessionmaker()
-
+    rows = []
     for cc in costcentres:
         for cost in cc.allocated_costs:
 
-            row = TableAllocationsData(
+            row = dict(
                                         DateAllocationsRun = upload_time,
                                         SendingCostCentre = cost.counterparty_costcentre,
                                         ReceivingCostCentre = cc.master_code,
@@ -501,49 +507,57 @@ def upload_allocated_costs_actuals(costcentres):
                                         CostHierarchy = cost.cost_hierarchy,
                                         Value = round(cost.amount,3)    # Rounded as database field is configured as decimal
                                         )
-            session.add(row)
+            if label is not None:
+                row['Label'] = label
+            rows.append(row)
 
-    session.commit()
-    session.close()
+    return rows
 
-def upload_allocated_costs_budget(costcentres, label):
-    '''
+def allocate_indirect_costs_to_rows(unprocessed_costcentres, upload_time, engine=r.ALLOCATION_ENGINE_OBJECTS,
+                                    label=None, audit_rows=False):
+    ''' Calculates the indirect cost allocations of a period with any of the allocation engines, and creates the rows
+        of the allocated costs table from them
 
-    :param costcentres: Cost centre objects populated with direct costs and indirect cost allocations
-    :return:
+    :param unprocessed_costcentres: A list of CostCentre objects, populated with headcount and direct cost information
+    :param upload_time: Time recorded as the DateAllocationsRun of the rows
+    :param engine: r.ALLOCATION_ENGINE_OBJECTS to allocate each cost as Cost objects, r.ALLOCATION_ENGINE_MATRIX
+                   to allocate the costs of each tier as a matrix (both create identical rows), or
+                   r.ALLOCATION_ENGINE_TRANSFER to allocate the direct costs of each cost centre directly to the cost
+                   centres that bear them
+    :param label: Label of the Budget data the costs are allocated for (None for Actuals)
+    :param audit_rows: If True, the transfer engine creates the rows of the costs allocated by each tier (identical
+                       to the other engines) rather than the rows of the costs allocated directly
+    :return: List of dictionaries of {column name: value} of TableAllocationsData (or TableBudgetAllocationsData)
     '''
 
-    upload_time = datetime.datetime.now()   # Create timestamp
-
-    session = db_sessionmaker()
-
-    for cc in costcentres:
-        for cost in cc.allocated_costs:
+    if engine == r.ALLOCATION_ENGINE_TRANSFER:
+        if audit_rows:
+            allocated_cost_matrices = allocation_transfers.allocate_indirect_cost_for_period_by_tier(
+                unprocessed_costcentres=unprocessed_costcentres)
+        else:
+            allocated_cost_matrices = allocation_transfers.allocate_indirect_cost_for_period(
+                unprocessed_costcentres=unprocessed_costcentres)
+        return allocation_matrices.create_allocated_costs_rows(allocated_cost_matrices=allocated_cost_matrices,
+                                                               upload_time=upload_time, label=label)
 
-            row = TableBudgetAllocationsData(
-                                        DateAllocationsRun = upload_time,
-                                        SendingCostCentre = cost.counterparty_costcentre,
-                                        ReceivingCostCentre = cc.master_code,
-                                        SendingCompany = r.COMPANY_CODE_MAINCO, # ToDo: Refactor to make this dynamic
-                                        ReceivingCompany = r.COMPANY_CODE_MAINCO, # ToDo: Refactor to make this dynamic
-                                        Period = cost.period,
-                                        GLAccount = cost.ledger_account_code,
-                                        CostHierarchy = cost.cost_hierarchy,
-                                        Value = round(cost.amount,3),    # Rounded as database field is configured as decimal
-                                        Label = label
-                                        )
-            session.add(row)
+    if engine == r.ALLOCATION_ENGINE_MATRIX:
+        allocated_cost_matrices = allocation_matrices.allocate_indirect_cost_for_period(
+            unprocessed_costcentres=unprocessed_costcentres)
+        return allocation_matrices.create_allocated_costs_rows(allocated_cost_matrices=allocated_cost_matrices,
+                                                               upload_time=upload_time, label=label)
 
-    session.commit()
-    session.close()
+    processed_costcentres = allocate_indirect_cost_for_period(unprocessed_costcentres=unprocessed_costcentres)
+    return create_allocated_costs_rows(costcentres=processed_costcentres, upload_time=upload_time, label=label)
 
 ### Main Allocation Functions
 
-def allocate_actuals_data(year, month):
+def allocate_actuals_data(year, month, engine=r.ALLOCATION_ENGINE_OBJECTS, audit_rows=False):
     ''' Allocated direct costs based on headcount for a given period and uploads the results to the database
 
     :param year:
     :param month:
+    :param engine: Allocation engine to use (see allocate_indirect_costs_to_rows)
+    :param audit_rows: If True, the transfer engine creates the rows of the costs allocated by each tier
     :return:
     '''
 
@@ -554,10 +568,12 @@ def allocate_actuals_data(year, month):
     # Get a list of cost centres populated with headcount and costs per hierarchy level
     unprocessed_costcentres = get_populated_costcentres_actuals(year=year, month=month)
 
-    processed_costcentres = allocate_indirect_cost_for_period(unprocessed_costcentres=unprocessed_costcentres)
+    upload_time = datetime.datetime.now()   # Create timestamp
+    rows = allocate_indirect_costs_to_rows(unprocessed_costcentres=unprocessed_costcentres, upload_time=upload_time,
+                                           engine=engine, audit_rows=audit_rows)
 
-    utils.misc_functions.delete_table_data_for_period(table=TableAllocationsData, year=year, month=month)
-    upload_allocated_costs_actuals(costcentres=processed_costcentres)
+    # The allocated costs of the period are replaced with the new rows
+    utils.db_staging.replace_period_rows(table=TableAllocationsData, year=year, month=month, rows=rows)
 
 def allocation_date_check(test_year, test_month, max_year, max_month):
     '''
@@ -573,25 +589,29 @@ def allocation_date_check(test_year, test_month, max_year, max_month):
     current_date = datetime.datetime(year=test_year, month=test_month, day=1)
     return current_date<=date_limit
 
-def allocate_budget_data(label, max_year=9999, max_month=13):
+def allocate_budget_data(label, max_year=9999, max_month=13, engine=r.ALLOCATION_ENGINE_OBJECTS, audit_rows=False):
     ''' Creates cost allocation data for budget data for a certain budget dataset
 
     :param label: The tag given to the budget dataset
+    :param engine: Allocation engine to use (see allocate_indirect_costs_to_rows)
+    :param audit_rows: If True, the transfer engine creates the rows of the costs allocated by each tier
     :return:
     '''
     utils.data_integrity.master_data_integrity_check_budget()
 
     # Get a list of all periods in the Budget data in the format (year, month)
     all_periods = get_all_budget_periods(label=label)
-    all_processed_costcentres = []
+    upload_time = datetime.datetime.now()   # Create timestamp
+    rows = []
 
     for year, month in all_periods:
         # To prevent large volumes of unnecessary data being generated, the period over which allocations
         # are run can be limited by the user
         if allocation_date_check(max_year=max_year,max_month=max_month,test_year=year, test_month=month):
             unprocessed_costcentres = get_populated_costcentres_budget(year=year, month=month, label=label)
-            processed_costcentres = allocate_indirect_cost_for_period(unprocessed_costcentres=unprocessed_costcentres)
-            all_processed_costcentres += processed_costcentres
+            rows += allocate_indirect_costs_to_rows(unprocessed_costcentres=unprocessed_costcentres,
+                                                    upload_time=upload_time, engine=engine, label=label,
+                                                    audit_rows=audit_rows)
         else:
             break
     # Delete previously allocated data (for the relevant period only)
@@ -603,4 +623,7 @@ def allocate_budget_data(label, max_year=9999, max_month=13):
     session.close()
 
     # Upload new data
-    upload_allocated_costs_budget(costcentres=all_processed_costcentres, label=label)
+    session = db_sessionmaker()
+    bulk_insert_rows(session=session, table=TableBudgetAllocationsData, rows=rows)
+    session.commit()
+    session.close()
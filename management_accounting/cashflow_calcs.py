@@ -11,10 +11,9 @@ from dateutil.relativedelta import relativedelta
 from customobjects import error_objects
 from customobjects.database_objects import \
     TableFinancialStatements, \
-    TableChartOfAccounts, \
-    TableNodeHierarchy, \
     TableConsolidatedFinStatements
 import utils.data_integrity
+import utils.master_data
 from utils.db_connect import db_sessionmaker
 import utils.misc_functions
 import references as r
@@ -178,18 +177,68 @@ def create_internal_cashflow_statement(year, month):
     # Get all Income Statement and Balance Sheet rows split by L0 and L1 node
     session = db_sessionmaker()
 
-    data = session.query(TableFinancialStatements, TableChartOfAccounts, TableNodeHierarchy)\
-        .filter(TableFinancialStatements.AccountCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code==TableNodeHierarchy.L3Code)\
+    data = session.query(TableFinancialStatements)\
         .filter(TableFinancialStatements.Period<=current_period)\
         .filter(TableFinancialStatements.Period>=prior_period)\
         .all()
 
     session.close()
 
-    # Populate the data into standardised Consol Fin Statement rows
+    # Check that all nodes in the standardised data are captured in the static master data
+    unmapped_nodes = utils.data_integrity.get_all_bs_nodes_unmapped_for_cashflow()
+    if unmapped_nodes != []:
+        raise error_objects.MasterDataIncompleteError("Balance sheet nodes not found in master lists, cannot calculate cashflow:\n{}"
+                                                      .format(unmapped_nodes))
+
+    return create_cashflow_statement_rows(year=year, month=month, data=data)
+
+def create_internal_cashflow_statements_for_periods(periods, data):
+    ''' Calculates the cash flow statement lines of a range of periods in chronological order, so that the Balance
+        Sheet of each period is re-used as the opening balances of the next period
+
+    :param periods: Chronologically ordered list of (year, month) tuples
+    :param data: TableFinancialStatements rows of the periods and of the period before the first period
+    :return: List of TableFinancialStatements row objects
+    '''
+
+    # Check that all nodes in the standardised data are captured in the static master data
+    unmapped_nodes = utils.data_integrity.get_all_bs_nodes_unmapped_for_cashflow(
+        account_codes=[row.AccountCode for row in data])
+    if unmapped_nodes != []:
+        raise error_objects.MasterDataIncompleteError("Balance sheet nodes not found in master lists, cannot calculate cashflow:\n{}"
+                                                      .format(unmapped_nodes))
+
+    data_by_period = {}
+    for row in data:
+        data_by_period.setdefault(row.Period, []).append(row)
+
+    cash_flow_rows = []
+    for year, month in periods:
+        current_period = datetime.datetime(year=year, month=month, day=1)
+        prior_period = current_period - relativedelta(months=1)
+        cash_flow_rows += create_cashflow_statement_rows(year=year, month=month,
+                                                         data=data_by_period.get(prior_period, [])
+                                                              + data_by_period.get(current_period, []))
+
+    return cash_flow_rows
+
+def create_cashflow_statement_rows(year, month, data):
+    ''' Calculates the cash flow statement lines of a period using the indirect method
+
+    :param year:
+    :param month:
+    :param data: TableFinancialStatements rows of the period and the period before
+    :return: List of TableFinancialStatements row objects
+    '''
+
+    # Populate the data into standardised Consol Fin Statement rows (accounts not in the master data are excluded)
+    master_data = utils.master_data.get_master_data_snapshot()
     calc_rows = []
-    for fs, coa, node in data:
+    for fs in data:
+        account_node = master_data.get_account_node(fs.AccountCode)
+        if account_node is None:
+            continue
+        coa, node = account_node
         new_row = TableConsolidatedFinStatements(
                                                 ID = None,
                                                 Period = fs.Period,
@@ -216,12 +265,6 @@ def create_internal_cashflow_statement(year, month):
                                                 )
         calc_rows.append(new_row)
 
-    # Check that all nodes in the standardised data are captured in the static master data
-    unmapped_nodes = utils.data_integrity.get_all_bs_nodes_unmapped_for_cashflow()
-    if unmapped_nodes != []:
-        raise error_objects.MasterDataIncompleteError("Balance sheet nodes not found in master lists, cannot calculate cashflow:\n{}"
-                                                      .format(unmapped_nodes))
-
     # Calculate the periodic movements of each cash flow statement category and create database row objects
     list_of_companies = list(set([row.CompanyCode for row in calc_rows]))  # Create for list of companies to future-proof
 
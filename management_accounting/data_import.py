@@ -6,8 +6,11 @@ Contains functions used to process external (i.e. Xero) data into standardised i
 '''
 
 import datetime
+import itertools
 
-from sqlalchemy.orm import aliased
+from dateutil.relativedelta import relativedelta
+import numpy as np
+from sqlalchemy import DateTime, literal, null, select
 
 from customobjects import error_objects
 from customobjects.database_objects import \
@@ -17,96 +20,218 @@ from customobjects.database_objects import \
     TableChartOfAccounts, \
     TableFinancialStatements, \
     TableConsolidatedFinStatements, \
-    TableAllocationsData,\
-    TableAllocationAccounts,\
-    TableNodeHierarchy
+    TableAllocationsData
+from customobjects.helper_objects import XeroReportMatrix
 from headcount import create_headcount_rows_actuals
-from management_accounting.cashflow_calcs import create_internal_cashflow_statement
+from management_accounting.cashflow_calcs import create_internal_cashflow_statements_for_periods
 import references as r
 import utils.data_integrity
+from utils.db_bulk_write import bulk_insert_rows
 from utils.db_connect import db_sessionmaker
+import utils.db_staging
+import utils.master_data
 import utils.misc_functions
 import utils.xero_connect
 
 
-def create_internal_profit_and_loss(year, month):
-    ''' Creates the rows for the master-data version of the profit and loss from the imported xero data
+# Columns of tbl_DATA_converted_actuals populated by the set-based conversion, in the order they are selected
+CONVERTED_ACTUALS_COLUMNS = ['TimeStamp', 'CompanyCode', 'CostCentreCode', 'Period', 'AccountCode', 'Value']
 
-    :param year:
-    :param month:
-    :return: A list of TableFinancialStatements table row objects
+
+def get_internal_profit_and_loss_select(from_period, to_period, timestamp):
+    ''' Returns the query that maps the imported xero profit and loss data to the master-data version, in the order
+        of CONVERTED_ACTUALS_COLUMNS
+
+    :param from_period: Datetime of the first period to convert
+    :param to_period: Datetime of the last period to convert
+    :param timestamp: Time recorded as the TimeStamp of the rows
+    :return: Select statement
     '''
 
-    # Check whether the cost centre field has been populated for all line items in the xero data
-    utils.data_integrity.check_unassigned_costcentres_is_nil(year=year, month=month)
+    return select([literal(timestamp, type_=DateTime),
+                   TableCompanies.CompanyCode,
+                   TableCostCentres.CostCentreCode,
+                   TableXeroExtract.Period,
+                   TableChartOfAccounts.GLCode,
+                   TableXeroExtract.Value * TableChartOfAccounts.XeroMultiplier])\
+        .where(TableXeroExtract.CompanyName == TableCompanies.XeroName)\
+        .where(TableXeroExtract.CostCentreCode == TableCostCentres.XeroCode)\
+        .where(TableXeroExtract.AccountCode == TableChartOfAccounts.XeroCode)\
+        .where(TableXeroExtract.Period >= from_period)\
+        .where(TableXeroExtract.Period <= to_period)\
+        .where(TableXeroExtract.Value != 0)     # Xero outputs all balances as positive, the multiplier sets the sign
+
+def get_internal_balance_sheet_select(from_period, to_period, timestamp):
+    ''' Returns the query that maps the imported xero balance sheet data to the master-data version, in the order
+        of CONVERTED_ACTUALS_COLUMNS
+
+    :param from_period: Datetime of the first period to convert
+    :param to_period: Datetime of the last period to convert
+    :param timestamp: Time recorded as the TimeStamp of the rows
+    :return: Select statement
+    '''
 
-    rows_to_upload = []
-    session = db_sessionmaker()
-    period_to_extract = datetime.datetime(year=year, month=month, day=1)
+    return select([literal(timestamp, type_=DateTime),
+                   TableCompanies.CompanyCode,
+                   null(),
+                   TableXeroExtract.Period,
+                   TableChartOfAccounts.GLCode,
+                   TableXeroExtract.Value * TableChartOfAccounts.XeroMultiplier])\
+        .where(TableXeroExtract.ReportName == r.XERO_DATA_BALANCESHEET)\
+        .where(TableXeroExtract.CompanyName == TableCompanies.XeroName)\
+        .where(TableXeroExtract.AccountCode == TableChartOfAccounts.XeroCode)\
+        .where(TableXeroExtract.Period >= from_period)\
+        .where(TableXeroExtract.Period <= to_period)\
+        .where(TableXeroExtract.Value != 0)     # Xero outputs all balances as positive, the multiplier sets the sign
+
+def insert_internal_profit_and_loss(session, from_period, to_period, timestamp, insert_table=None):
+    ''' Creates the master-data version of the profit and loss from the imported xero data. The rows are mapped
+        and inserted by a single INSERT ... SELECT, so the data never leaves the database
+
+    :param session: Session to insert the rows in (the caller is responsible for committing)
+    :param from_period: Datetime of the first period to convert
+    :param to_period: Datetime of the last period to convert
+    :param timestamp: Time recorded as the TimeStamp of the rows
+    :param insert_table: Table object to insert the rows into instead of TableFinancialStatements (e.g. a staging table)
+    :return: Number of rows inserted
+    '''
 
-    query = session.query(TableXeroExtract, TableCompanies, TableCostCentres, TableChartOfAccounts)\
-        .filter(TableXeroExtract.CompanyName==TableCompanies.XeroName)\
-        .filter(TableXeroExtract.CostCentreCode==TableCostCentres.XeroCode)\
-        .filter(TableXeroExtract.AccountCode==TableChartOfAccounts.XeroCode)\
-        .filter(TableXeroExtract.Period==period_to_extract)\
-        .all()
-    session.close()
+    select_statement = get_internal_profit_and_loss_select(from_period=from_period, to_period=to_period,
+                                                           timestamp=timestamp)
 
-    if len(query)==0:
-        raise error_objects.TableEmptyForPeriodError("No data returned from table {} for period {}.{}".format(r.TBL_DATA_EXTRACT_XERO, year, month))
-    else:
+    insert_table = TableFinancialStatements.__table__ if insert_table is None else insert_table
+    result = session.execute(insert_table.insert().from_select(CONVERTED_ACTUALS_COLUMNS, select_statement))
+    return result.rowcount
 
-        for xero_data, company, costcentre, account in query:
-            if xero_data.Value != 0:
-                new_row = TableFinancialStatements(
-                                            TimeStamp = None,
-                                            CompanyCode = company.CompanyCode,
-                                            CostCentreCode = costcentre.CostCentreCode,
-                                            Period = period_to_extract,
-                                            AccountCode = account.GLCode,
-                                            Value = (xero_data.Value * account.XeroMultiplier)  # Xero outputs all balances as positive
-                                            )
-                rows_to_upload.append(new_row)
+def insert_internal_balance_sheet(session, from_period, to_period, timestamp, insert_table=None):
+    ''' Creates the master-data version of the balance sheet from the imported xero data. The rows are mapped
+        and inserted by a single INSERT ... SELECT, so the data never leaves the database
 
-    return rows_to_upload
+    :param session: Session to insert the rows in (the caller is responsible for committing)
+    :param from_period: Datetime of the first period to convert
+    :param to_period: Datetime of the last period to convert
+    :param timestamp: Time recorded as the TimeStamp of the rows
+    :param insert_table: Table object to insert the rows into instead of TableFinancialStatements (e.g. a staging table)
+    :return: Number of rows inserted
+    '''
 
-def create_internal_balance_sheet(year, month):
-    ''' Creates the master-data version of the balance sheet from the imported xero data
+    select_statement = get_internal_balance_sheet_select(from_period=from_period, to_period=to_period,
+                                                         timestamp=timestamp)
 
-    :param year:
-    :param month:
-    :return:
+    insert_table = TableFinancialStatements.__table__ if insert_table is None else insert_table
+    result = session.execute(insert_table.insert().from_select(CONVERTED_ACTUALS_COLUMNS, select_statement))
+    return result.rowcount
+
+def get_xero_report_matrices(xero_rows):
+    ''' Loads rows of Xero data into one accounts x cost centres matrix per report, company and period
+
+    :param xero_rows: Iterable of row tuples with values in the order of utils.xero_connect.XERO_EXTRACT_COLUMNS
+    :return: List of XeroReportMatrix objects
     '''
 
-    rows_to_upload = []
-    session = db_sessionmaker()
-    period_to_extract = datetime.datetime(year=year, month=month, day=1)
+    report_name_idx, company_name_idx, cost_centre_idx, account_idx, period_idx, value_idx = \
+        [utils.xero_connect.XERO_EXTRACT_COLUMNS.index(column)
+         for column in ['ReportName', 'CompanyName', 'CostCentreCode', 'AccountCode', 'Period', 'Value']]
+
+    # {(report name, company name, period): [account indexes, cost centre indexes, row numbers, column numbers, values]}
+    reports = {}
+    for row in xero_rows:
+        key = (row[report_name_idx], row[company_name_idx], row[period_idx])
+        if key not in reports:
+            reports[key] = [{}, {}, [], [], []]
+        accounts, cost_centres, row_numbers, column_numbers, values = reports[key]
+        row_numbers.append(accounts.setdefault(row[account_idx], len(accounts)))
+        column_numbers.append(cost_centres.setdefault(row[cost_centre_idx], len(cost_centres)))
+        values.append(row[value_idx])
+
+    report_matrices = []
+    for (report_name, company_name, period), (accounts, cost_centres, row_numbers, column_numbers, values) \
+            in sorted(reports.items()):
+        cell_numbers = np.array(row_numbers, dtype=np.int64) * len(cost_centres) + np.array(column_numbers,
+                                                                                             dtype=np.int64)
+        matrix_values = np.bincount(cell_numbers, weights=np.array(values, dtype=np.float64),
+                                    minlength=len(accounts) * len(cost_centres))\
+            .reshape(len(accounts), len(cost_centres))
+
+        account_codes = np.empty(len(accounts), dtype=object)
+        account_codes[accounts.values()] = accounts.keys()
+        cost_centre_codes = np.empty(len(cost_centres), dtype=object)
+        cost_centre_codes[cost_centres.values()] = cost_centres.keys()
+
+        report_matrices.append(XeroReportMatrix(values=matrix_values, report_name=report_name,
+                                                company_name=company_name, period=period,
+                                                account_codes=account_codes, cost_centre_codes=cost_centre_codes))
+    return report_matrices
+
+def convert_xero_matrix_to_internal_rows(report_matrix, master_data, timestamp):
+    ''' Maps a Xero report matrix to the master-data version of the profit and loss and balance sheet. The GL
+        code mapping and the XeroMultiplier sign flip are applied to whole rows of the matrix, and the balances of
+        each mapped cost centre are read from whole columns
+
+    :param report_matrix: XeroReportMatrix object
+    :param master_data: MasterDataSnapshot object
+    :param timestamp: Time recorded as the TimeStamp of the rows
+    :return: Tuple of (list of profit and loss rows, list of balance sheet rows), as TableFinancialStatements row
+             objects (not added to a session)
+    '''
 
-    query = session.query(TableXeroExtract,  TableCompanies, TableChartOfAccounts)\
-        .filter(TableXeroExtract.ReportName==r.XERO_DATA_BALANCESHEET)\
-        .filter(TableXeroExtract.CompanyName==TableCompanies.XeroName)\
-        .filter(TableXeroExtract.AccountCode==TableChartOfAccounts.XeroCode)\
-        .filter(TableXeroExtract.Period==period_to_extract)\
-        .all()
-    session.close()
+    comp = master_data.companies_by_xero_name.get(report_matrix.company_name)
+    if comp is None:
+        return [], []
+
+    accounts = [master_data.accounts_by_xero_code.get(account_code) for account_code in report_matrix.account_codes]
+    is_mapped = np.array([coa is not None for coa in accounts], dtype=bool)
+    gl_codes = np.array([coa.GLCode for coa in accounts if coa is not None], dtype=object)
+    multipliers = np.array([coa.XeroMultiplier for coa in accounts if coa is not None], dtype=np.float64)
+
+    # Xero outputs all balances as positive, the multiplier sets the sign
+    values = report_matrix.values[is_mapped] * multipliers[:, np.newaxis]
+
+    pnl_rows = []
+    for column, cost_centre_code in enumerate(report_matrix.cost_centre_codes):
+        cc = master_data.cost_centres_by_xero_code.get(cost_centre_code)
+        if cc is None:
+            continue
+        account_idx = np.nonzero(values[:, column])[0]
+        for gl_code, value in zip(gl_codes[account_idx].tolist(), values[account_idx, column].tolist()):
+            pnl_rows.append(TableFinancialStatements(TimeStamp=timestamp, CompanyCode=comp.CompanyCode,
+                                                     CostCentreCode=cc.CostCentreCode, Period=report_matrix.period,
+                                                     AccountCode=gl_code, Value=value))
+
+    bs_rows = []
+    if report_matrix.report_name == r.XERO_DATA_BALANCESHEET:
+        account_values = values.sum(axis=1)
+        account_idx = np.nonzero(account_values)[0]
+        for gl_code, value in zip(gl_codes[account_idx].tolist(), account_values[account_idx].tolist()):
+            bs_rows.append(TableFinancialStatements(TimeStamp=timestamp, CompanyCode=comp.CompanyCode,
+                                                    CostCentreCode=None, Period=report_matrix.period,
+                                                    AccountCode=gl_code, Value=value))
+
+    return pnl_rows, bs_rows
+
+def convert_xero_rows_to_internal_rows(xero_rows, timestamp):
+    ''' Maps rows of Xero data held in memory to the master-data version of the profit and loss and balance sheet,
+        matching the rows created inside the database by insert_internal_profit_and_loss and
+        insert_internal_balance_sheet. The rows are loaded into a matrix per report so that the mapping is applied
+        to whole rows and columns of balances rather than balance by balance
+
+    :param xero_rows: Iterable of row tuples with values in the order of utils.xero_connect.XERO_EXTRACT_COLUMNS
+    :param timestamp: Time recorded as the TimeStamp of the rows
+    :return: List of TableFinancialStatements row objects (not added to a session)
+    '''
 
-    if len(query)==0:
-        raise error_objects.TableEmptyForPeriodError("No data returned from table {} for period {}.{}".format(r.TBL_DATA_EXTRACT_XERO, year, month))
-    else:
+    master_data = utils.master_data.get_master_data_snapshot()
 
-        for xero_data, company, account in query:
-            if xero_data.Value != 0:
-                new_row = TableFinancialStatements(
-                                            TimeStamp = None,
-                                            CompanyCode = company.CompanyCode,
-                                            CostCentreCode = None,
-                                            Period = period_to_extract,
-                                            AccountCode = account.GLCode,
-                                            Value = (xero_data.Value * account.XeroMultiplier)  # Xero outputs all balances as positive
-                                            )
-                rows_to_upload.append(new_row)
+    pnl_rows = []
+    bs_rows = []
+    for report_matrix in get_xero_report_matrices(xero_rows=xero_rows):
+        report_pnl_rows, report_bs_rows = convert_xero_matrix_to_internal_rows(report_matrix=report_matrix,
+                                                                               master_data=master_data,
+                                                                               timestamp=timestamp)
+        pnl_rows += report_pnl_rows
+        bs_rows += report_bs_rows
 
-    return rows_to_upload
+    return pnl_rows + bs_rows
 
 def create_internal_financial_statements(year, month):
     ''' Creates an Income Statement, Balance Sheet and Cash Flow Statement, mapped to the Clearmatics internal
@@ -117,36 +242,88 @@ def create_internal_financial_statements(year, month):
     :return:
     '''
 
-    # Perform validations on the data before proceeding
-    utils.data_integrity.master_data_integrity_check_actuals(year=year, month=month)
-
-    utils.data_integrity.check_table_has_records_for_period(year=year, month=month, table=TableXeroExtract)
+    create_internal_financial_statements_for_periods(from_year=year, from_month=month, to_year=year, to_month=month)
 
-    # Create the P&L
-    pnl_rows = create_internal_profit_and_loss(year=year, month=month)
+def create_internal_financial_statements_for_periods(from_year, from_month, to_year, to_month):
+    ''' Creates the Income Statement, Balance Sheet and Cash Flow Statement of every period in a range. The Xero
+        data of the whole range is validated and converted at once, and the periods are then processed in
+        chronological order so that each Cash Flow Statement uses the Balance Sheet of the period before it
 
-    # Create the Balance Sheet
-    bs_rows = create_internal_balance_sheet(year=year, month=month)
+    :param from_year: Year of the first period to convert
+    :param from_month: Month of the first period to convert
+    :param to_year: Year of the last period to convert
+    :param to_month: Month of the last period to convert
+    :return:
+    '''
 
-    # Create the Cash Flow Statement
-    cf_rows = create_internal_cashflow_statement(year=year, month=month)
+    periods = utils.misc_functions.get_periods_in_range(from_year=from_year, from_month=from_month,
+                                                        to_year=to_year, to_month=to_month)
+    from_period = datetime.datetime(year=from_year, month=from_month, day=1)
+    to_period = datetime.datetime(year=to_year, month=to_month, day=1)
+    prior_period = from_period - relativedelta(months=1)
 
-    # Create the Cash Flow Statement using P&L and Balance Sheet
-    rows_to_upload = pnl_rows + bs_rows + cf_rows
+    # Perform validations on the data of every period before proceeding (incl. unassigned cost centre balances)
+    utils.data_integrity.master_data_integrity_check_actuals_for_periods(periods=periods)
 
-    utils.misc_functions.delete_table_data_for_period(table=TableFinancialStatements, year=year, month=month)
+    session = db_sessionmaker()
+    extracted_periods = [period for (period,) in session.query(TableXeroExtract.Period)
+                         .filter(TableXeroExtract.Period >= from_period)
+                         .filter(TableXeroExtract.Period <= to_period)
+                         .distinct()
+                         .all()]
+    session.close()
+    for year, month in periods:
+        if datetime.datetime(year=year, month=month, day=1) not in extracted_periods:
+            raise error_objects.TableEmptyForPeriodError(
+                "Table {} contains no records for period {}.{}".format(TableXeroExtract.__tablename__, year, month))
+
+    # Calculating cash flows based on Balance Sheet movements requires the period before the range to be populated
+    utils.data_integrity.check_period_exists(year=prior_period.year, month=prior_period.month)
+
+    # The P&L and Balance Sheet (converted inside the database) and the Cash Flow Statements are built in a staging
+    # table and then swapped in for the old data, so the periods are left untouched if any of them fail
+    staging_table = utils.db_staging.create_staging_table(table=TableFinancialStatements, from_period=from_period,
+                                                          to_period=to_period)
     try:
         session = db_sessionmaker()
-        timestamp = datetime.datetime.now()
-        for row in rows_to_upload:
-            row.TimeStamp = timestamp
-            session.add(row)
-    except Exception, e:
-        raise
-    else:
-        session.commit()
+        try:
+            timestamp = datetime.datetime.now()
+            insert_internal_profit_and_loss(session=session, from_period=from_period, to_period=to_period,
+                                            timestamp=timestamp, insert_table=staging_table)
+            insert_internal_balance_sheet(session=session, from_period=from_period, to_period=to_period,
+                                          timestamp=timestamp, insert_table=staging_table)
+
+            # The converted rows of the range (and the opening balances) are read once
+            data = session.query(TableFinancialStatements)\
+                .filter(TableFinancialStatements.Period == prior_period)\
+                .all()
+            data += session.query(staging_table).all()
+
+            for year, month in periods:
+                period = datetime.datetime(year=year, month=month, day=1)
+                period_rows = [row for row in data if row.Period == period]
+                if not [row for row in period_rows if row.CostCentreCode is not None] \
+                        or not [row for row in period_rows if row.CostCentreCode is None]:
+                    raise error_objects.TableEmptyForPeriodError(
+                        "No data returned from table {} for period {}.{}".format(r.TBL_DATA_EXTRACT_XERO, year, month))
+
+            cf_rows = create_internal_cashflow_statements_for_periods(periods=periods, data=data)
+            for row in cf_rows:
+                row.TimeStamp = timestamp
+            bulk_insert_rows(session=session, table=TableFinancialStatements, rows=cf_rows,
+                             insert_table=staging_table)
+        except Exception:
+            session.rollback()
+            raise
+        else:
+            session.commit()
+        finally:
+            session.close()
+
+        utils.db_staging.swap_staging_table(table=TableFinancialStatements, staging_table=staging_table,
+                                            from_period=from_period, to_period=to_period)
     finally:
-        session.close()
+        utils.db_staging.drop_staging_table(staging_table=staging_table)
 
 def create_consolidated_financial_statements(year, month):
     ''' Creates the consolidated financial statements that includes the allocated costs
@@ -156,7 +333,7 @@ def create_consolidated_financial_statements(year, month):
     :param month:
     :return:
     '''
-    # ToDo: Function feels too long - needs refactoring
+
     # Perform validation checks before proceeding
     utils.data_integrity.master_data_integrity_check_actuals(year=year, month=month)
     utils.data_integrity.check_table_has_records_for_period(year=year, month=month, table=TableFinancialStatements)
@@ -164,156 +341,150 @@ def create_consolidated_financial_statements(year, month):
 
     time_stamp = datetime.datetime.now()
     period_to_create = datetime.datetime(year=year, month=month,day=1)
-    rows_to_import = []
 
-    session = db_sessionmaker()
-    # Extract the data from the Xero Income Statement
-    consol_qry_cc = session.query(TableFinancialStatements,
-                               TableCompanies,
-                               TableCostCentres,
-                               TableChartOfAccounts,
-                               TableNodeHierarchy)\
-        .filter(TableFinancialStatements.Period == period_to_create)\
-        .filter(TableFinancialStatements.CompanyCode == TableCompanies.CompanyCode)\
-        .filter(TableFinancialStatements.CostCentreCode == TableCostCentres.CostCentreCode)\
-        .filter(TableFinancialStatements.AccountCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code == TableNodeHierarchy.L3Code)\
-        .all()
+    fin_statement_rows, alloc_rows = get_consolidation_fact_rows(period=period_to_create)
 
-    # Extract the data from the Xero financial statements (no cost centres e.g. Revenue, Balance Sheet)
-    consol_qry_nocc = session.query(TableFinancialStatements,
-                               TableCompanies,
-                               TableChartOfAccounts,
-                               TableNodeHierarchy)\
-        .filter(TableFinancialStatements.Period == period_to_create)\
-        .filter(TableFinancialStatements.CompanyCode == TableCompanies.CompanyCode)\
-        .filter(TableFinancialStatements.CostCentreCode == None)\
-        .filter(TableFinancialStatements.AccountCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code == TableNodeHierarchy.L3Code)\
-        .all()
+    # Get headcount data
+    headcount_rows = create_headcount_rows_actuals(year=year, month=month, time_stamp=time_stamp)
 
-    # To reference a table more than once (sender, receiver cost centres) we need to alias the table
-    cc_alias_sending = aliased(TableCostCentres)
-    cc_alias_receiving = aliased(TableCostCentres)
-    comp_alias_sending = aliased(TableCompanies)
-    comp_alias_receiving = aliased(TableCompanies)
-
-    # Append the data from the cost allocations table
-    alloc_qry = session.query(TableAllocationsData,
-                              comp_alias_sending,
-                              comp_alias_receiving,
-                              cc_alias_sending,
-                              cc_alias_receiving,
-                              TableAllocationAccounts)\
-        .filter(TableAllocationsData.Period==period_to_create)\
-        .filter(TableAllocationsData.SendingCompany==comp_alias_sending.CompanyCode)\
-        .filter(TableAllocationsData.ReceivingCompany==comp_alias_receiving.CompanyCode)\
-        .filter(TableAllocationsData.SendingCostCentre==cc_alias_sending.CostCentreCode)\
-        .filter(TableAllocationsData.ReceivingCostCentre==cc_alias_receiving.CostCentreCode)\
-        .filter(TableAllocationsData.GLAccount == TableAllocationAccounts.GLCode)\
-        .all()
+    # The rows are enriched as they are written to a staging table, and then swapped in for the old data
+    row_counts = {}
+    staging_table = utils.db_staging.create_staging_table(table=TableConsolidatedFinStatements,
+                                                          from_period=period_to_create, to_period=period_to_create)
+    try:
+        session = db_sessionmaker()
+        try:
+            bulk_insert_rows(session=session, table=TableConsolidatedFinStatements, insert_table=staging_table,
+                             rows=itertools.chain(
+                                 create_consolidated_actuals_rows(period=period_to_create, time_stamp=time_stamp,
+                                                                  fin_statement_rows=fin_statement_rows,
+                                                                  alloc_rows=alloc_rows, row_counts=row_counts),
+                                 headcount_rows))
+            session.commit()
+        finally:
+            session.close()
+
+        assert row_counts.get('cc'), "Query of financial statement (with costcentres) data produced no results"
+        assert row_counts.get('alloc'), "Allocation query produced no results"
+        assert row_counts.get('nocc'), "Query of financial statement data (no cost centres) produced no results"
+
+        utils.db_staging.swap_staging_table(table=TableConsolidatedFinStatements, staging_table=staging_table,
+                                            from_period=period_to_create, to_period=period_to_create)
+    finally:
+        utils.db_staging.drop_staging_table(staging_table=staging_table)
 
-    session.close()
+def get_consolidation_fact_rows(period):
+    ''' Returns the fact columns of the converted Xero data and the allocated costs of a period. The master data
+        is looked up in memory rather than joined in the query
 
-    assert consol_qry_cc != [], "Query of financial statement (with costcentres) data produced no results"
-    assert alloc_qry != [], "Allocation query produced no results"
-    assert consol_qry_nocc != [], "Query of financial statement data (no cost centres) produced no results"
-
-    # For data returned from the database, create ConsolidatedTable rows objects
-    for pnl, comp, cc, coa , node in consol_qry_cc:
-        consol_row = TableConsolidatedFinStatements(
-                                                    Period = period_to_create,
-                                                    CompanyCode = comp.CompanyCode,
-                                                    CompanyName = comp.CompanyName,
-                                                    PartnerCompanyCode = None,
-                                                    PartnerCompanyName = None,
-                                                    CostCentreCode = cc.CostCentreCode,
-                                                    CostCentreName = cc.CostCentreName,
-                                                    PartnerCostCentreCode = None,
-                                                    PartnerCostCentreName = None,
-                                                    FinancialStatement = node.L0Name,
-                                                    GLAccountCode = coa.GLCode,
-                                                    GLAccountName = coa.GLName,
-                                                    L1Code = node.L1Code,
-                                                    L1Name = node.L1Name,
-                                                    L2Code = node.L2Code,
-                                                    L2Name = node.L2Name,
-                                                    L3Code = node.L3Code,
-                                                    L3Name = node.L3Name,
-                                                    CostHierarchyNumber = cc.AllocationTier,
-                                                    Value = pnl.Value,
-                                                    TimeStamp = time_stamp,
-                                                    Label = r.OUTPUT_LABEL_ACTUALS
-                                                    )
-        rows_to_import.append(consol_row)
-
-    for pnl, comp, coa , node in consol_qry_nocc:
-        consol_row = TableConsolidatedFinStatements(
-                                                    Period = period_to_create,
-                                                    CompanyCode = comp.CompanyCode,
-                                                    CompanyName = comp.CompanyName,
-                                                    PartnerCompanyCode = None,
-                                                    PartnerCompanyName = None,
-                                                    CostCentreCode = None,
-                                                    CostCentreName = None,
-                                                    PartnerCostCentreCode = None,
-                                                    PartnerCostCentreName = None,
-                                                    FinancialStatement = node.L0Name,
-                                                    GLAccountCode = coa.GLCode,
-                                                    GLAccountName = coa.GLName,
-                                                    L1Code = node.L1Code,
-                                                    L1Name = node.L1Name,
-                                                    L2Code = node.L2Code,
-                                                    L2Name = node.L2Name,
-                                                    L3Code = node.L3Code,
-                                                    L3Name = node.L3Name,
-                                                    CostHierarchyNumber = None,
-                                                    Value = pnl.Value,
-                                                    TimeStamp = time_stamp,
-                                                    Label = r.OUTPUT_LABEL_ACTUALS
-                                                    )
-        rows_to_import.append(consol_row)
-
-    for data, comp_send, comp_rec, cc_send, cc_rec, alloc_accounts in alloc_qry:
-        consol_row = TableConsolidatedFinStatements(
-                                                    Period = period_to_create,
-                                                    CompanyCode = comp_rec.CompanyCode,
-                                                    CompanyName = comp_rec.CompanyName,
-                                                    PartnerCompanyCode = comp_send.CompanyCode,
-                                                    PartnerCompanyName = comp_send.CompanyName,
-                                                    CostCentreCode = cc_rec.CostCentreCode,
-                                                    CostCentreName = cc_rec.CostCentreName,
-                                                    PartnerCostCentreCode = cc_send.CostCentreCode,
-                                                    PartnerCostCentreName = cc_send.CostCentreName,
-                                                    FinancialStatement = alloc_accounts.L0Name,
-                                                    GLAccountCode = alloc_accounts.GLCode,
-                                                    GLAccountName = alloc_accounts.GLName,
-                                                    L1Code = alloc_accounts.L1Code,
-                                                    L1Name = alloc_accounts.L1Name,
-                                                    L2Code = alloc_accounts.L2Code,
-                                                    L2Name = alloc_accounts.L2Name,
-                                                    L3Code = alloc_accounts.L3Code,
-                                                    L3Name = alloc_accounts.L3Name,
-                                                    CostHierarchyNumber = data.CostHierarchy,
-                                                    Value = data.Value,
-                                                    TimeStamp = time_stamp,
-                                                    Label = r.OUTPUT_LABEL_ACTUALS
-                                                    )
-        rows_to_import.append(consol_row)
+    :param period: Datetime of the period
+    :return: Tuple of (list of (CompanyCode, CostCentreCode, AccountCode, Value) tuples, list of (SendingCompany,
+             ReceivingCompany, SendingCostCentre, ReceivingCostCentre, GLAccount, CostHierarchy, Value) tuples)
+    '''
 
-    # Get headcount data
-    headcount_rows = create_headcount_rows_actuals(year=year, month=month, time_stamp=time_stamp)
+    session = db_sessionmaker()
+    fin_statement_rows = session.query(TableFinancialStatements.CompanyCode,
+                                       TableFinancialStatements.CostCentreCode,
+                                       TableFinancialStatements.AccountCode,
+                                       TableFinancialStatements.Value)\
+        .filter(TableFinancialStatements.Period == period)\
+        .all()
 
-    for row in headcount_rows:
-        rows_to_import.append(row)
+    alloc_rows = session.query(TableAllocationsData.SendingCompany,
+                               TableAllocationsData.ReceivingCompany,
+                               TableAllocationsData.SendingCostCentre,
+                               TableAllocationsData.ReceivingCostCentre,
+                               TableAllocationsData.GLAccount,
+                               TableAllocationsData.CostHierarchy,
+                               TableAllocationsData.Value)\
+        .filter(TableAllocationsData.Period == period)\
+        .all()
+    session.close()
 
-    # Delete periodic data from the table
-    utils.misc_functions.delete_table_data_for_period(table=TableConsolidatedFinStatements, year=year, month=month)
+    return fin_statement_rows, alloc_rows
 
-    # For all rows created, add them to the database
-    session = db_sessionmaker()
-    for row in rows_to_import:
-        session.add(row)
+def create_consolidated_actuals_rows(period, time_stamp, fin_statement_rows, alloc_rows, row_counts):
+    ''' Generates the rows of the consolidated financial statements by looking up the master data of the converted
+        Xero data and the allocated costs. Rows that aren't mapped in the master data are excluded
+
+    :param period: Datetime of the period
+    :param time_stamp: Time recorded as the TimeStamp of the rows
+    :param fin_statement_rows: (CompanyCode, CostCentreCode, AccountCode, Value) tuples from the converted Xero data
+    :param alloc_rows: (SendingCompany, ReceivingCompany, SendingCostCentre, ReceivingCostCentre, GLAccount,
+                       CostHierarchy, Value) tuples from the allocated costs
+    :param row_counts: Dictionary updated with the number of rows generated from each type of data
+                       ('cc', 'nocc', 'alloc')
+    :return: Generator of dictionaries of {column name: value} of TableConsolidatedFinStatements
+    '''
 
-    session.commit()
-    session.close()
\ No newline at end of file
+    master_data = utils.master_data.get_master_data_snapshot()
+
+    for company_code, cost_centre_code, account_code, value in fin_statement_rows:
+        comp = master_data.get_company(company_code)
+        account_node = master_data.get_account_node(account_code)
+        cc = None if cost_centre_code is None else master_data.get_cost_centre(cost_centre_code)
+        if comp is None or account_node is None or (cost_centre_code is not None and cc is None):
+            continue
+        coa, node = account_node
+
+        row_type = 'nocc' if cc is None else 'cc'
+        row_counts[row_type] = row_counts.get(row_type, 0) + 1
+        yield dict(
+                Period = period,
+                CompanyCode = comp.CompanyCode,
+                CompanyName = comp.CompanyName,
+                PartnerCompanyCode = None,
+                PartnerCompanyName = None,
+                CostCentreCode = None if cc is None else cc.CostCentreCode,
+                CostCentreName = None if cc is None else cc.CostCentreName,
+                PartnerCostCentreCode = None,
+                PartnerCostCentreName = None,
+                FinancialStatement = node.L0Name,
+                GLAccountCode = coa.GLCode,
+                GLAccountName = coa.GLName,
+                L1Code = node.L1Code,
+                L1Name = node.L1Name,
+                L2Code = node.L2Code,
+                L2Name = node.L2Name,
+                L3Code = node.L3Code,
+                L3Name = node.L3Name,
+                CostHierarchyNumber = None if cc is None else cc.AllocationTier,
+                Value = value,
+                TimeStamp = time_stamp,
+                Label = r.OUTPUT_LABEL_ACTUALS
+                )
+
+    for comp_send_code, comp_rec_code, cc_send_code, cc_rec_code, gl_account, cost_hierarchy, value in alloc_rows:
+        comp_send = master_data.get_company(comp_send_code)
+        comp_rec = master_data.get_company(comp_rec_code)
+        cc_send = master_data.get_cost_centre(cc_send_code)
+        cc_rec = master_data.get_cost_centre(cc_rec_code)
+        alloc_accounts = master_data.allocation_accounts.get(gl_account)
+        if None in (comp_send, comp_rec, cc_send, cc_rec, alloc_accounts):
+            continue
+
+        row_counts['alloc'] = row_counts.get('alloc', 0) + 1
+        yield dict(
+                Period = period,
+                CompanyCode = comp_rec.CompanyCode,
+                CompanyName = comp_rec.CompanyName,
+                PartnerCompanyCode = comp_send.CompanyCode,
+                PartnerCompanyName = comp_send.CompanyName,
+                CostCentreCode = cc_rec.CostCentreCode,
+                CostCentreName = cc_rec.CostCentreName,
+                PartnerCostCentreCode = cc_send.CostCentreCode,
+                PartnerCostCentreName = cc_send.CostCentreName,
+                FinancialStatement = alloc_accounts.L0Name,
+                GLAccountCode = alloc_accounts.GLCode,
+                GLAccountName = alloc_accounts.GLName,
+                L1Code = alloc_accounts.L1Code,
+                L1Name = alloc_accounts.L1Name,
+                L2Code = alloc_accounts.L2Code,
+                L2Name = alloc_accounts.L2Name,
+                L3Code = alloc_accounts.L3Code,
+                L3Name = alloc_accounts.L3Name,
+                CostHierarchyNumber = cost_hierarchy,
+                Value = value,
+                TimeStamp = time_stamp,
+                Label = r.OUTPUT_LABEL_ACTUALS
+                )
@@ -12,11 +12,10 @@ from sqlalchemy import or_
 
 from customobjects.database_objects import \
     TableConsolidatedFinStatements, \
-    TableHeadcount,\
-    TableCompanies, \
-    TableCostCentres
+    TableHeadcount
 import references as r
 from utils.db_connect import db_sessionmaker
+import utils.master_data
 
 
 def create_headcount_rows_actuals(year, month, time_stamp=None):
@@ -34,18 +33,21 @@ def create_headcount_rows_actuals(year, month, time_stamp=None):
 
     # Get all headcount at the end of the period that have started but haven't left
     session = db_sessionmaker()
-    headcount_qry = session.query(TableHeadcount, TableCompanies, TableCostCentres)\
+    headcount_qry = session.query(TableHeadcount)\
         .filter(TableHeadcount.StartDate<=end_date)\
         .filter(or_(TableHeadcount.EndDate>end_date,TableHeadcount.EndDate==None))\
-        .filter(TableHeadcount.CompanyCode==TableCompanies.CompanyCode)\
-        .filter(TableHeadcount.CostCentreCode==TableCostCentres.CostCentreCode)\
         .all()
     session.close()
 
     # Want the headcount grouped by cost centre, company code,
+    master_data = utils.master_data.get_master_data_snapshot()
     populated_rows = []
 
-    for headcount, comp, cc in headcount_qry:
+    for headcount in headcount_qry:
+        comp = master_data.get_company(headcount.CompanyCode)
+        cc = master_data.get_cost_centre(headcount.CostCentreCode)
+        if comp is None or cc is None:
+            continue
 
         row = TableConsolidatedFinStatements(
             Period=start_date,
@@ -6,6 +6,7 @@ Contains constants and other references used by the script
 '''
 
 import datetime
+import os
 
 
 ### Time Constraints
@@ -33,6 +34,59 @@ XERO_DATA_INCOMESTATEMENT = "ProfitAndLoss"
 XERO_DATA_COSTCENTRES = "CostCentre"
 XERO_DATA_COSTCENTRES_UNASSIGNED = "Unassigned"
 
+# Xero account types (as given on journal lines) that are reported in the Income Statement
+XERO_PNL_ACCOUNT_TYPES = ['REVENUE', 'SALES', 'OTHERINCOME', 'EXPENSE', 'DIRECTCOSTS', 'OVERHEADS', 'DEPRECIATN',
+                          'WAGESEXPENSE', 'SUPERANNUATIONEXPENSE']
+
+# Xero account types (as given on journal lines) that are reported in the Balance Sheet
+XERO_BALANCESHEET_ACCOUNT_TYPES = ['BANK', 'CURRENT', 'FIXED', 'INVENTORY', 'NONCURRENT', 'PREPAYMENT', 'CURRLIAB',
+                                   'LIABILITY', 'TERMLIAB', 'PAYGLIABILITY', 'SUPERANNUATIONLIABILITY',
+                                   'WAGESPAYABLELIABILITY', 'EQUITY']
+
+# Xero account types with a credit balance, which Xero reports reverse the sign of (so that balances are positive)
+XERO_CREDIT_ACCOUNT_TYPES = ['REVENUE', 'SALES', 'OTHERINCOME', 'CURRLIAB', 'LIABILITY', 'TERMLIAB', 'PAYGLIABILITY',
+                             'SUPERANNUATIONLIABILITY', 'WAGESPAYABLELIABILITY', 'EQUITY']
+
+# Xero reports the current year earnings in the Balance Sheet against this fixed account ID
+XERO_CURRENT_YEAR_EARNINGS_ACCOUNT = "abababab-abab-abab-abab-abababababab"
+XERO_CURRENT_YEAR_EARNINGS_NAME = "Current Year Earnings"
+
+# Rows of reports exported from Xero that are calculated totals rather than accounts (as well as the "Total ..." rows)
+XERO_REPORT_SUMMARY_ROWS = ['Gross Profit', 'Operating Profit', 'Net Profit', 'Net Assets']
+
+# Key added to retrieved Xero reports for the local time the report was retrieved from Xero (or exported from Xero),
+# which is recorded as the DateExtracted of its rows
+XERO_REPORT_DATE_FETCHED = "DateFetched"
+
+# Xero API connection
+
+XERO_MAX_CONCURRENT_PERIODS = 4     # Number of periods retrieved from each Xero organisation at the same time
+XERO_HTTP_POOL_SIZE = 5             # Maximum number of open connections (and requests in progress) per organisation
+XERO_REQUEST_TIMEOUT = 60           # Seconds to wait for a response from the Xero API
+
+# Xero API call limits, every request is scheduled so that these are not exceeded
+XERO_RATE_LIMIT_PER_MINUTE = 60
+XERO_RATE_LIMIT_PER_DAY = 5000
+XERO_MAX_RETRIES = 5                # Number of times a rate limited request is retried before the pull is aborted
+XERO_BACKOFF_BASE = 1.0             # Seconds, doubled for each retry when Xero doesn't say how long to wait
+XERO_MAX_RATE_LIMIT_WAIT = 300      # Seconds a request may wait for the limits to reset before the pull is aborted
+
+XERO_JOURNALS_PAGE_SIZE = 100       # Number of journals the Xero Journals endpoint returns per request
+XERO_REPORT_MAX_PERIODS = 12        # Number of months the Xero reports endpoints return in one multi-period report
+XERO_REPORT_FILE_WORKERS = 4        # Number of exported report files parsed at the same time
+
+# Raw Xero responses are recorded here so that reports can be re-parsed without calling the API again
+XERO_CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xero-cache")
+
+# The cost centre (tracking option) mapping rarely changes so is re-used until it expires or no longer matches
+XERO_COST_CENTRE_MAPPING_FILE = os.path.join(XERO_CACHE_DIRECTORY, "cost-centre-mapping.json")
+XERO_COST_CENTRE_MAPPING_TTL = 7 * 24 * 60 * 60     # Seconds before the cached mapping is retrieved from Xero again
+
+# Default size of the synthetic reports served by the local Xero stand-in (see utils/xero_standin.py)
+XERO_STANDIN_ACCOUNTS = 500
+XERO_STANDIN_COST_CENTRES = 50
+XERO_STANDIN_DENSITY = 0.3          # Proportion of report cells with a balance
+
 # Clearmatics data mappings
 
 CM_DATA_BALANCESHEET = "BalanceSheet"
@@ -82,8 +136,21 @@ CM_CF_GL_FINANCING = 900030
 
 DEFAULT_MAX_CALC_ERROR = 0.0001 # The standard error tolerance used in the model's calculations
 
+# Engines that indirect cost allocations can be calculated with (the objects and matrix engines create identical
+# allocations, the transfer engine creates the same indirect costs per cost centre)
+ALLOCATION_ENGINE_OBJECTS = "objects"   # Each allocated cost is created as a pair of Cost objects
+ALLOCATION_ENGINE_MATRIX = "matrix"     # The costs allocated by each tier are calculated as a numpy matrix
+ALLOCATION_ENGINE_TRANSFER = "transfer" # Costs are allocated directly to the cost centres that bear them
+ALLOCATION_ENGINES = [ALLOCATION_ENGINE_OBJECTS, ALLOCATION_ENGINE_MATRIX, ALLOCATION_ENGINE_TRANSFER]
+
 ### Database Constants
 
+DB_BULK_INSERT_CHUNK_SIZE = 1000    # Number of rows sent to the database in each multi-row INSERT statement
+DB_STAGING_TABLE_SUFFIX = "_staging"  # Period rewrites are built in a copy of the table named <table><suffix>_<YYYYMM>
+DB_PARTITION_HISTORY = "p_history"  # Partition holding any periods before the first monthly partition
+DB_PARTITION_FUTURE = "p_future"    # Partition holding any periods after the last monthly partition
+MASTER_DATA_CHECK_INTERVAL = 60     # Seconds the master data snapshot is used before checking the tables for changes
+
 #### Master Data
 
 TBL_MASTER_ALLOCACCOUNTS = "tbl_MASTER_allocationaccounts"
@@ -107,6 +174,8 @@ COL_PERIOD_ISPUBLISHED = "IsPublished"
 TBL_MASTER_NODEHIERARCHY = "tbl_MASTER_nodehierarchy"
 COL_NODE_L3CODE = "L3Code"
 
+TBL_MASTER_SCHEMAVERSION = "tbl_MASTER_schemaversion"
+
 #### User Data
 
 TBL_DATA_ALLOCATIONS_ACTUALS = "tbl_DATA_allocations_actuals"
@@ -122,6 +191,16 @@ TBL_DATA_CONVERTED_ACTUALS = "tbl_DATA_converted_actuals"
 
 TBL_DATA_EXTRACT_XERO = "tbl_DATA_extract_xero"
 COL_XEROEXTRACT_ACCOUNTCODE = "AccountCode"
+XERO_EXTRACT_VALUE_DECIMALS = 3     # Precision of the Value column, balances are compared at this precision
+
+TBL_DATA_EXTRACT_XERO_CHANGELOG = "tbl_DATA_extract_xero_changelog"
+XERO_CHANGE_INSERTED = "INSERTED"
+XERO_CHANGE_UPDATED = "UPDATED"
+XERO_CHANGE_DELETED = "DELETED"
+
+TBL_DATA_XERO_JOURNAL_SYNC = "tbl_DATA_xero_journal_sync"
+
+TBL_DATA_VALIDATION_XERO = "tbl_DATA_validation_xero"
 
 #### Output Data
 
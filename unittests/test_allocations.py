@@ -5,14 +5,51 @@
 Contains unit tests for the allocations.py module
 '''
 
+import datetime
+import random
 import unittest
 
 from customobjects.helper_objects import Cost, CostCentre, Employee
-from management_accounting import allocations
+from management_accounting import allocations, allocation_transfers
+import references as r
 
 TEST_PERIOD_YEAR = 2017
 TEST_PERIOD_MONTH = 3
 
+def create_test_costcentres(tiers, seed=1):
+    ''' Creates cost centres populated with employees and direct costs, without reading the database
+
+    :param tiers: List of the allocation tier of each cost centre
+    :param seed: Seed of the random FTE and costs, so that the same cost centres can be created again
+    :return: List of CostCentre objects
+    '''
+
+    rnd = random.Random(seed)
+    period = datetime.datetime(year=TEST_PERIOD_YEAR, month=TEST_PERIOD_MONTH, day=1)
+
+    costcentres = []
+    for index, tier in enumerate(tiers, 1):
+        cc = CostCentre()
+        cc.master_code = "C{:06d}".format(index)
+        cc.hierarchy_tier = tier
+        cc.employees = []
+        cc.direct_costs = []
+        cc.allocated_costs = []
+        for emp_index in range(rnd.randint(1 if tier == 1 else 0, 3)):   # Costs must be received by L1 FTE
+            emp = Employee()
+            emp.fte = rnd.choice([0.5, 0.8, 1.0])
+            cc.employees.append(emp)
+        for allocation_account_code in [900100, 900200, 900300]:
+            if rnd.random() < 0.8:
+                cost = Cost()
+                cost.period = period
+                cost.allocation_account_code = allocation_account_code
+                cost.amount = rnd.randint(-50000, 500000) / 100.0
+                cc.direct_costs.append(cost)
+        costcentres.append(cc)
+
+    return costcentres
+
 class Test_Allocations(unittest.TestCase):
     ''' Unit tests for the management_accounting.allocations.py module '''
 
@@ -207,3 +244,64 @@ class Test_Allocations(unittest.TestCase):
                                                         max_month=max_month)
         self.assertEqual(test_date_3,True)
 
+    def test_allocation_engines_create_identical_rows(self):
+        ''' The matrix allocation engine should create exactly the same allocation rows as the object engine,
+            including where a tier of the hierarchy is missing
+
+        :return:
+        '''
+
+        upload_time = datetime.datetime.now()
+        for tiers in [[1, 1, 2, 2, 3], [1, 1, 1, 2, 2, 3, 3, 3, 4, 4], [1, 2, 2, 3, 5, 5]]:
+            object_rows = allocations.allocate_indirect_costs_to_rows(
+                unprocessed_costcentres=create_test_costcentres(tiers=tiers), upload_time=upload_time,
+                engine=r.ALLOCATION_ENGINE_OBJECTS)
+            matrix_rows = allocations.allocate_indirect_costs_to_rows(
+                unprocessed_costcentres=create_test_costcentres(tiers=tiers), upload_time=upload_time,
+                engine=r.ALLOCATION_ENGINE_MATRIX)
+
+            self.assertNotEqual(object_rows, [])
+            self.assertEqual(sorted(sorted(row.items()) for row in matrix_rows),
+                             sorted(sorted(row.items()) for row in object_rows))
+
+    def test_transfer_engine_allocates_same_indirect_costs(self):
+        ''' The transfer allocation engine should allocate the same net indirect costs to each cost centre as the
+            object engine (including costs received by a tier that aren't allocated onwards), and create identical
+            rows when the rows of each tier are requested
+
+        :return:
+        '''
+
+        upload_time = datetime.datetime.now()
+        for tiers in [[1, 1, 2, 2, 3], [1, 1, 1, 2, 2, 3, 3, 3, 4, 4], [1, 2, 2, 3, 5, 5]]:
+            processed_costcentres = allocations.allocate_indirect_cost_for_period(
+                unprocessed_costcentres=create_test_costcentres(tiers=tiers))
+            object_rows = allocations.create_allocated_costs_rows(costcentres=processed_costcentres,
+                                                                  upload_time=upload_time)
+
+            costcentres = create_test_costcentres(tiers=tiers)
+            allocated_cost_totals, cost_columns = allocation_transfers.get_allocated_cost_totals(
+                costcentres=costcentres)
+            cc_index = dict((cc.master_code, cc_idx) for cc_idx, cc in enumerate(costcentres))
+            for cc in processed_costcentres:
+                cc_idx = cc_index[cc.master_code]
+                for column_idx, (ledger_code, period) in enumerate(cost_columns):
+                    self.assertAlmostEqual(allocated_cost_totals[cc_idx, column_idx],
+                                           sum([cost.amount for cost in cc.allocated_costs
+                                                if cost.ledger_account_code == ledger_code and cost.period == period]),
+                                           places=6)
+
+            transfer_rows = allocations.allocate_indirect_costs_to_rows(
+                unprocessed_costcentres=create_test_costcentres(tiers=tiers), upload_time=upload_time,
+                engine=r.ALLOCATION_ENGINE_TRANSFER)
+            self.assertLess(len(transfer_rows), len(object_rows))
+            for cc_idx, cc in enumerate(costcentres):
+                self.assertAlmostEqual(sum([row['Value'] for row in transfer_rows
+                                            if row['ReceivingCostCentre'] == cc.master_code]),
+                                       allocated_cost_totals[cc_idx, :].sum(), places=2)
+
+            audit_rows = allocations.allocate_indirect_costs_to_rows(
+                unprocessed_costcentres=create_test_costcentres(tiers=tiers), upload_time=upload_time,
+                engine=r.ALLOCATION_ENGINE_TRANSFER, audit_rows=True)
+            self.assertEqual(sorted(sorted(row.items()) for row in audit_rows),
+                             sorted(sorted(row.items()) for row in object_rows))
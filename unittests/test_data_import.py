@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the data_import.py module
+'''
+
+import datetime
+import unittest
+
+from customobjects.database_objects import TableChartOfAccounts, TableCostCentres, TableCompanies
+from customobjects.helper_objects import MasterDataSnapshot
+from management_accounting import data_import
+import references as r
+
+TEST_PERIOD = datetime.datetime(year=2017, month=3, day=1)
+TEST_TIMESTAMP = datetime.datetime(year=2017, month=4, day=5)
+TEST_COMPANY_NAME = "Test Company Ltd"
+
+
+def get_test_xero_row(report_name, cost_centre_code, account_code, value):
+    ''' Returns a row of Xero data with values in the order of utils.xero_connect.XERO_EXTRACT_COLUMNS
+
+    :return:
+    '''
+
+    return (TEST_TIMESTAMP, report_name, TEST_COMPANY_NAME, cost_centre_code, None, account_code, None, TEST_PERIOD,
+            value)
+
+
+class Test_DataImport(unittest.TestCase):
+    ''' Unit tests for the management_accounting.data_import.py module '''
+
+    def setUp(self):
+
+        self.master_data = MasterDataSnapshot(
+            version=None,
+            accounts=[TableChartOfAccounts(GLCode=5000, XeroCode="acc-rent-id", XeroMultiplier=1),
+                      TableChartOfAccounts(GLCode=4000, XeroCode="acc-revenue-id", XeroMultiplier=-1),
+                      TableChartOfAccounts(GLCode=2000, XeroCode="acc-accruals-id", XeroMultiplier=-1)],
+            nodes=[],
+            allocation_accounts=[],
+            cost_centres=[TableCostCentres(XeroCode="cc-finance-id", CostCentreCode="C000001"),
+                          TableCostCentres(XeroCode="cc-sales-id", CostCentreCode="C000002")],
+            companies=[TableCompanies(XeroName=TEST_COMPANY_NAME, CompanyCode=10)])
+
+    def test_get_xero_report_matrices(self):
+        ''' Rows should be loaded into one accounts x cost centres matrix per report, with index vectors of the
+            accounts and cost centres
+
+        :return:
+        '''
+
+        xero_rows = [get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, "cc-finance-id", "acc-rent-id", 100.0),
+                     get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, "cc-sales-id", "acc-revenue-id", 250.0),
+                     get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, None, "acc-rent-id", -20.5),
+                     get_test_xero_row(r.XERO_DATA_BALANCESHEET, None, "acc-accruals-id", 79.5)]
+
+        pnl_matrix, bs_matrix = sorted(data_import.get_xero_report_matrices(xero_rows=xero_rows),
+                                       key=lambda report_matrix: report_matrix.report_name, reverse=True)
+
+        self.assertEqual(pnl_matrix.report_name, r.XERO_DATA_INCOMESTATEMENT)
+        self.assertEqual(list(pnl_matrix.account_codes), ["acc-rent-id", "acc-revenue-id"])
+        self.assertEqual(list(pnl_matrix.cost_centre_codes), ["cc-finance-id", "cc-sales-id", None])
+        self.assertEqual(pnl_matrix.values.tolist(), [[100.0, 0.0, -20.5], [0.0, 250.0, 0.0]])
+        self.assertEqual(bs_matrix.shape(), (1, 1))
+
+    def test_convert_xero_matrix_to_internal_rows(self):
+        ''' Balances should be mapped to GL codes and cost centres with the sign set by the XeroMultiplier.
+            Unassigned and unmapped balances should be left out of the Income Statement rows
+
+        :return:
+        '''
+
+        xero_rows = [get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, "cc-finance-id", "acc-rent-id", 100.0),
+                     get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, "cc-sales-id", "acc-revenue-id", 250.0),
+                     get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, None, "acc-rent-id", -20.5),
+                     get_test_xero_row(r.XERO_DATA_INCOMESTATEMENT, "cc-finance-id", "acc-unmapped-id", 5.0),
+                     get_test_xero_row(r.XERO_DATA_BALANCESHEET, None, "acc-accruals-id", 79.5)]
+
+        test_result = []
+        for report_matrix in data_import.get_xero_report_matrices(xero_rows=xero_rows):
+            pnl_rows, bs_rows = data_import.convert_xero_matrix_to_internal_rows(report_matrix=report_matrix,
+                                                                                 master_data=self.master_data,
+                                                                                 timestamp=TEST_TIMESTAMP)
+            test_result += pnl_rows + bs_rows
+
+        self.assertEqual(sorted([(row.CompanyCode, row.CostCentreCode, row.AccountCode, row.Period, row.Value)
+                                 for row in test_result]),
+                         sorted([(10, "C000001", 5000, TEST_PERIOD, 100.0),
+                                 (10, "C000002", 4000, TEST_PERIOD, -250.0),
+                                 (10, None, 2000, TEST_PERIOD, -79.5)]))
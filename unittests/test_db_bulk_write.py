@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the db_bulk_write.py module
+'''
+
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from customobjects.database_objects import TableAllocationsData
+from utils import db_bulk_write
+
+TEST_PERIOD = datetime.datetime(year=2017, month=3, day=1)
+TEST_COLUMNS = ['SendingCostCentre', 'ReceivingCostCentre', 'Period', 'GLAccount', 'Value']
+
+
+class Test_DbBulkWrite(unittest.TestCase):
+    ''' Unit tests for the utils.db_bulk_write.py module '''
+
+    def setUp(self):
+
+        engine = create_engine("sqlite://")
+        TableAllocationsData.__table__.create(bind=engine)
+        self.session = sessionmaker(bind=engine)()
+        db_bulk_write.get_bulk_write_statistics(reset=True)
+
+    def tearDown(self):
+
+        self.session.close()
+
+    def test_rows_are_inserted_in_chunks(self):
+        ''' Dictionaries, tuples and row objects should all be inserted, split into statements of chunk_size rows,
+            and the rows written should be recorded against the table
+
+        :return:
+        '''
+
+        rows = [dict(zip(TEST_COLUMNS, ("CC{}".format(index), "CC0", TEST_PERIOD, 1000, float(index))))
+                for index in range(5)]
+        rows += [("CC{}".format(index), "CC0", TEST_PERIOD, 1000, float(index)) for index in range(5, 8)]
+
+        row_count = db_bulk_write.bulk_insert_rows(session=self.session, table=TableAllocationsData,
+                                                   rows=rows[:5], chunk_size=2)
+        row_count += db_bulk_write.bulk_insert_rows(session=self.session, table=TableAllocationsData,
+                                                    rows=rows[5:], columns=TEST_COLUMNS, chunk_size=2)
+        row_count += db_bulk_write.bulk_insert_rows(session=self.session, table=TableAllocationsData,
+                                                    rows=[TableAllocationsData(SendingCostCentre="CC8",
+                                                                               ReceivingCostCentre="CC0",
+                                                                               Period=TEST_PERIOD, GLAccount=1000,
+                                                                               Value=8.0)])
+        self.session.commit()
+
+        inserted_rows = self.session.query(TableAllocationsData.SendingCostCentre, TableAllocationsData.Value)\
+            .order_by(TableAllocationsData.ID)\
+            .all()
+        self.assertEqual(row_count, 9)
+        self.assertEqual(inserted_rows, [("CC{}".format(index), float(index)) for index in range(9)])
+
+        statistics = db_bulk_write.get_bulk_write_statistics(reset=True)
+        self.assertEqual([table_statistics[:2] for table_statistics in statistics],
+                         [(TableAllocationsData.__tablename__, 9)])
+        self.assertEqual(db_bulk_write.get_bulk_write_statistics(), [])
+
+    def test_tuples_without_columns_raise_error(self):
+        ''' Tuples can't be inserted unless the order of their values is given
+
+        :return:
+        '''
+
+        self.assertRaises(ValueError, db_bulk_write.bulk_insert_rows, self.session, TableAllocationsData,
+                          [("CC1", "CC0", TEST_PERIOD, 1000, 1.0)])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the db_migrations.py module
+'''
+
+import unittest
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from customobjects.database_objects import Base, TableFinModelExtract, TableXeroExtract, TableXeroValidation
+from utils import db_migrations
+
+
+class Test_DbMigrations(unittest.TestCase):
+    ''' Unit tests for the utils.db_migrations.py module '''
+
+    def test_key_columns_are_indexed(self):
+        ''' Every index of the migration should be created, with names that are unique across the database
+
+        :return:
+        '''
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+
+        db_migrations.migrate_index_key_columns(session=session)
+        session.commit()
+        session.close()
+
+        index_count = sum(len(indexes) for table, indexes in db_migrations.KEY_COLUMN_INDEXES)
+        created_indexes = [index['name'] for table, indexes in db_migrations.KEY_COLUMN_INDEXES
+                           for index in inspect(engine).get_indexes(table.__tablename__)]
+        finmodel_indexes = inspect(engine).get_indexes(TableFinModelExtract.__tablename__)
+
+        self.assertEqual(len(set(created_indexes)), index_count)
+        self.assertEqual([index['column_names'] for index in finmodel_indexes], [['Label', 'Period']])
+
+    def test_missing_key_column_is_added(self):
+        ''' The migrations should add the key columns missing from older copies of the schema before indexing them,
+            so that the later migrations are still applied
+
+        :return:
+        '''
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        engine.execute("DROP TABLE `{}`".format(TableXeroExtract.__tablename__))
+        engine.execute("CREATE TABLE `{}` (`ID` integer PRIMARY KEY, `DateExtracted` datetime, `ReportName` text, "
+                       "`CompanyName` text, `CostCentreName` text, `AccountCode` text, `AccountName` text, "
+                       "`Period` datetime, `Value` decimal(10,3))".format(TableXeroExtract.__tablename__))
+        session = sessionmaker(bind=engine)()
+
+        db_migrations.migrate_index_key_columns(session=session)
+        db_migrations.migrate_record_xero_validation_facts(session=session)
+        session.commit()
+        session.close()
+
+        extract_columns = [column['name'] for column in inspect(engine).get_columns(TableXeroExtract.__tablename__)]
+        extract_indexes = [index['column_names'] for index in inspect(engine)
+                           .get_indexes(TableXeroExtract.__tablename__)]
+
+        self.assertIn('CostCentreCode', extract_columns)
+        self.assertIn(['CostCentreCode'], extract_indexes)
+
+    def test_existing_validation_table_is_kept(self):
+        ''' The validation facts migration should leave the table and its index alone if they already exist, as in a
+            database created from the schema file
+
+        :return:
+        '''
+
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        session = sessionmaker(bind=engine)()
+
+        for attempt in range(2):
+            db_migrations.migrate_record_xero_validation_facts(session=session)
+            session.commit()
+        session.close()
+
+        validation_indexes = inspect(engine).get_indexes(TableXeroValidation.__tablename__)
+
+        self.assertEqual([index['column_names'] for index in validation_indexes], [['Period', 'CompanyName']])
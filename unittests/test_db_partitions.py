@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the db_partitions.py module
+'''
+
+import datetime
+import unittest
+
+import references as r
+from utils import db_partitions
+
+
+class Test_DbPartitions(unittest.TestCase):
+    ''' Unit tests for the utils.db_partitions.py module '''
+
+    def test_partition_definitions(self):
+        ''' Each period should have a partition holding the days of its month, followed by the partition of later
+            periods (including across the end of a year)
+
+        :return:
+        '''
+
+        definitions = db_partitions.get_period_partition_definitions(
+            periods=[datetime.datetime(year=2017, month=12, day=1), datetime.datetime(year=2018, month=1, day=1)])
+
+        self.assertEqual(definitions.split(",\n"),
+                         ["PARTITION p201712 VALUES LESS THAN (TO_DAYS('2018-01-01'))",
+                          "PARTITION p201801 VALUES LESS THAN (TO_DAYS('2018-02-01'))",
+                          "PARTITION {} VALUES LESS THAN MAXVALUE".format(r.DB_PARTITION_FUTURE)])
+
+    def test_available_periods_are_in_order(self):
+        ''' Partitions must be defined in order, so the available periods should be returned in order
+
+        :return:
+        '''
+
+        periods = db_partitions.get_available_periods()
+
+        self.assertEqual(len(periods), len(r.AVAILABLE_PERIODS_YEARS) * len(r.AVAILABLE_PERIODS_MONTHS))
+        self.assertEqual(periods, sorted(periods))
+        self.assertEqual(db_partitions.get_period_partition_name(periods[0]),
+                         "p{}01".format(min(r.AVAILABLE_PERIODS_YEARS)))
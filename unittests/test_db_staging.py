@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the db_staging.py module
+'''
+
+import datetime
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, inspect
+
+from customobjects.database_objects import TableAllocationsData, TablePeriods
+from utils import db_staging
+from utils.db_connect import db_sessionmaker
+
+TEST_PERIOD = datetime.datetime(year=2017, month=3, day=1)
+OTHER_PERIOD = datetime.datetime(year=2017, month=4, day=1)
+
+
+class Test_DbStaging(unittest.TestCase):
+    ''' Unit tests for the utils.db_staging.py module '''
+
+    def setUp(self):
+
+        # The staging functions use sessions of their own, so the database is shared through a file
+        file_handle, self.database_path = tempfile.mkstemp(suffix=".db")
+        os.close(file_handle)
+        self.engine = create_engine("sqlite:///{}".format(self.database_path))
+        for table in [TablePeriods, TableAllocationsData]:
+            table.__table__.create(bind=self.engine)
+
+        self.original_bind = db_sessionmaker.session_factory.kw['bind']
+        db_sessionmaker.remove()
+        db_sessionmaker.configure(bind=self.engine)
+
+        session = db_sessionmaker()
+        session.add_all([TablePeriods(Period=TEST_PERIOD, IsLocked=0, IsPublished=0),
+                         TablePeriods(Period=OTHER_PERIOD, IsLocked=0, IsPublished=0)])
+        session.add_all([TableAllocationsData(SendingCostCentre="CC1", ReceivingCostCentre="CC0", Period=period,
+                                              GLAccount=1000, Value=1.0)
+                         for period in [TEST_PERIOD, OTHER_PERIOD]])
+        session.commit()
+        session.close()
+
+    def tearDown(self):
+
+        db_sessionmaker.remove()
+        db_sessionmaker.configure(bind=self.original_bind)
+        self.engine.dispose()
+        os.remove(self.database_path)
+
+    def test_period_rows_are_replaced(self):
+        ''' Only the rows of the period should be replaced, with IDs that aren't used by any other period, and the
+            staging table should be dropped afterwards
+
+        :return:
+        '''
+
+        rows = [dict(SendingCostCentre="CC{}".format(index), ReceivingCostCentre="CC0", Period=TEST_PERIOD,
+                     GLAccount=1000, Value=float(index)) for index in range(2, 5)]
+
+        row_count = db_staging.replace_period_rows(table=TableAllocationsData, year=TEST_PERIOD.year,
+                                                   month=TEST_PERIOD.month, rows=rows)
+
+        session = db_sessionmaker()
+        result = session.query(TableAllocationsData.Period, TableAllocationsData.SendingCostCentre)\
+            .order_by(TableAllocationsData.Period, TableAllocationsData.SendingCostCentre)\
+            .all()
+        ids = [id for (id,) in session.query(TableAllocationsData.ID).all()]
+        session.close()
+
+        self.assertEqual(row_count, 3)
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(result, [(TEST_PERIOD, "CC2"), (TEST_PERIOD, "CC3"), (TEST_PERIOD, "CC4"),
+                                  (OTHER_PERIOD, "CC1")])
+        self.assertEqual(inspect(self.engine).get_table_names(),
+                         [TableAllocationsData.__tablename__, TablePeriods.__tablename__])
+
+    def test_failed_build_leaves_period_untouched(self):
+        ''' If the new rows can't be built, the old rows of the period should be kept
+
+        :return:
+        '''
+
+        self.assertRaises(ValueError, db_staging.replace_period_rows, TableAllocationsData, TEST_PERIOD.year,
+                          TEST_PERIOD.month, [("CC2", "CC0", TEST_PERIOD, 1000, 2.0)])
+
+        session = db_sessionmaker()
+        result = session.query(TableAllocationsData.Period, TableAllocationsData.SendingCostCentre)\
+            .order_by(TableAllocationsData.Period)\
+            .all()
+        session.close()
+
+        self.assertEqual(result, [(TEST_PERIOD, "CC1"), (OTHER_PERIOD, "CC1")])
+        self.assertEqual(inspect(self.engine).get_table_names(),
+                         [TableAllocationsData.__tablename__, TablePeriods.__tablename__])
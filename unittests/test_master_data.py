@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the master_data.py module
+'''
+
+import os
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from customobjects.database_objects import \
+    TableChartOfAccounts, \
+    TableNodeHierarchy, \
+    TableAllocationAccounts, \
+    TableCostCentres, \
+    TableCompanies
+import customobjects.error_objects
+from utils import master_data
+from utils.db_connect import db_sessionmaker
+
+
+class Test_MasterData(unittest.TestCase):
+    ''' Unit tests for the utils.master_data.py module '''
+
+    def setUp(self):
+
+        engine = create_engine("sqlite://")
+        for table in master_data.MASTER_DATA_TABLES:
+            table.__table__.create(bind=engine)
+        self.session = sessionmaker(bind=engine)()
+
+        self.session.add_all([
+            TableChartOfAccounts(GLCode=5000, GLName="Rent", XeroCode="acc-rent-id", XeroName="Rent",
+                                 L3Code="L3-RENT", L3Name="Rent", XeroMultiplier=1),
+            TableChartOfAccounts(GLCode=4000, GLName="Revenue", XeroCode="acc-revenue-id", XeroName="Sales",
+                                 L3Code="L3-REV", L3Name="Revenue", XeroMultiplier=-1),
+            TableNodeHierarchy(L0Code="L0-IS", L0Name="Income Statement", L1Code="L1-OPEX", L1Name="Opex",
+                               L2Code="L2-PREM", L2Name="Premises", L3Code="L3-RENT", L3Name="Rent"),
+            TableNodeHierarchy(L0Code="L0-IS", L0Name="Income Statement", L1Code="L1-REV", L1Name="Revenue",
+                               L2Code="L2-REV", L2Name="Revenue", L3Code="L3-REV", L3Name="Revenue"),
+            TableAllocationAccounts(GLCode=9000, GLName="Allocated premises", L2Hierarchy="L2-PREM"),
+            TableCostCentres(XeroName="Finance", XeroCode="cc-finance-id", CostCentreName="Finance",
+                             CostCentreCode="C000001", AllocationTier=2),
+            TableCompanies(XeroName="Test Company Ltd", CompanyName="Test Company", CompanyCode=10),
+        ])
+        self.session.commit()
+
+    def tearDown(self):
+
+        self.session.close()
+
+    def test_snapshot_lookups(self):
+        ''' The snapshot should resolve the mappings previously made by joins, including codes held as text, and
+            return None for anything that isn't in the master data
+
+        :return:
+        '''
+
+        version = master_data.get_master_data_version(session=self.session)
+        snapshot = master_data.load_master_data_snapshot(session=self.session, version=version)
+
+        coa, node = snapshot.get_account_node("5000")
+        self.assertEqual((coa.GLName, node.L2Code), ("Rent", "L2-PREM"))
+        self.assertEqual(snapshot.accounts_by_xero_code["acc-revenue-id"].GLCode, 4000)
+        self.assertEqual(snapshot.get_allocation_account(5000).GLCode, 9000)
+        self.assertEqual(snapshot.get_allocation_account(4000), None)
+        self.assertEqual(snapshot.get_account_node(1234), None)
+        self.assertEqual(snapshot.get_company("10").CompanyName, "Test Company")
+        self.assertEqual(snapshot.get_cost_centre("C000001").AllocationTier, 2)
+        self.assertEqual(snapshot.cost_centres_by_xero_code.keys(), ["cc-finance-id"])
+
+    def test_duplicate_xero_code_raises_error(self):
+        ''' A Xero code mapped to more than one cost centre can't be resolved to a single row, so the snapshot
+            shouldn't be built
+
+        :return:
+        '''
+
+        self.session.add(TableCostCentres(XeroName="Finance (Old)", XeroCode="cc-finance-id", CostCentreName="Finance",
+                                          CostCentreCode="C000002", AllocationTier=2))
+        self.session.commit()
+
+        version = master_data.get_master_data_version(session=self.session)
+
+        self.assertRaises(customobjects.error_objects.MasterDataIncompleteError, master_data.load_master_data_snapshot,
+                          session=self.session, version=version)
+
+    def test_version_changes_with_master_data(self):
+        ''' The version should only change when the contents of a master data table change
+
+        :return:
+        '''
+
+        version = master_data.get_master_data_version(session=self.session)
+        self.assertEqual(master_data.get_master_data_version(session=self.session), version)
+
+        self.session.query(TableCostCentres).filter(TableCostCentres.CostCentreCode == "C000001")\
+            .update({TableCostCentres.AllocationTier: 1})
+        self.session.commit()
+
+        self.assertNotEqual(master_data.get_master_data_version(session=self.session), version)
+
+    def test_snapshot_is_only_checked_for_changes_once_per_interval(self):
+        ''' A change to the master data shouldn't be picked up until the check interval has passed, unless the
+            snapshot is refreshed
+
+        :return:
+        '''
+
+        # The snapshot is loaded in a session of its own, so the database is shared through a file
+        file_handle, database_path = tempfile.mkstemp(suffix=".db")
+        os.close(file_handle)
+        engine = create_engine("sqlite:///{}".format(database_path))
+        for table in master_data.MASTER_DATA_TABLES:
+            table.__table__.create(bind=engine)
+
+        original_bind = db_sessionmaker.session_factory.kw['bind']
+        db_sessionmaker.remove()
+        db_sessionmaker.configure(bind=engine)
+        master_data.clear_master_data_snapshot()
+        try:
+            session = db_sessionmaker()
+            session.add(TableCostCentres(XeroName="Finance", XeroCode="cc-finance-id", CostCentreName="Finance",
+                                         CostCentreCode="C000001", AllocationTier=2))
+            session.commit()
+
+            snapshot = master_data.get_master_data_snapshot()
+
+            session.query(TableCostCentres).update({TableCostCentres.AllocationTier: 1})
+            session.commit()
+            session.close()
+
+            self.assertIs(master_data.get_master_data_snapshot(), snapshot)
+            self.assertEqual(master_data.get_master_data_snapshot(refresh=True).get_cost_centre("C000001")
+                             .AllocationTier, 1)
+        finally:
+            master_data.clear_master_data_snapshot()
+            db_sessionmaker.remove()
+            db_sessionmaker.configure(bind=original_bind)
+            engine.dispose()
+            os.remove(database_path)
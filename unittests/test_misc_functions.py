@@ -44,3 +44,36 @@ class Test_MiscFunctions(unittest.TestCase):
                 self.assertRaises(error_objects.PeriodNotFoundError, utils.data_integrity.check_period_exists, error_year, correct_month)
                 self.assertRaises(error_objects.PeriodNotFoundError, utils.data_integrity.check_period_exists, error_year, error_month)
                 self.assertRaises(error_objects.PeriodNotFoundError, utils.data_integrity.check_period_exists, correct_year, error_month)
+
+    def test_get_periods_in_range(self):
+        ''' get_periods_in_range should return every period between the two dates, including across year ends
+
+        :return:
+        '''
+
+        test_result = misc_functions.get_periods_in_range(from_year=2017, from_month=11, to_year=2018, to_month=2)
+        expected_result = [(2017, 11), (2017, 12), (2018, 1), (2018, 2)]
+        self.assertEqual(test_result, expected_result)
+
+        self.assertRaises(error_objects.PeriodNotFoundError, misc_functions.get_periods_in_range, 2018, 2, 2017, 11)
+
+    def test_get_consecutive_period_batches(self):
+        ''' get_consecutive_period_batches should split the periods at gaps and at the maximum batch size
+
+        :return:
+        '''
+
+        periods = [(2018, 2), (2017, 11), (2017, 12), (2018, 1), (2018, 5)]
+        test_result = misc_functions.get_consecutive_period_batches(periods=periods, batch_size=3)
+        expected_result = [[(2017, 11), (2017, 12), (2018, 1)], [(2018, 2)], [(2018, 5)]]
+        self.assertEqual(test_result, expected_result)
+
+    def test_convert_period_string_to_year_month(self):
+        ''' convert_period_string_to_year_month should accept both YYYY.MM and YYYY-MM formats
+
+        :return:
+        '''
+
+        self.assertEqual(misc_functions.convert_period_string_to_year_month("2017.3"), (2017, 3))
+        self.assertEqual(misc_functions.convert_period_string_to_year_month("2017-03"), (2017, 3))
+        self.assertRaises(error_objects.PeriodNotFoundError, misc_functions.convert_period_string_to_year_month, "March")
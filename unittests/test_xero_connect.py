@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the xero_connect.py module
+'''
+
+import datetime
+import json
+import shutil
+import tempfile
+import unittest
+
+import references as r
+import references_private as rp
+from customobjects.error_objects import XeroRateLimitError
+from utils import xero_cache, xero_connect
+
+TEST_PERIOD_YEAR = 2017
+TEST_PERIOD_MONTH = 3
+
+TEST_COMPANY_NAME = "Test Company Ltd"
+TEST_COST_CENTRE_DICT = {'Finance': 'cc-finance-id', 'Sales': 'cc-sales-id'}
+
+
+def get_test_pnl_data():
+    ''' Returns a Profit & Loss report (split by cost centre) in the format returned by the Xero API
+
+    :return:
+    '''
+
+    return {
+        'ReportID': r.XERO_DATA_INCOMESTATEMENT,
+        'ReportTitles': ['Profit and Loss', TEST_COMPANY_NAME, '1 March 2017 to 31 March 2017'],
+        'Rows': [
+            {'RowType': 'Header', 'Cells': [{'Value': ''}, {'Value': 'Finance'}, {'Value': 'Sales'},
+                                            {'Value': r.XERO_DATA_COSTCENTRES_UNASSIGNED}, {'Value': 'Total'}]},
+            {'RowType': 'Section', 'Rows': [
+                {'RowType': 'Row', 'Cells': [{'Value': 'Rent', 'Attributes': [{'Value': 'acc-rent-id', 'Id': 'account'}]},
+                                             {'Value': '100.00'}, {'Value': '0.00'}, {'Value': '-20.50'},
+                                             {'Value': '79.50'}]},
+                {'RowType': 'Row', 'Cells': [{'Value': 'Travel', 'Attributes': [{'Value': 'acc-travel-id', 'Id': 'account'}]},
+                                             {'Value': ''}, {'Value': '35.00'}, {'Value': '0.00'},
+                                             {'Value': '35.00'}]},
+                {'RowType': 'SummaryRow', 'Cells': [{'Value': 'Total Operating Expenses'}, {'Value': '100.00'},
+                                                    {'Value': '35.00'}, {'Value': '-20.50'}, {'Value': '114.50'}]},
+            ]},
+        ],
+    }
+
+def get_test_balancesheet_data():
+    ''' Returns a Balance Sheet report in the format returned by the Xero API
+
+    :return:
+    '''
+
+    return {
+        'ReportID': r.XERO_DATA_BALANCESHEET,
+        'ReportTitles': ['Balance Sheet', TEST_COMPANY_NAME, 'As at 31 March 2017'],
+        'Rows': [
+            {'RowType': 'Header', 'Cells': [{'Value': ''}, {'Value': '31 Mar 2017'}, {'Value': '31 Mar 2016'}]},
+            {'RowType': 'Section', 'Rows': [
+                {'RowType': 'Row', 'Cells': [{'Value': 'Bank', 'Attributes': [{'Value': 'acc-bank-id', 'Id': 'account'}]},
+                                             {'Value': '500.00'}, {'Value': '250.00'}]},
+                {'RowType': 'Row', 'Cells': [{'Value': 'Debtors', 'Attributes': [{'Value': 'acc-debtors-id', 'Id': 'account'}]},
+                                             {'Value': '0.00'}, {'Value': '10.00'}]},
+                {'RowType': 'SummaryRow', 'Cells': [{'Value': 'Total Assets'}, {'Value': '500.00'}, {'Value': '260.00'}]},
+            ]},
+        ],
+    }
+
+
+class Test_XeroConnect(unittest.TestCase):
+    ''' Unit tests for the utils.xero_connect.py module '''
+
+    def test_iter_xero_pnl_body_rows_excludes_zero_values(self):
+        ''' iter_xero_pnl_body_rows should only yield the non-zero balances of each account and cost centre
+
+        :return:
+        '''
+
+        xero_data = get_test_pnl_data()
+        list_of_cost_centres = xero_connect.get_list_of_cost_centres(xero_data=xero_data)
+
+        test_result = list(xero_connect.iter_xero_pnl_body_rows(xero_data=xero_data,
+                                                                list_of_cost_centres=list_of_cost_centres,
+                                                                cost_centre_dict=TEST_COST_CENTRE_DICT,
+                                                                year=TEST_PERIOD_YEAR,
+                                                                month=TEST_PERIOD_MONTH))
+
+        test_values = sorted([(row[3], row[5], row[8]) for row in test_result])
+        expected_values = sorted([('cc-finance-id', 'acc-rent-id', 100.0),
+                                  (None, 'acc-rent-id', -20.5),
+                                  ('cc-sales-id', 'acc-travel-id', 35.0)])
+        self.assertEqual(test_values, expected_values)
+
+        for row in test_result:
+            self.assertEqual(len(row), len(xero_connect.XERO_EXTRACT_COLUMNS))
+            self.assertEqual(row[2], TEST_COMPANY_NAME)
+            self.assertEqual(row[7], datetime.datetime(year=TEST_PERIOD_YEAR, month=TEST_PERIOD_MONTH, day=1))
+
+    def test_iter_xero_balancesheet_body_rows_uses_current_period_column(self):
+        ''' iter_xero_balancesheet_body_rows should ignore the prior year comparator and zero balances
+
+        :return:
+        '''
+
+        test_result = list(xero_connect.iter_xero_balancesheet_body_rows(xero_data=get_test_balancesheet_data(),
+                                                                         year=TEST_PERIOD_YEAR,
+                                                                         month=TEST_PERIOD_MONTH))
+
+        self.assertEqual([(row[5], row[8]) for row in test_result], [('acc-bank-id', 500.0)])
+
+    def test_get_xero_extract_changes(self):
+        ''' Only new, changed and vanished balances should be returned by the comparison
+
+        :return:
+        '''
+
+        period = datetime.datetime(year=TEST_PERIOD_YEAR, month=TEST_PERIOD_MONTH, day=1)
+        existing_rows = [(1, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-finance-id', 'acc-rent-id', 100.0),
+                         (2, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-sales-id', 'acc-rent-id', 50.0),
+                         (3, r.XERO_DATA_BALANCESHEET, TEST_COMPANY_NAME, None, 'acc-bank-id', 500.0)]
+        new_rows = [(None, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-finance-id', 'Finance',
+                     'acc-rent-id', 'Rent', period, 100.0004),
+                    (None, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-sales-id', 'Sales',
+                     'acc-travel-id', 'Travel', period, 35.0),
+                    (None, r.XERO_DATA_BALANCESHEET, TEST_COMPANY_NAME, None, None,
+                     'acc-bank-id', 'Bank', period, 450.0)]
+
+        rows_to_insert, rows_to_update, rows_to_delete = xero_connect.get_xero_extract_changes(existing_rows=existing_rows,
+                                                                                              rows=new_rows)
+
+        self.assertEqual(rows_to_insert, [new_rows[1]])
+        self.assertEqual(rows_to_update, [(3, 500.0, new_rows[2])])
+        self.assertEqual(rows_to_delete, [(2, (r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-sales-id',
+                                               'acc-rent-id'), 50.0)])
+
+    def test_iter_xero_rows_recording_validation_facts(self):
+        ''' The rows should be passed through unchanged, with the total and unassigned balance of each account
+            recorded as they are streamed
+
+        :return:
+        '''
+
+        period = datetime.datetime(year=TEST_PERIOD_YEAR, month=TEST_PERIOD_MONTH, day=1)
+        rows = [(period, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, cost_centre_code, cost_centre_name,
+                 'acc-rent-id', 'Rent', period, value)
+                for cost_centre_code, cost_centre_name, value in [('cc-finance-id', 'Finance', 100.0),
+                                                                  (None, rp.XERO_UNASSIGNED_CC, -20.5),
+                                                                  ('cc-sales-id', 'Sales', 35.0)]]
+
+        facts = {}
+        test_result = list(xero_connect.iter_xero_rows_recording_validation_facts(rows=iter(rows), facts=facts))
+
+        self.assertEqual(test_result, rows)
+        self.assertEqual(facts, {(period, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'acc-rent-id'):
+                                 ['Rent', 114.5, -20.5]})
+
+    def test_xero_request_scheduler_waits_for_rate_limits(self):
+        ''' Requests beyond the per-minute limit, or after a rate limited response, should wait rather than be sent
+
+        :return:
+        '''
+
+        clock = {'now': 0.0}
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            clock['now'] += seconds
+
+        scheduler = xero_connect.XeroRequestScheduler(per_minute=2, per_day=100, max_wait=100,
+                                                      clock=lambda: clock['now'], sleep=sleep)
+        for i in range(3):
+            scheduler.acquire()
+        self.assertEqual(len(sleeps), 1)
+        self.assertAlmostEqual(sleeps[0], 30.0)
+
+        scheduler.throttle(attempt=0, retry_after=10)
+        scheduler.acquire()
+        self.assertGreaterEqual(sum(sleeps[1:]), 10)
+        self.assertEqual(scheduler.get_counters(), {'requests': 4, 'queued': 2, 'throttled': 0, 'retried': 0})
+
+        scheduler.update_limits({'X-DayLimit-Remaining': '0'})
+        with self.assertRaises(XeroRateLimitError):
+            scheduler.acquire()
+
+    def test_rate_limited_request_is_counted_as_throttled_and_retried(self):
+        ''' Every rate limited response should be counted as throttled, but only the requests sent again should be
+            counted as retried
+
+        :return:
+        '''
+
+        class RateLimitedResponse(object):
+            status_code = 429
+            headers = {'Retry-After': '1'}
+            text = ''
+
+        class RateLimitedSession(object):
+            def get(self, url, **kwargs):
+                return RateLimitedResponse()
+
+        clock = {'now': 0.0}
+
+        def sleep(seconds):
+            clock['now'] += seconds
+
+        company_code = xero_connect.get_xero_company_code()
+        scheduler = xero_connect.XeroRequestScheduler(per_minute=100, per_day=1000, max_wait=100,
+                                                      clock=lambda: clock['now'], sleep=sleep)
+
+        http_session = xero_connect._http_session
+        request_schedulers = dict(xero_connect._request_schedulers)
+        xero_connect._http_session = RateLimitedSession()
+        xero_connect._request_schedulers[company_code] = scheduler
+        try:
+            with self.assertRaises(XeroRateLimitError):
+                xero_connect.send_xero_request(url='https://api.xero.com/test', company_code=company_code)
+        finally:
+            xero_connect._http_session = http_session
+            xero_connect._request_schedulers.clear()
+            xero_connect._request_schedulers.update(request_schedulers)
+
+        self.assertEqual(scheduler.get_counters(), {'requests': r.XERO_MAX_RETRIES + 1, 'queued': r.XERO_MAX_RETRIES,
+                                                    'throttled': r.XERO_MAX_RETRIES + 1,
+                                                    'retried': r.XERO_MAX_RETRIES})
+
+    def test_replayed_report_is_dated_when_retrieved(self):
+        ''' A report replayed from the local Xero cache should be dated when it was retrieved from Xero rather than
+            when it is replayed, so that journals posted since are still applied by the journal sync
+
+        :return:
+        '''
+
+        fetched_at = datetime.datetime(year=2017, month=4, day=3, hour=9, minute=30)
+        params = {'date': '2017-03-31'}
+
+        cache_directory = r.XERO_CACHE_DIRECTORY
+        r.XERO_CACHE_DIRECTORY = tempfile.mkdtemp()
+        try:
+            xero_cache.write_cached_response(endpoint='Reports/BalanceSheet', params=params,
+                                             response_text=json.dumps({'Reports': [get_test_balancesheet_data()]}),
+                                             company_code=xero_connect.get_xero_company_code(),
+                                             fetched_at=fetched_at)
+            xero_data = xero_connect.xero_api_get_report('Reports/BalanceSheet', params=params)
+        finally:
+            shutil.rmtree(r.XERO_CACHE_DIRECTORY)
+            r.XERO_CACHE_DIRECTORY = cache_directory
+
+        test_result = list(xero_connect.iter_xero_balancesheet_body_rows(xero_data=xero_data,
+                                                                         year=TEST_PERIOD_YEAR,
+                                                                         month=TEST_PERIOD_MONTH,
+                                                                         timestamp=datetime.datetime.now()))
+
+        self.assertEqual([(row[0], row[5]) for row in test_result], [(fetched_at, 'acc-bank-id')])
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the xero_files.py module
+'''
+
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import references as r
+from customobjects.error_objects import MasterDataIncompleteError
+from utils import xero_files
+
+TEST_COMPANY_NAME = "Test Company Ltd"
+TEST_TIMESTAMP = datetime.datetime(year=2017, month=4, day=1)
+TEST_ACCOUNT_MAPPING = {'Rent': 'acc-rent-id', 'Travel': 'acc-travel-id'}
+TEST_COST_CENTRE_MAPPING = {'Finance': 'cc-finance-id', 'Sales': 'cc-sales-id'}
+
+TEST_PNL_CSV = '''Profit and Loss
+{}
+For the month ended 31 March 2017
+
+,Finance,Sales,Unassigned,Total
+Operating Expenses
+Rent,100.00,,"(20.50)",79.50
+Travel,,"1,035.00",0.00,"1,035.00"
+Total Operating Expenses,100.00,"1,035.00",(20.50),"1,114.50"
+
+Net Profit,-100.00,"-1,035.00",20.50,"-1,114.50"
+'''.format(TEST_COMPANY_NAME)
+
+
+class Test_XeroFiles(unittest.TestCase):
+    ''' Unit tests for the utils.xero_files.py module '''
+
+    def setUp(self):
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.directory)
+
+    def write_test_file(self, file_name, contents):
+
+        filepath = os.path.join(self.directory, file_name)
+        with open(filepath, 'wb') as test_file:
+            test_file.write(contents)
+        return filepath
+
+    def test_csv_report_is_parsed(self):
+        ''' An exported Profit & Loss should be parsed into the same rows as the report retrieved from the API,
+            with accounts and cost centres mapped by name and the totals rows excluded
+
+        :return:
+        '''
+
+        self.write_test_file("{}-2017-03.csv".format(r.XERO_DATA_INCOMESTATEMENT), TEST_PNL_CSV)
+        self.write_test_file("notes.txt", "Not a report")
+
+        report_files = xero_files.get_xero_report_files(self.directory)
+        self.assertEqual([report_file[1:] for report_file in report_files],
+                         [(r.XERO_DATA_INCOMESTATEMENT, 2017, 3)])
+
+        company_name, rows = xero_files.parse_xero_report_file(report_file=report_files[0],
+                                                               account_mapping=TEST_ACCOUNT_MAPPING,
+                                                               cost_centre_mapping=TEST_COST_CENTRE_MAPPING,
+                                                               timestamp=TEST_TIMESTAMP)
+
+        period = datetime.datetime(year=2017, month=3, day=1)
+        expected_rows = [
+            (TEST_TIMESTAMP, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-finance-id', 'Finance',
+             'acc-rent-id', 'Rent', period, 100.0),
+            (TEST_TIMESTAMP, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, None, r.XERO_DATA_COSTCENTRES_UNASSIGNED,
+             'acc-rent-id', 'Rent', period, -20.5),
+            (TEST_TIMESTAMP, r.XERO_DATA_INCOMESTATEMENT, TEST_COMPANY_NAME, 'cc-sales-id', 'Sales',
+             'acc-travel-id', 'Travel', period, 1035.0),
+        ]
+
+        self.assertEqual(company_name, TEST_COMPANY_NAME)
+        self.assertEqual(rows, expected_rows)
+
+    def test_report_file_is_dated_when_exported(self):
+        ''' The rows of an exported report should be dated when the report was exported rather than when it is
+            imported, so that journals posted since are still applied by the journal sync
+
+        :return:
+        '''
+
+        filepath = self.write_test_file("{}-2017-03.csv".format(r.XERO_DATA_INCOMESTATEMENT), TEST_PNL_CSV)
+        os.utime(filepath, (time.mktime(TEST_TIMESTAMP.timetuple()), time.mktime(TEST_TIMESTAMP.timetuple())))
+
+        company_name, rows = xero_files.parse_xero_report_file(report_file=(filepath, r.XERO_DATA_INCOMESTATEMENT,
+                                                                            2017, 3),
+                                                               account_mapping=TEST_ACCOUNT_MAPPING,
+                                                               cost_centre_mapping=TEST_COST_CENTRE_MAPPING)
+
+        self.assertEqual(set([row[0] for row in rows]), set([TEST_TIMESTAMP]))
+
+    def test_unmapped_account_raises_error(self):
+        ''' An account that isn't in the Chart of Accounts should abort the import of the file
+
+        :return:
+        '''
+
+        filepath = self.write_test_file("{}-2017-03.csv".format(r.XERO_DATA_INCOMESTATEMENT), TEST_PNL_CSV)
+        report_file = (filepath, r.XERO_DATA_INCOMESTATEMENT, 2017, 3)
+
+        self.assertRaises(MasterDataIncompleteError, xero_files.parse_xero_report_file, report_file,
+                          {'Rent': 'acc-rent-id'}, TEST_COST_CENTRE_MAPPING)
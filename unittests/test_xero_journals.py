@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the xero_journals.py module
+'''
+
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from customobjects.database_objects import TablePeriods
+import customobjects.error_objects
+import references as r
+from utils import xero_journals
+
+TEST_FINANCIAL_YEAR_END_MONTH = 12
+
+TEST_EXTRACTED = datetime.datetime(year=2017, month=4, day=5)
+
+
+def get_test_journal(journal_date, created):
+    ''' Returns a journal posting rent (tracked against the Finance cost centre) to accruals
+
+    :param journal_date: Datetime the journal is dated
+    :param created: UTC datetime the journal was created
+    :return:
+    '''
+
+    return {'JournalNumber': 1,
+            'JournalDate': journal_date,
+            'CreatedDateUTC': created,
+            'JournalLines': [{'AccountID': 'acc-rent-id', 'AccountName': 'Rent', 'AccountType': 'OVERHEADS',
+                              'NetAmount': 100.0,
+                              'TrackingCategories': [{'Name': r.XERO_DATA_COSTCENTRES, 'Option': 'Finance',
+                                                      'TrackingOptionID': 'cc-finance-id'}]},
+                             {'AccountID': 'acc-accruals-id', 'AccountName': 'Accruals', 'AccountType': 'CURRLIAB',
+                              'NetAmount': -100.0, 'TrackingCategories': []}]}
+
+
+class Test_XeroJournals(unittest.TestCase):
+    ''' Unit tests for the utils.xero_journals.py module '''
+
+    def setUp(self):
+
+        periods = [datetime.datetime(year=2017, month=month, day=1) for month in [11, 12]]
+        periods.append(datetime.datetime(year=2018, month=1, day=1))
+        self.extracted_periods = {}
+        for period in periods:
+            self.extracted_periods[(r.XERO_DATA_INCOMESTATEMENT, period)] = TEST_EXTRACTED
+            self.extracted_periods[(r.XERO_DATA_BALANCESHEET, period)] = TEST_EXTRACTED
+
+    def test_late_journal_is_applied_to_later_periods(self):
+        ''' A journal created after the periods were extracted should change the Income Statement of its own period,
+            and the Balance Sheet (including Current Year Earnings) of its period and the later periods in the same
+            financial year. Balance Sheets in the next financial year should be left unchanged and returned as stale
+
+        :return:
+        '''
+
+        november = datetime.datetime(year=2017, month=11, day=1)
+        december = datetime.datetime(year=2017, month=12, day=1)
+        january = datetime.datetime(year=2018, month=1, day=1)
+
+        journal = get_test_journal(journal_date=datetime.datetime(year=2017, month=11, day=30),
+                                   created=TEST_EXTRACTED + datetime.timedelta(days=1))
+        deltas, stale_periods = xero_journals.get_journal_deltas(journals=[journal],
+                                                                 extracted_periods=self.extracted_periods,
+                                                                 financial_year_end_month=TEST_FINANCIAL_YEAR_END_MONTH)
+
+        expected_deltas = {(r.XERO_DATA_INCOMESTATEMENT, 'cc-finance-id', 'acc-rent-id', november):
+                               [100.0, 'Rent', 'Finance']}
+        for period in [november, december]:
+            expected_deltas[(r.XERO_DATA_BALANCESHEET, None, 'acc-accruals-id', period)] = [100.0, 'Accruals', None]
+            expected_deltas[(r.XERO_DATA_BALANCESHEET, None, r.XERO_CURRENT_YEAR_EARNINGS_ACCOUNT, period)] = \
+                [-100.0, r.XERO_CURRENT_YEAR_EARNINGS_NAME, None]
+
+        self.assertEqual(deltas, expected_deltas)
+        self.assertEqual(stale_periods, set([january]))
+
+    def test_journal_included_in_extract_is_skipped(self):
+        ''' A journal created before the periods were extracted is already included in the extract
+
+        :return:
+        '''
+
+        journal = get_test_journal(journal_date=datetime.datetime(year=2017, month=11, day=30),
+                                   created=TEST_EXTRACTED - datetime.timedelta(days=1))
+        deltas, stale_periods = xero_journals.get_journal_deltas(journals=[journal],
+                                                                 extracted_periods=self.extracted_periods,
+                                                                 financial_year_end_month=TEST_FINANCIAL_YEAR_END_MONTH)
+
+        self.assertEqual(deltas, {})
+        self.assertEqual(stale_periods, set())
+
+    def test_journal_in_locked_period_is_not_applied(self):
+        ''' Changes to a locked period should be left out and the period returned, while the changes to the later
+            periods that aren't locked are still applied
+
+        :return:
+        '''
+
+        november = datetime.datetime(year=2017, month=11, day=1)
+        december = datetime.datetime(year=2017, month=12, day=1)
+
+        engine = create_engine("sqlite://")
+        TablePeriods.__table__.create(bind=engine)
+        session = sessionmaker(bind=engine)()
+        session.add_all([TablePeriods(Period=november, IsLocked=1, IsPublished=1),
+                         TablePeriods(Period=december, IsLocked=0, IsPublished=0)])
+        session.commit()
+
+        journal = get_test_journal(journal_date=datetime.datetime(year=2017, month=11, day=30),
+                                   created=TEST_EXTRACTED + datetime.timedelta(days=1))
+        deltas, stale_periods = xero_journals.get_journal_deltas(journals=[journal],
+                                                                 extracted_periods=self.extracted_periods,
+                                                                 financial_year_end_month=TEST_FINANCIAL_YEAR_END_MONTH)
+        locked_periods = xero_journals.get_locked_periods(session=session,
+                                                          periods=list(set([key[3] for key in deltas])))
+        deltas, locked_periods = xero_journals.exclude_locked_period_deltas(deltas=deltas,
+                                                                            locked_periods=locked_periods)
+        session.close()
+
+        expected_deltas = {(r.XERO_DATA_BALANCESHEET, None, 'acc-accruals-id', december): [100.0, 'Accruals', None],
+                           (r.XERO_DATA_BALANCESHEET, None, r.XERO_CURRENT_YEAR_EARNINGS_ACCOUNT, december):
+                               [-100.0, r.XERO_CURRENT_YEAR_EARNINGS_NAME, None]}
+
+        self.assertEqual(deltas, expected_deltas)
+        self.assertEqual(locked_periods, set([november]))
+
+    def test_payroll_journal_is_applied_to_income_statement(self):
+        ''' Wages are posted to a WAGESEXPENSE account, which is reported in the Income Statement, against a
+            WAGESPAYABLELIABILITY account, which has a credit balance
+
+        :return:
+        '''
+
+        november = datetime.datetime(year=2017, month=11, day=1)
+        december = datetime.datetime(year=2017, month=12, day=1)
+
+        journal = get_test_journal(journal_date=datetime.datetime(year=2017, month=11, day=30),
+                                   created=TEST_EXTRACTED + datetime.timedelta(days=1))
+        journal['JournalLines'][0].update({'AccountID': 'acc-wages-id', 'AccountName': 'Wages',
+                                           'AccountType': 'WAGESEXPENSE'})
+        journal['JournalLines'][1].update({'AccountID': 'acc-wages-payable-id', 'AccountName': 'Wages Payable',
+                                           'AccountType': 'WAGESPAYABLELIABILITY'})
+        deltas, stale_periods = xero_journals.get_journal_deltas(journals=[journal],
+                                                                 extracted_periods=self.extracted_periods,
+                                                                 financial_year_end_month=TEST_FINANCIAL_YEAR_END_MONTH)
+
+        expected_deltas = {(r.XERO_DATA_INCOMESTATEMENT, 'cc-finance-id', 'acc-wages-id', november):
+                               [100.0, 'Wages', 'Finance']}
+        for period in [november, december]:
+            expected_deltas[(r.XERO_DATA_BALANCESHEET, None, 'acc-wages-payable-id', period)] = \
+                [100.0, 'Wages Payable', None]
+            expected_deltas[(r.XERO_DATA_BALANCESHEET, None, r.XERO_CURRENT_YEAR_EARNINGS_ACCOUNT, period)] = \
+                [-100.0, r.XERO_CURRENT_YEAR_EARNINGS_NAME, None]
+
+        self.assertEqual(deltas, expected_deltas)
+        self.assertEqual(stale_periods, set([datetime.datetime(year=2018, month=1, day=1)]))
+
+    def test_unknown_account_type_raises_error(self):
+        ''' A journal line posted to an account type that isn't recognised can't be assigned to either report
+
+        :return:
+        '''
+
+        journal = get_test_journal(journal_date=datetime.datetime(year=2017, month=11, day=30),
+                                   created=TEST_EXTRACTED + datetime.timedelta(days=1))
+        journal['JournalLines'][1]['AccountType'] = 'UNKNOWNTYPE'
+
+        self.assertRaises(customobjects.error_objects.MasterDataIncompleteError, xero_journals.get_journal_deltas,
+                          journals=[journal], extracted_periods=self.extracted_periods,
+                          financial_year_end_month=TEST_FINANCIAL_YEAR_END_MONTH)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Contains unit tests for the xero_standin.py module
+'''
+
+import datetime
+import unittest
+
+from utils import xero_connect, xero_standin
+
+TEST_ACCOUNTS = 20
+TEST_COST_CENTRES = 5
+TEST_TIMESTAMP = datetime.datetime(year=2018, month=3, day=1)
+
+
+class Test_XeroStandIn(unittest.TestCase):
+    ''' Unit tests for the utils.xero_standin.py module '''
+
+    def test_standin_profit_and_loss_is_parsed(self):
+        ''' The synthetic Profit & Loss should parse into rows of every account and cost centre (including the
+            Unassigned cost centre) and be identical for repeated requests for the same period
+
+        :return:
+        '''
+
+        xero_data = xero_standin.create_standin_profit_and_loss(from_date="2017-01-01",
+                                                                account_count=TEST_ACCOUNTS,
+                                                                cost_centre_count=TEST_COST_CENTRES,
+                                                                density=0.5)['Reports'][0]
+        tracking_categories = xero_standin.create_standin_tracking_categories(cost_centre_count=TEST_COST_CENTRES)
+
+        list_of_cost_centres = xero_connect.get_list_of_cost_centres(xero_data=xero_data)
+        cost_centre_dict = xero_connect.get_cost_centre_id_dictionary(
+            categories=tracking_categories['TrackingCategories'])
+        rows = list(xero_connect.iter_xero_pnl_body_rows(xero_data=xero_data,
+                                                         list_of_cost_centres=list_of_cost_centres,
+                                                         cost_centre_dict=cost_centre_dict, year=2017, month=1,
+                                                         timestamp=TEST_TIMESTAMP))
+
+        self.assertEqual(len(set([row[5] for row in rows])), TEST_ACCOUNTS)
+        self.assertEqual(len(set([row[3] for row in rows])), TEST_COST_CENTRES + 1)
+        self.assertEqual(xero_data, xero_standin.create_standin_profit_and_loss(from_date="2017-01-01",
+                                                                                account_count=TEST_ACCOUNTS,
+                                                                                cost_centre_count=TEST_COST_CENTRES,
+                                                                                density=0.5)['Reports'][0])
+
+    def test_standin_balance_sheet_periods_are_split(self):
+        ''' Splitting a multi-period Balance Sheet should give the same balances as requesting each period alone
+
+        :return:
+        '''
+
+        xero_data = xero_standin.create_standin_balance_sheet(date="2018-02-28", account_count=TEST_ACCOUNTS,
+                                                              density=0.5, periods=3)['Reports'][0]
+        balance_sheets = xero_connect.split_xero_balancesheet_periods(xero_data)
+
+        self.assertEqual(sorted(balance_sheets.keys()), [(2017, 11), (2017, 12), (2018, 1), (2018, 2)])
+        for (year, month), date in [((2017, 11), "2017-11-30"), ((2018, 2), "2018-02-28")]:
+            single_period = xero_standin.create_standin_balance_sheet(date=date, account_count=TEST_ACCOUNTS,
+                                                                      density=0.5)['Reports'][0]
+            split_rows = list(xero_connect.iter_xero_balancesheet_body_rows(
+                xero_data=balance_sheets[(year, month)], year=year, month=month, timestamp=TEST_TIMESTAMP))
+            single_rows = list(xero_connect.iter_xero_balancesheet_body_rows(
+                xero_data=single_period, year=year, month=month, timestamp=TEST_TIMESTAMP))
+            self.assertEqual(split_rows, single_rows)
+
+    def test_balance_sheet_column_not_at_month_end_is_not_split(self):
+        ''' A comparative column dated before the end of its month isn't the closing balance of that period, so it
+            should be left for the period's own request
+
+        :return:
+        '''
+
+        xero_data = xero_standin.create_standin_balance_sheet(date="2018-02-28", account_count=TEST_ACCOUNTS,
+                                                              density=0.5, periods=3)['Reports'][0]
+        xero_data['Rows'][0]['Cells'][2] = {'Value': '28 Jan 2018'}
+        balance_sheets = xero_connect.split_xero_balancesheet_periods(xero_data)
+
+        self.assertEqual(sorted(balance_sheets.keys()), [(2017, 11), (2017, 12), (2018, 2)])
+
+    def test_balance_sheet_row_missing_columns_is_not_split(self):
+        ''' A row without a balance for every period can't be split, so the report should be rejected rather than
+            giving a period an account without a balance
+
+        :return:
+        '''
+
+        xero_data = xero_standin.create_standin_balance_sheet(date="2018-02-28", account_count=TEST_ACCOUNTS,
+                                                              density=0.5, periods=3)['Reports'][0]
+        account_row = xero_data['Rows'][1]['Rows'][0]
+        account_row['Cells'] = account_row['Cells'][:2]
+
+        self.assertRaises(ValueError, xero_connect.split_xero_balancesheet_periods, xero_data)
@@ -14,6 +14,7 @@ from sqlalchemy import func, asc
 import customobjects.error_objects as error_objects
 import references as r
 import utils.data_integrity
+import utils.master_data
 #import utils.misc_functions
 from customobjects.database_objects import \
     TablePeriods, \
@@ -265,34 +266,44 @@ def display_status_table():
     actuals_table = get_actuals_status_table()
     print "\n" + actuals_table
 
-    # Check whether any accounts aren't mapped to the master coa account
-    unmapped_accounts = list(set(utils.data_integrity.get_unmapped_xero_account_codes()))
-    if unmapped_accounts:
-        print "##### UNMAPPED ACCOUNTS #####\n\nThe following Xero accounts are unmapped in the chart of accounts:\n"
-        for row in unmapped_accounts:
-            print " " + str(row)
-        print "\n"
-
-    unmapped_cashflow_nodes = get_all_bs_nodes_unmapped_for_cashflow()
-    if unmapped_cashflow_nodes:
-        print "The following Balance Sheet nodes are unmapped for cash flow calculations:"
-        for row in unmapped_cashflow_nodes:
-            print " " + str(row)
-
-    try:
-       utils.data_integrity.master_data_uniquesness_check()
-    except error_objects.MasterDataIncompleteError, e:
-        print e.message
-
-    try:
-        utils.data_integrity.balance_sheet_balances_check()
-    except error_objects.BalanceSheetImbalanceError, e:
-        print e.message
-
+    # The master data checks look up the master data snapshot, which can't be loaded if a mapping column is duplicated
     try:
-        utils.data_integrity.coa_L3_nodes_in_hierarchy()
+        utils.master_data.get_master_data_snapshot()
+        master_data_loaded = True
     except error_objects.MasterDataIncompleteError, e:
         print e.message
+        master_data_loaded = False
+
+    if master_data_loaded:
+        # Check whether any accounts aren't mapped to the master coa account
+        unmapped_accounts = list(set(utils.data_integrity.get_unmapped_xero_account_codes()))
+        if unmapped_accounts:
+            print "##### UNMAPPED ACCOUNTS #####\n\nThe following Xero accounts are unmapped in the chart of accounts:\n"
+            for row in unmapped_accounts:
+                print " " + str(row)
+            print "\n"
+
+        unmapped_cashflow_nodes = get_all_bs_nodes_unmapped_for_cashflow()
+        if unmapped_cashflow_nodes:
+            print "The following Balance Sheet nodes are unmapped for cash flow calculations:"
+            for row in unmapped_cashflow_nodes:
+                print " " + str(row)
+
+        try:
+            utils.data_integrity.master_data_uniquesness_check()
+        except error_objects.MasterDataIncompleteError, e:
+            print e.message
+
+        try:
+            utils.data_integrity.check_xero_balance_sheet_is_nil(from_period=r.MODEL_START_DATE,
+                                                                 to_period=datetime.datetime.now())
+        except error_objects.BalanceSheetImbalanceError, e:
+            print e.message
+
+        try:
+            utils.data_integrity.coa_L3_nodes_in_hierarchy()
+        except error_objects.MasterDataIncompleteError, e:
+            print e.message
 
     print "##### BUDGET DATA #####"
 
@@ -19,39 +19,66 @@ from customobjects.database_objects import \
     TableNodeHierarchy, \
     TablePeriods, \
     TableFinancialStatements, \
-    TableXeroExtract, \
+    TableXeroValidation, \
     TableFinModelExtract
 from utils.db_connect import db_sessionmaker
+import utils.master_data
 import references as r
 import references_private as rp
 
-def check_unassigned_costcentres_is_nil(year, month):
+def get_unassigned_xero_balances(from_period, to_period):
+    ''' Returns the balances in the Xero data that aren't assigned to a cost centre, for a range of periods. The
+        balances are read from the validation facts recorded when the Xero data was extracted
+
+    :param from_period: Datetime of the first period in the range
+    :param to_period: Datetime of the last period in the range
+    :return: Dictionary of {period: list of (Xero account code, value) tuples}
+    '''
+
+    session = db_sessionmaker()
+    query = session.query(TableXeroValidation.Period, TableXeroValidation.AccountCode,
+                          TableXeroValidation.UnassignedValue)\
+        .filter(TableXeroValidation.UnassignedValue != 0) \
+        .filter(TableXeroValidation.Period >= from_period)\
+        .filter(TableXeroValidation.Period <= to_period)\
+        .all()
+    session.close()
+
+    unassigned_balances = {}
+    for period, account_code, value in query:
+        unassigned_balances.setdefault(period, []).append((account_code, value))
+    return unassigned_balances
+
+def check_unassigned_costcentres_is_nil(year, month, unassigned_rows=None):
     ''' Checks that any L1 nodes that must reallocate its costs has no costs that have no cost centre allocated
 
     :param year: Year of the period to check
     :param month: Month of the period to check
+    :param unassigned_rows: List of (Xero account code, value) tuples of the unassigned balances in the period, if
+                            already retrieved with get_unassigned_xero_balances
     :return:
     '''
 
-    session = db_sessionmaker()
-    date_to_check = datetime.datetime(year=year, month=month, day=1)
+    if unassigned_rows is None:
+        date_to_check = datetime.datetime(year=year, month=month, day=1)
+        unassigned_rows = get_unassigned_xero_balances(from_period=date_to_check, to_period=date_to_check)\
+            .get(date_to_check, [])
 
-    total_unassigned = session.query(TableXeroExtract, TableChartOfAccounts, TableNodeHierarchy, TableAllocationAccounts)\
-        .filter(TableXeroExtract.AccountCode==TableChartOfAccounts.XeroCode)\
-        .filter(TableChartOfAccounts.L3Code==TableNodeHierarchy.L3Code)\
-        .filter(TableNodeHierarchy.L2Code == TableAllocationAccounts.L2Hierarchy)\
-        .filter(TableXeroExtract.CostCentreName == rp.XERO_UNASSIGNED_CC) \
-        .filter(TableXeroExtract.Period==date_to_check)\
-        .all()
-    session.close()
+    # Only the balances of accounts whose costs are allocated are checked
+    master_data = utils.master_data.get_master_data_snapshot()
+    total_unassigned = []
+    for xero_code, value in unassigned_rows:
+        coa = master_data.accounts_by_xero_code.get(xero_code)
+        if coa is not None and master_data.get_allocation_account(coa.GLCode) is not None:
+            total_unassigned.append((value, master_data.nodes[coa.L3Code]))
 
-    L1_nodes = list(set([node.L1Code for xero, coa, node, alloc_ac in total_unassigned]))
+    L1_nodes = list(set([node.L1Code for value, node in total_unassigned]))
 
     is_error = False
     consolidated_error_message = ""
     # Each L1 node should net to zero so that no unassigned costs are allocated to receiver cost centres
     for L1_node in L1_nodes:
-        total_unallocated = sum([xero.Value for xero, coa, node, alloc_ac in total_unassigned if node.L1Code==L1_node])
+        total_unallocated = sum([value for value, node in total_unassigned if node.L1Code==L1_node])
         if abs(total_unallocated) > r.DEFAULT_MAX_CALC_ERROR:
             is_error = True
             consolidated_error_message += "Costs in cost centre '{}' for L1 node {} are not net flat for period {}.{} (total = {})\n"\
@@ -194,24 +221,24 @@ def coa_L3_nodes_in_hierarchy():
         raise error_objects.MasterDataIncompleteError("L3 hierarchy nodes included in {} are missing from the mapping in {}:\n{}"
                                                       .format(r.TBL_MASTER_CHARTOFACCOUNTS, r.TBL_MASTER_NODEHIERARCHY, node_error_message))
 
-def get_all_bs_nodes_unmapped_for_cashflow():
+def get_all_bs_nodes_unmapped_for_cashflow(account_codes=None):
     ''' Checks that the L2 nodes in the Balance Sheet are all captured by one of the three categories of nodes
         (operating, investment, financing) used to calculate the cash flows of the business
 
+    :param account_codes: GL account codes to check, by default all the accounts in the converted Xero data
     :return:
     '''
 
-    session = db_sessionmaker()
-    qry = session.query(TableFinancialStatements,
-                                TableChartOfAccounts,
-                                TableNodeHierarchy)\
-        .filter(TableFinancialStatements.AccountCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code==TableNodeHierarchy.L3Code)\
-        .all()
-
-    session.close()
+    if account_codes is None:
+        session = db_sessionmaker()
+        account_codes = [account_code for (account_code,) in
+                         session.query(TableFinancialStatements.AccountCode).distinct().all()]
+        session.close()
 
-    b2_L2_nodes = list(set([node.L2Code for fs, coa, node in qry if node.L0Name==r.CM_DATA_BALANCESHEET]))
+    master_data = utils.master_data.get_master_data_snapshot()
+    account_nodes = [master_data.get_account_node(account_code) for account_code in set(account_codes)]
+    b2_L2_nodes = list(set([node.L2Code for coa, node in filter(None, account_nodes)
+                            if node.L0Name==r.CM_DATA_BALANCESHEET]))
     unmapped_nodes = []
     for node in b2_L2_nodes:
         if node not in r.CM_BS_L2_OPERATING:
@@ -228,12 +255,14 @@ def get_unmapped_xero_account_codes():
     :return:
     '''
 
+    # Every account in the Xero data has a validation fact in each period it has a balance in
     session = db_sessionmaker()
-    xero_data = session.query(TableXeroExtract).all()
-    coa_data = session.query(TableChartOfAccounts).all()
-    mapped_xero_codes = list(set([row.XeroCode for row in coa_data]))
-    unmapped_rows = [(row.AccountName, row.AccountCode) for row in xero_data if row.AccountCode not in mapped_xero_codes]
+    xero_data = session.query(TableXeroValidation.AccountName, TableXeroValidation.AccountCode).distinct().all()
     session.close()
+
+    mapped_xero_codes = utils.master_data.get_master_data_snapshot().accounts_by_xero_code
+    unmapped_rows = [(account_name, account_code) for account_name, account_code in xero_data
+                     if account_code not in mapped_xero_codes]
     return unmapped_rows
 
 def check_period_is_locked(year, month):
@@ -295,32 +324,57 @@ def check_directory_exists(dir_path):
 
     return os.path.isdir(dir_path)
 
-def balance_sheet_balances_check():
-    ''' Checks whether the Balance Sheet nets to zero in the re-mapped financial data
+def get_xero_balance_sheet_net(from_period, to_period, fact_rows=None):
+    ''' Returns the net of the Balance Sheet of each period once the Xero data is converted to the master data, from
+        the validation facts recorded when the Xero data was extracted
 
-    :return:
+    :param from_period: Datetime of the first period in the range
+    :param to_period: Datetime of the last period in the range
+    :param fact_rows: List of (period, company name, Xero account code, value) tuples of the Balance Sheet validation
+                      facts of the range, if already held in memory (read from the database if not given)
+    :return: Dictionary of {period: net of the Balance Sheet}
     '''
 
-    session = db_sessionmaker()
-    qry = session.query(TableFinancialStatements, TableChartOfAccounts, TableNodeHierarchy)\
-        .filter(TableFinancialStatements.AccountCode == TableChartOfAccounts.GLCode)\
-        .filter(TableChartOfAccounts.L3Code==TableNodeHierarchy.L3Code)\
-        .filter(TableNodeHierarchy.L0Name==r.CM_DATA_BALANCESHEET).all()
-    session.close()
-
-    consolidated_error_message = ""
-    is_error = False
+    if fact_rows is None:
+        session = db_sessionmaker()
+        fact_rows = session.query(TableXeroValidation.Period, TableXeroValidation.CompanyName,
+                                  TableXeroValidation.AccountCode, TableXeroValidation.Value)\
+            .filter(TableXeroValidation.ReportName == r.XERO_DATA_BALANCESHEET)\
+            .filter(TableXeroValidation.Period >= from_period)\
+            .filter(TableXeroValidation.Period <= to_period)\
+            .all()
+        session.close()
 
-    time_periods = list(set([fs.Period for fs, coa, node in qry]))
+    # Only the balances converted to accounts mapped to Balance Sheet nodes are included
+    master_data = utils.master_data.get_master_data_snapshot()
+    balance_sheet_net = {}
+    for period, company_name, xero_code, value in fact_rows:
+        coa = master_data.accounts_by_xero_code.get(xero_code)
+        if company_name not in master_data.companies_by_xero_name or coa is None or coa.L3Code not in master_data.nodes:
+            continue
+        if master_data.nodes[coa.L3Code].L0Name == r.CM_DATA_BALANCESHEET:
+            balance_sheet_net[period] = balance_sheet_net.get(period, 0) + value * coa.XeroMultiplier
+
+    return balance_sheet_net
+
+def check_xero_balance_sheet_is_nil(from_period, to_period, fact_rows=None):
+    ''' Checks that the Balance Sheet of each period of the Xero data nets to zero once converted to the master data
+
+    :param from_period: Datetime of the first period in the range
+    :param to_period: Datetime of the last period in the range
+    :param fact_rows: List of (period, company name, Xero account code, value) tuples of the Balance Sheet validation
+                      facts of the range, if already held in memory
+    :return:
+    '''
 
-    for time_period in time_periods:
-        imbalance_check = sum([fs.Value for fs, coa, node in qry if fs.Period==time_period])
-        if imbalance_check != 0:
-            is_error = True
+    consolidated_error_message = ""
+    for period, imbalance_check in sorted(get_xero_balance_sheet_net(from_period=from_period, to_period=to_period,
+                                                                     fact_rows=fact_rows).items()):
+        if round(imbalance_check, r.XERO_EXTRACT_VALUE_DECIMALS) != 0:
             consolidated_error_message += "    Balance Sheet has imbalance of {} for period {}."\
-                                                           .format(imbalance_check, time_period.date())
+                                                           .format(imbalance_check, period.date())
 
-    if is_error:
+    if consolidated_error_message:
         raise error_objects.BalanceSheetImbalanceError("The Balance Sheet contains the following errors:\n{}"
                                                        .format(consolidated_error_message))
 
@@ -344,7 +398,34 @@ def master_data_integrity_check_actuals(year, month, check_balance_sheet=True, c
 
     # Where old data is overwritten, a balance sheet imbalance may be the error being corrected
     if check_balance_sheet:
-        balance_sheet_balances_check()
+        date_to_check = datetime.datetime(year=year, month=month, day=1)
+        check_xero_balance_sheet_is_nil(from_period=date_to_check, to_period=date_to_check)
+
+def master_data_integrity_check_actuals_for_periods(periods, check_balance_sheet=True):
+    ''' Performs the tests of master_data_integrity_check_actuals for a range of periods. The tests that don't depend
+        on the period are only run once, and the validation facts of the whole range are retrieved at once
+
+    :param periods: Chronologically ordered list of (year, month) tuples
+    :param check_balance_sheet:
+    :return:
+    '''
+
+    for year, month in periods:
+        check_period_exists(year=year, month=month)
+        check_period_is_locked(year=year, month=month)
+
+    master_data_uniquesness_check()
+    coa_L3_nodes_in_hierarchy()
+
+    from_period = datetime.datetime(year=periods[0][0], month=periods[0][1], day=1)
+    to_period = datetime.datetime(year=periods[-1][0], month=periods[-1][1], day=1)
+    unassigned_balances = get_unassigned_xero_balances(from_period=from_period, to_period=to_period)
+    for year, month in periods:
+        check_unassigned_costcentres_is_nil(year=year, month=month, unassigned_rows=unassigned_balances.get(
+            datetime.datetime(year=year, month=month, day=1), []))
+
+    if check_balance_sheet:
+        check_xero_balance_sheet_is_nil(from_period=from_period, to_period=to_period)
 
 def master_data_integrity_check_budget():
     ''' Performs tests on the data integrity of the Budget data
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to time the database reads of each stage of the reporting process, so that the effect of a
+schema migration (e.g. adding indexes) can be measured by running the benchmark before and after it is applied
+'''
+
+import datetime
+import json
+import time
+
+from dateutil.relativedelta import relativedelta
+
+from customobjects.database_objects import \
+    TableXeroExtract, \
+    TableFinancialStatements, \
+    TableFinModelExtract, \
+    TableBudgetAllocationsData
+from management_accounting import allocations, data_import
+import utils.data_integrity
+import utils.master_data
+from utils.db_connect import db_sessionmaker
+
+
+def read_xero_extract_period(period):
+    ''' Reads the Xero data of a period for every company, as done when a pull replaces or syncs the period
+
+    :param period: Datetime of the period
+    :return:
+    '''
+
+    company_names = utils.master_data.get_master_data_snapshot().companies_by_xero_name.keys()
+
+    session = db_sessionmaker()
+    session.query(TableXeroExtract.ID,
+                  TableXeroExtract.ReportName,
+                  TableXeroExtract.CostCentreCode,
+                  TableXeroExtract.AccountCode,
+                  TableXeroExtract.Value)\
+        .filter(TableXeroExtract.Period == period)\
+        .filter(TableXeroExtract.CompanyName.in_(company_names))\
+        .all()
+    session.close()
+
+def read_conversion_data(period):
+    ''' Runs the queries of the conversion of the Xero data of a period, without inserting the converted rows
+
+    :param period: Datetime of the period
+    :return:
+    '''
+
+    utils.data_integrity.get_unassigned_xero_balances(from_period=period, to_period=period)
+
+    timestamp = datetime.datetime.now()
+    session = db_sessionmaker()
+    session.execute(data_import.get_internal_profit_and_loss_select(from_period=period, to_period=period,
+                                                                    timestamp=timestamp)).fetchall()
+    session.execute(data_import.get_internal_balance_sheet_select(from_period=period, to_period=period,
+                                                                  timestamp=timestamp)).fetchall()
+    session.query(TableFinancialStatements)\
+        .filter(TableFinancialStatements.Period == period - relativedelta(months=1))\
+        .all()
+    session.close()
+
+def read_budget_consolidation_data(label):
+    ''' Reads the direct and allocated Budget data of a label, as done when the consolidated Budget table is created
+
+    :param label: Label of the Budget data
+    :return:
+    '''
+
+    session = db_sessionmaker()
+    session.query(TableFinModelExtract).filter(TableFinModelExtract.Label == label).all()
+    session.query(TableBudgetAllocationsData).filter(TableBudgetAllocationsData.Label == label).all()
+    session.close()
+
+def get_benchmark_stages(year, month, label=None):
+    ''' Returns the stages that are benchmarked, and a function that runs the database reads of each stage
+
+    :param year:
+    :param month:
+    :param label: Label of the Budget data to benchmark the Budget stages on (the Budget stages are skipped if None)
+    :return: List of (stage name, function) tuples
+    '''
+
+    period = datetime.datetime(year=year, month=month, day=1)
+
+    stages = [
+        ('actuals_get_data', lambda: read_xero_extract_period(period=period)),
+        ('actuals_convert_data', lambda: read_conversion_data(period=period)),
+        ('actuals_run_allocations', lambda: allocations.get_populated_costcentres_actuals(year=year, month=month)),
+        ('actuals_create_consol_table', lambda: data_import.get_consolidation_fact_rows(period=period)),
+    ]
+
+    if label is not None:
+        stages += [
+            ('budget_run_allocations',
+             lambda: allocations.get_populated_costcentres_budget(year=year, month=month, label=label)),
+            ('budget_create_consol_table', lambda: read_budget_consolidation_data(label=label)),
+        ]
+
+    return stages
+
+def benchmark_stage_queries(year, month, iterations, label=None):
+    ''' Times the database reads of each stage of the reporting process. Nothing is written to the database
+
+    :param year:
+    :param month:
+    :param iterations: Number of times the reads of each stage are run
+    :param label: Label of the Budget data to benchmark the Budget stages on (the Budget stages are skipped if None)
+    :return: Dictionary of {stage name: list of timings in seconds}
+    '''
+
+    utils.data_integrity.check_period_exists(year=year, month=month)
+    stages = get_benchmark_stages(year=year, month=month, label=label)
+
+    # The master data snapshot is loaded up front, so it isn't timed as part of the first stage that uses it
+    utils.master_data.get_master_data_snapshot()
+
+    results = {stage_name: [] for stage_name, stage_function in stages}
+    for iteration in range(iterations):
+        for stage_name, stage_function in stages:
+            start_time = time.time()
+            stage_function()
+            results[stage_name].append(time.time() - start_time)
+
+    return results
+
+def save_benchmark_results(results, filepath):
+    ''' Saves the timings of a benchmark, to compare a later benchmark against
+
+    :param results: Dictionary of {stage name: list of timings in seconds}
+    :param filepath:
+    :return:
+    '''
+
+    with open(filepath, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+def load_benchmark_results(filepath):
+    ''' Loads the timings of a benchmark saved by save_benchmark_results
+
+    :param filepath:
+    :return: Dictionary of {stage name: list of timings in seconds}
+    '''
+
+    with open(filepath, 'r') as results_file:
+        return json.load(results_file)
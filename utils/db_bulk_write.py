@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to write rows to the reporting database in bulk, using a single multi-row INSERT per batch
+of rows rather than adding an ORM object per row to the session
+'''
+
+import itertools
+import threading
+import time
+
+from sqlalchemy import inspect
+
+import references as r
+
+# Rows written and seconds spent writing them for each table, shared by every writer in the process
+_write_statistics_lock = threading.Lock()
+_write_statistics = {}
+
+
+def iter_chunks(rows, chunk_size):
+    ''' Splits an iterable into lists of at most chunk_size items
+
+    :param rows: Iterable to split
+    :param chunk_size:
+    :return: Generator of lists
+    '''
+
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+def convert_row_to_dict(table, row, columns=None):
+    ''' Converts a row to a dictionary of column values that can be passed to an INSERT statement
+
+    :param table: ORM table class the row is written to
+    :param row: Dictionary of {column name: value}, tuple of values in the order of columns, or a row object of table
+    :param columns: List of column names, required if the rows are tuples
+    :return: Dictionary of {column name: value}
+    '''
+
+    if isinstance(row, dict):
+        return row
+
+    if isinstance(row, (tuple, list)):
+        if columns is None:
+            raise ValueError("Column names must be given to insert tuples into {}".format(table.__tablename__))
+        return dict(zip(columns, row))
+
+    if isinstance(row, table):
+        # Unset primary keys are left out so that the database assigns them
+        row_dict = {}
+        for column in inspect(table).column_attrs:
+            value = getattr(row, column.key)
+            if value is None and column.columns[0].primary_key:
+                continue
+            row_dict[column.columns[0].name] = value
+        return row_dict
+
+    raise TypeError("Unable to insert {} object into {}".format(type(row).__name__, table.__tablename__))
+
+def bulk_insert_rows(session, table, rows, columns=None, chunk_size=r.DB_BULK_INSERT_CHUNK_SIZE, insert_table=None):
+    ''' Inserts rows into a table in batches, using a single multi-row INSERT per batch rather than adding an ORM
+        object per row
+
+    :param session: Session to insert the rows in (the caller is responsible for committing)
+    :param table: ORM table class the rows are written to
+    :param rows: Iterable of dictionaries of {column name: value}, tuples of values in the order of columns, or row
+                 objects of table (the rows in a batch must all set the same columns)
+    :param columns: List of column names, required if the rows are tuples
+    :param chunk_size: Number of rows sent to the database per statement
+    :param insert_table: Table object to write the rows to instead of the table of the ORM class, e.g. a staging copy
+                         of it (the rows are still recorded against the ORM table in the statistics)
+    :return: Number of rows inserted
+    '''
+
+    insert_statement = (table.__table__ if insert_table is None else insert_table).insert()
+    row_count = 0
+    seconds = 0.0
+
+    for chunk in iter_chunks(rows, chunk_size):
+        chunk = [convert_row_to_dict(table=table, row=row, columns=columns) for row in chunk]
+        start_time = time.time()
+        session.execute(insert_statement, chunk)
+        seconds += time.time() - start_time
+        row_count += len(chunk)
+
+    record_bulk_write(table_name=table.__tablename__, row_count=row_count, seconds=seconds)
+
+    return row_count
+
+def record_bulk_write(table_name, row_count, seconds):
+    ''' Adds the rows written to a table to the statistics of the process
+
+    :param table_name:
+    :param row_count: Number of rows written
+    :param seconds: Time spent writing the rows
+    :return:
+    '''
+
+    with _write_statistics_lock:
+        statistics = _write_statistics.setdefault(table_name, {'rows': 0, 'seconds': 0.0})
+        statistics['rows'] += row_count
+        statistics['seconds'] += seconds
+
+def get_bulk_write_statistics(reset=False):
+    ''' Returns the rows written to each table since the statistics were last reset
+
+    :param reset: If True, the statistics are reset after they are returned
+    :return: List of (table name, rows written, seconds spent writing, rows per second) tuples ordered by table name
+    '''
+
+    with _write_statistics_lock:
+        statistics = [(table_name, values['rows'], values['seconds'],
+                       (values['rows'] / values['seconds'] if values['seconds'] else 0.0))
+                      for table_name, values in sorted(_write_statistics.items())]
+        if reset:
+            _write_statistics.clear()
+
+    return statistics
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to upgrade the schema of an existing reporting database. Each migration is applied once,
+in order, and the version of the schema is recorded in tbl_MASTER_schemaversion
+'''
+
+import datetime
+
+from sqlalchemy import func, inspect
+
+from customobjects.database_objects import \
+    TableSchemaVersion, \
+    TableXeroExtract, \
+    TableXeroValidation, \
+    TableFinancialStatements, \
+    TableAllocationsData, \
+    TableBudgetAllocationsData, \
+    TableFinModelExtract, \
+    TableConsolidatedFinStatements, \
+    TableConsolidatedBudget, \
+    TableHeadcount, \
+    TableChartOfAccounts, \
+    TableNodeHierarchy, \
+    TableAllocationAccounts, \
+    TableCostCentres, \
+    TableCompanies, \
+    TablePeriods
+import utils.db_partitions
+import utils.xero_validation
+from utils.db_connect import db_sessionmaker
+
+
+def migrate_partition_tables_by_period(session):
+    ''' Migration 1: Range partitions the fact and output tables by Period, with a partition per month
+
+    :param session:
+    :return:
+    '''
+
+    # Partitioning is only supported by MySQL, the tables of other databases are left as they are
+    if session.get_bind().dialect.name != 'mysql':
+        return
+
+    for table in utils.db_partitions.PERIOD_PARTITIONED_TABLES:
+        utils.db_partitions.partition_table_by_period(session=session, table=table)
+
+
+# Key columns mapped by the ORM that are missing from older copies of the schema, and their column definitions
+KEY_COLUMNS_ADDED = [
+    (TableXeroExtract, [('CostCentreCode', "varchar(64) DEFAULT NULL")]),
+]
+
+# Text columns that are joined or filtered on, and the length of the VARCHAR column they are converted to (text
+# columns can only be indexed on a prefix of their values)
+KEY_COLUMN_LENGTHS = [
+    (TableXeroExtract, [('ReportName', 64), ('CompanyName', 255), ('CostCentreCode', 64), ('CostCentreName', 255),
+                        ('AccountCode', 64)]),
+    (TableFinancialStatements, [('CostCentreCode', 64)]),
+    (TableAllocationsData, [('SendingCostCentre', 64), ('ReceivingCostCentre', 64)]),
+    (TableBudgetAllocationsData, [('SendingCostCentre', 64), ('ReceivingCostCentre', 64), ('Label', 255)]),
+    (TableFinModelExtract, [('CompanyCode', 64), ('CostCentreCode', 64), ('Label', 255)]),
+    (TableConsolidatedFinStatements, [('CostCentreCode', 64), ('PartnerCostCentreCode', 64), ('Label', 255)]),
+    (TableConsolidatedBudget, [('CostCentreCode', 64), ('PartnerCostCentreCode', 64), ('Label', 255)]),
+    (TableHeadcount, [('CostCentreCode', 64)]),
+    (TableChartOfAccounts, [('XeroCode', 64), ('L3Code', 64)]),
+    (TableNodeHierarchy, [('L0Code', 64), ('L1Code', 64), ('L2Code', 64), ('L3Code', 64)]),
+    (TableAllocationAccounts, [('L2Hierarchy', 64)]),
+    (TableCostCentres, [('XeroName', 255), ('XeroCode', 64), ('CostCentreCode', 64)]),
+    (TableCompanies, [('XeroName', 255)]),
+]
+
+# Indexes on the columns each stage filters and joins on, as lists of the columns of each index on a table
+KEY_COLUMN_INDEXES = [
+    (TableXeroExtract, [['Period', 'CompanyName', 'ReportName'], ['CostCentreName', 'Period'], ['AccountCode'],
+                        ['CostCentreCode']]),
+    (TableFinancialStatements, [['Period', 'CostCentreCode'], ['AccountCode']]),
+    (TableAllocationsData, [['Period'], ['SendingCostCentre'], ['ReceivingCostCentre']]),
+    (TableBudgetAllocationsData, [['Label', 'Period']]),
+    (TableFinModelExtract, [['Label', 'Period']]),
+    (TableConsolidatedFinStatements, [['Period'], ['Label', 'Period']]),
+    (TableConsolidatedBudget, [['Label', 'Period']]),
+    (TableHeadcount, [['CostCentreCode']]),
+    (TableChartOfAccounts, [['GLCode'], ['XeroCode'], ['L3Code']]),
+    (TableNodeHierarchy, [['L3Code']]),
+    (TableAllocationAccounts, [['GLCode'], ['L2Hierarchy']]),
+    (TableCostCentres, [['CostCentreCode'], ['XeroCode']]),
+    (TableCompanies, [['CompanyCode'], ['XeroName']]),
+    (TablePeriods, [['Period']]),
+]
+
+
+def get_index_name(table, columns):
+    ''' Returns the name of the index on a list of columns of a table (index names must be unique across the database
+        in some databases, so the name of the table is included)
+
+    :param table: ORM table class
+    :param columns: List of column names
+    :return: String index name, e.g. idx_tbl_DATA_extract_finmodel_Label_Period
+    '''
+
+    return "idx_{}_{}".format(table.__tablename__, "_".join(columns))
+
+def create_index(session, table, columns):
+    ''' Creates an index on a list of columns of a table, unless the table already has it (e.g. the table was created
+        from the current schema file)
+
+    :param session:
+    :param table: ORM table class
+    :param columns: List of column names
+    :return:
+    '''
+
+    index_name = get_index_name(table=table, columns=columns)
+    if index_name in [index['name'] for index in inspect(session.connection()).get_indexes(table.__tablename__)]:
+        return
+
+    session.execute("CREATE INDEX `{}` ON `{}` ({})"
+                    .format(index_name, table.__tablename__, ", ".join("`{}`".format(column) for column in columns)))
+
+def add_columns(session, table, column_definitions):
+    ''' Adds columns to a table, unless the table already has them
+
+    :param session:
+    :param table: ORM table class
+    :param column_definitions: List of (column name, column definition) tuples
+    :return:
+    '''
+
+    existing_columns = [column['name'] for column in inspect(session.connection()).get_columns(table.__tablename__)]
+    for column_name, column_definition in column_definitions:
+        if column_name not in existing_columns:
+            session.execute("ALTER TABLE `{}` ADD COLUMN `{}` {}"
+                            .format(table.__tablename__, column_name, column_definition))
+
+def convert_columns_to_varchar(session, table, column_lengths):
+    ''' Converts text columns of a table to VARCHAR columns in a single ALTER TABLE statement, keeping the
+        character set, nullability and comment of each column
+
+    :param session:
+    :param table: ORM table class
+    :param column_lengths: List of (column name, length) tuples
+    :return:
+    '''
+
+    column_definitions = []
+    parameters = {}
+    for index, (column_name, length) in enumerate(column_lengths):
+        column = session.execute("SELECT IS_NULLABLE, CHARACTER_SET_NAME, COLUMN_COMMENT FROM information_schema.COLUMNS "
+                                 "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+                                 "AND COLUMN_NAME = :column_name",
+                                 {'table_name': table.__tablename__, 'column_name': column_name}).fetchone()
+        if column is None:
+            continue    # Columns missing from older copies of the schema are left as they are
+
+        is_nullable, character_set, comment = column
+        parameters['comment_{}'.format(index)] = comment
+        column_definitions.append("MODIFY `{}` varchar({}) CHARACTER SET {} {} COMMENT :comment_{}"
+                                  .format(column_name, length, character_set,
+                                          "DEFAULT NULL" if is_nullable == 'YES' else "NOT NULL", index))
+
+    if column_definitions:
+        session.execute("ALTER TABLE `{}` {}".format(table.__tablename__, ", ".join(column_definitions)), parameters)
+
+def migrate_index_key_columns(session):
+    ''' Migration 2: Adds any key columns missing from the table, converts the text columns that are joined and
+        filtered on to VARCHAR columns, and indexes them
+
+    :param session:
+    :return:
+    '''
+
+    for table, column_definitions in KEY_COLUMNS_ADDED:
+        add_columns(session=session, table=table, column_definitions=column_definitions)
+
+    # Text columns can't be indexed in MySQL, other databases index them as they are
+    if session.get_bind().dialect.name == 'mysql':
+        for table, column_lengths in KEY_COLUMN_LENGTHS:
+            convert_columns_to_varchar(session=session, table=table, column_lengths=column_lengths)
+
+    for table, indexes in KEY_COLUMN_INDEXES:
+        for columns in indexes:
+            create_index(session=session, table=table, columns=columns)
+
+def migrate_record_xero_validation_facts(session):
+    ''' Migration 3: Creates the table of validation facts of the Xero data (unless it was created from the schema
+        file), and records the facts of the Xero data already extracted
+
+    :param session:
+    :return:
+    '''
+
+    TableXeroValidation.__table__.create(bind=session.connection(), checkfirst=True)
+    create_index(session=session, table=TableXeroValidation, columns=['Period', 'CompanyName'])
+
+    extracted_periods = session.query(TableXeroExtract.CompanyName, TableXeroExtract.Period).distinct().all()
+    for company_name in set([company_name for company_name, period in extracted_periods]):
+        utils.xero_validation.refresh_xero_validation_facts(
+            session=session, company_names=[company_name],
+            periods=[period for extracted_company_name, period in extracted_periods
+                     if extracted_company_name == company_name])
+
+
+# (Version, description, function) of every migration, in the order they are applied
+MIGRATIONS = [
+    (1, "Partition fact and output tables by period", migrate_partition_tables_by_period),
+    (2, "Index the columns that are joined and filtered on", migrate_index_key_columns),
+    (3, "Record validation facts of the Xero data", migrate_record_xero_validation_facts),
+]
+
+
+def get_schema_version(session):
+    ''' Returns the version of the schema of the database, creating the table the version is recorded in if it
+        doesn't exist yet
+
+    :param session:
+    :return: Integer version, 0 if no migrations have been applied
+    '''
+
+    TableSchemaVersion.__table__.create(bind=session.get_bind(), checkfirst=True)
+    return session.query(func.max(TableSchemaVersion.Version)).scalar() or 0
+
+def apply_schema_migrations():
+    ''' Applies any migrations that haven't been applied to the database yet, then adds the monthly partitions of
+        any periods that have been made available since the tables were partitioned
+
+    :return: Tuple of (list of (version, description) tuples of the migrations applied, list of partitions added)
+    '''
+
+    session = db_sessionmaker()
+    try:
+        schema_version = get_schema_version(session=session)
+
+        migrations_applied = []
+        for version, description, migration in MIGRATIONS:
+            if version <= schema_version:
+                continue
+            # Schema changes can't be rolled back in MySQL, so each migration is recorded as soon as it is applied
+            migration(session)
+            session.add(TableSchemaVersion(Version=version, Description=description,
+                                           DateApplied=datetime.datetime.now()))
+            session.commit()
+            migrations_applied.append((version, description))
+
+        partitions_added = []
+        for table in utils.db_partitions.PERIOD_PARTITIONED_TABLES:
+            partitions_added += ["{}.{}".format(table.__tablename__, partition_name) for partition_name in
+                                 utils.db_partitions.add_period_partitions(session=session, table=table)]
+        session.commit()
+    finally:
+        session.close()
+
+    return migrations_applied, partitions_added
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to manage the monthly partitions of the fact and output tables, which are range
+partitioned by Period in MySQL so that the data of a period can be read, replaced or removed without scanning the
+data of every other period
+'''
+
+import datetime
+
+from customobjects.database_objects import \
+    TableXeroExtract, \
+    TableFinancialStatements, \
+    TableAllocationsData, \
+    TableBudgetAllocationsData, \
+    TableConsolidatedFinStatements, \
+    TableConsolidatedBudget
+import references as r
+
+# Tables partitioned by Period (see migration 1 in utils/db_migrations.py)
+PERIOD_PARTITIONED_TABLES = [TableXeroExtract, TableFinancialStatements, TableAllocationsData,
+                             TableBudgetAllocationsData, TableConsolidatedFinStatements, TableConsolidatedBudget]
+
+
+def get_period_partition_name(period):
+    ''' Returns the name of the monthly partition that holds a period
+
+    :param period: Datetime of the period
+    :return: String partition name, e.g. p201801
+    '''
+
+    return "p{:%Y%m}".format(period)
+
+def get_period_partition_definitions(periods):
+    ''' Returns the partition definitions for a list of monthly partitions, followed by the partition holding any
+        later periods
+
+    :param periods: Chronologically ordered list of datetimes of the periods to create partitions for
+    :return: String of partition definitions for use in ALTER TABLE statements
+    '''
+
+    definitions = []
+    for period in periods:
+        next_period = datetime.datetime(year=period.year + period.month // 12, month=period.month % 12 + 1, day=1)
+        definitions.append("PARTITION {} VALUES LESS THAN (TO_DAYS('{:%Y-%m-%d}'))"
+                           .format(get_period_partition_name(period), next_period))
+    definitions.append("PARTITION {} VALUES LESS THAN MAXVALUE".format(r.DB_PARTITION_FUTURE))
+
+    return ",\n".join(definitions)
+
+def get_available_periods():
+    ''' Returns every period that can be reported on, which each have a monthly partition
+
+    :return: Chronologically ordered list of datetimes
+    '''
+
+    return [datetime.datetime(year=year, month=month, day=1)
+            for year in sorted(r.AVAILABLE_PERIODS_YEARS) for month in sorted(r.AVAILABLE_PERIODS_MONTHS)]
+
+def get_table_partitions(session, table):
+    ''' Returns the names of the partitions of a table
+
+    :param session:
+    :param table: ORM table class
+    :return: List of partition names in order, empty if the table isn't partitioned (or the database isn't MySQL)
+    '''
+
+    if session.get_bind().dialect.name != 'mysql':
+        return []
+
+    partitions = session.execute("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                                 "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name "
+                                 "AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION",
+                                 {'table_name': table.__tablename__}).fetchall()
+
+    return [partition_name for (partition_name,) in partitions]
+
+def partition_table_by_period(session, table):
+    ''' Range partitions a table by Period, with a partition for every available period. MySQL requires the
+        partitioning column to be part of the primary key, so Period is added to it
+
+    :param session:
+    :param table: ORM table class
+    :return:
+    '''
+
+    periods = get_available_periods()
+
+    session.execute("ALTER TABLE `{}` DROP PRIMARY KEY, ADD PRIMARY KEY (`ID`, `Period`)".format(table.__tablename__))
+    session.execute("ALTER TABLE `{}` PARTITION BY RANGE (TO_DAYS(`Period`)) (\n"
+                    "PARTITION {} VALUES LESS THAN (TO_DAYS('{:%Y-%m-%d}')),\n{})"
+                    .format(table.__tablename__, r.DB_PARTITION_HISTORY, periods[0],
+                            get_period_partition_definitions(periods=periods)))
+
+def add_period_partitions(session, table):
+    ''' Adds monthly partitions to a partitioned table for any available periods after its last monthly partition
+        (e.g. when a year is added to AVAILABLE_PERIODS_YEARS), by splitting them out of the partition of later periods
+
+    :param session:
+    :param table: ORM table class
+    :return: List of names of the partitions added
+    '''
+
+    partitions = get_table_partitions(session=session, table=table)
+    if r.DB_PARTITION_FUTURE not in partitions:
+        return []
+
+    monthly_partitions = [partition_name for partition_name in partitions
+                          if partition_name not in (r.DB_PARTITION_HISTORY, r.DB_PARTITION_FUTURE)]
+    new_periods = [period for period in get_available_periods()
+                   if get_period_partition_name(period) > max(monthly_partitions)]
+    if new_periods:
+        session.execute("ALTER TABLE `{}` REORGANIZE PARTITION {} INTO (\n{})"
+                        .format(table.__tablename__, r.DB_PARTITION_FUTURE,
+                                get_period_partition_definitions(periods=new_periods)))
+
+    return [get_period_partition_name(period) for period in new_periods]
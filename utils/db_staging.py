@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to rewrite the data of a period by building the new rows in a staging copy of the table,
+then swapping them into the table in one short transaction, so readers never see an empty or half-written period
+'''
+
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import Column, MetaData, Table, select
+
+import references as r
+import utils.data_integrity
+import utils.db_partitions
+from utils.db_bulk_write import bulk_insert_rows
+from utils.db_connect import db_sessionmaker
+
+
+def get_staging_table(table, from_period, to_period):
+    ''' Returns the staging copy of a table used to rewrite a range of periods. Each range has its own staging
+        table, so different periods of the same table can be rewritten at the same time
+
+    :param table: ORM table class of the table being rewritten
+    :param from_period: Datetime of the first period being rewritten
+    :param to_period: Datetime of the last period being rewritten
+    :return: Table object
+    '''
+
+    table_name = "{}{}_{:%Y%m}".format(table.__tablename__, r.DB_STAGING_TABLE_SUFFIX, from_period)
+    if to_period != from_period:
+        table_name += "_{:%Y%m}".format(to_period)
+
+    # Foreign keys aren't copied, the rows are only checked against them when they are swapped into the table
+    return Table(table_name, MetaData(),
+                 *[Column(column.name, column.type, primary_key=column.primary_key)
+                   for column in table.__table__.columns])
+
+def create_staging_table(table, from_period, to_period):
+    ''' Creates an empty staging table to build the rows of a range of periods in, after checking that none of the
+        periods are locked
+
+    :param table: ORM table class of the table being rewritten
+    :param from_period: Datetime of the first period being rewritten
+    :param to_period: Datetime of the last period being rewritten
+    :return: Table object
+    '''
+
+    period = from_period
+    while period <= to_period:
+        utils.data_integrity.check_period_is_locked(year=period.year, month=period.month)
+        period += relativedelta(months=1)
+
+    staging_table = get_staging_table(table=table, from_period=from_period, to_period=to_period)
+
+    # A session of its own, as creating a table ends any open transaction in MySQL
+    session = db_sessionmaker.session_factory()
+    try:
+        connection = session.connection()
+        staging_table.drop(bind=connection, checkfirst=True)     # Left behind if a previous rewrite was interrupted
+        if connection.dialect.name == 'mysql':
+            # Copies the column types and indexes of the table exactly. The staging table only holds the periods
+            # being rewritten, so isn't partitioned
+            connection.execute("CREATE TABLE {} LIKE {}".format(staging_table.name, table.__tablename__))
+            if utils.db_partitions.get_table_partitions(session=session, table=table):
+                connection.execute("ALTER TABLE {} REMOVE PARTITIONING".format(staging_table.name))
+        else:
+            staging_table.create(bind=connection)
+        session.commit()
+    finally:
+        session.close()
+
+    return staging_table
+
+def drop_staging_table(staging_table):
+    ''' Drops a staging table once its rows have been swapped in (or the rewrite has failed)
+
+    :param staging_table: Table object returned by create_staging_table
+    :return:
+    '''
+
+    session = db_sessionmaker.session_factory()
+    try:
+        staging_table.drop(bind=session.connection(), checkfirst=True)
+        session.commit()
+    finally:
+        session.close()
+
+def swap_staging_table(table, staging_table, from_period, to_period):
+    ''' Replaces the rows of a range of periods in a table with the rows built in its staging table. The delete and
+        the copy run inside the database in a single transaction, so readers see either the old or the new rows.
+        The partition of a period isn't exchanged with the staging table, as the IDs of the staged rows would then
+        duplicate the IDs of rows in other periods
+
+    :param table: ORM table class of the table being rewritten
+    :param staging_table: Table object returned by create_staging_table
+    :param from_period: Datetime of the first period being rewritten
+    :param to_period: Datetime of the last period being rewritten
+    :return: Number of rows swapped in
+    '''
+
+    # The table assigns new primary keys to the rows it receives
+    columns = [column.name for column in table.__table__.columns if not column.primary_key]
+
+    session = db_sessionmaker.session_factory()
+    try:
+        session.execute(table.__table__.delete()
+                        .where(table.__table__.c.Period >= from_period)
+                        .where(table.__table__.c.Period <= to_period))
+        result = session.execute(table.__table__.insert()
+                                 .from_select(columns, select([staging_table.c[column] for column in columns])))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+    return result.rowcount
+
+def replace_period_rows(table, year, month, rows, columns=None):
+    ''' Replaces the rows of a period in a table, building the new rows in a staging table before swapping them in
+
+    :param table: ORM table class of the table being rewritten
+    :param year:
+    :param month:
+    :param rows: Iterable of rows in any of the forms accepted by bulk_insert_rows
+    :param columns: List of column names, required if the rows are tuples
+    :return: Number of rows swapped in
+    '''
+
+    period = datetime.datetime(year=year, month=month, day=1)
+    staging_table = create_staging_table(table=table, from_period=period, to_period=period)
+    try:
+        session = db_sessionmaker.session_factory()
+        try:
+            bulk_insert_rows(session=session, table=table, rows=rows, columns=columns, insert_table=staging_table)
+            session.commit()
+        finally:
+            session.close()
+
+        return swap_staging_table(table=table, staging_table=staging_table, from_period=period, to_period=period)
+    finally:
+        drop_staging_table(staging_table=staging_table)
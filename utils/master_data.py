@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to hold a snapshot of the master data tables in memory, so that the mappings used by
+each stage are resolved by dictionary lookups rather than by joining to the master data tables in every query
+'''
+
+import hashlib
+import threading
+import time
+
+from customobjects.database_objects import \
+    TableChartOfAccounts, \
+    TableNodeHierarchy, \
+    TableAllocationAccounts, \
+    TableCostCentres, \
+    TableCompanies
+from customobjects.helper_objects import MasterDataSnapshot
+import references as r
+from utils.db_connect import db_sessionmaker
+
+# Tables held in the snapshot, in the order they are passed to MasterDataSnapshot
+MASTER_DATA_TABLES = [TableChartOfAccounts, TableNodeHierarchy, TableAllocationAccounts, TableCostCentres,
+                      TableCompanies]
+
+# The snapshot is shared by every stage (and thread) in the process, and reloaded when the master data changes
+_snapshot_lock = threading.Lock()
+_snapshot = None
+_snapshot_checked_at = None     # Time the fingerprint of the snapshot was last checked against the database
+
+
+def get_master_data_version(session):
+    ''' Returns a fingerprint of the contents of the master data tables, which changes whenever a row is added,
+        changed or deleted
+
+    :param session:
+    :return: String fingerprint
+    '''
+
+    table_names = [table.__tablename__ for table in MASTER_DATA_TABLES]
+
+    if session.get_bind().dialect.name == 'mysql':
+        # The checksums are calculated by the database, so the rows don't need to be read to check for changes
+        checksums = session.execute("CHECKSUM TABLE {}".format(", ".join(table_names))).fetchall()
+        fingerprint = repr(sorted([(str(table_name), checksum) for table_name, checksum in checksums]))
+    else:
+        fingerprint = repr([session.query(*table.__table__.columns).order_by(table.ID).all()
+                            for table in MASTER_DATA_TABLES])
+
+    return hashlib.md5(fingerprint).hexdigest()
+
+def load_master_data_snapshot(session, version):
+    ''' Loads the master data tables into a new snapshot
+
+    :param session:
+    :param version: Fingerprint of the master data tables
+    :return: MasterDataSnapshot
+    '''
+
+    accounts, nodes, allocation_accounts, cost_centres, companies = \
+        [session.query(table).order_by(table.ID).all() for table in MASTER_DATA_TABLES]
+
+    return MasterDataSnapshot(version=version,
+                              accounts=accounts,
+                              nodes=nodes,
+                              allocation_accounts=allocation_accounts,
+                              cost_centres=cost_centres,
+                              companies=companies)
+
+def get_master_data_snapshot(refresh=False):
+    ''' Returns the snapshot of the master data tables, which is only reloaded from the database if the tables have
+        changed since it was loaded. Calculating the fingerprint reads the whole of each table, so the tables are
+        checked for changes at most once every MASTER_DATA_CHECK_INTERVAL seconds
+
+    :param refresh: If True, reload the snapshot even if the master data is unchanged
+    :return: MasterDataSnapshot
+    '''
+
+    global _snapshot, _snapshot_checked_at
+
+    with _snapshot_lock:
+        if not refresh and _snapshot is not None \
+                and time.time() - _snapshot_checked_at < r.MASTER_DATA_CHECK_INTERVAL:
+            return _snapshot
+
+        # A session of its own, so that loading the snapshot can't end a transaction the caller has open
+        session = db_sessionmaker.session_factory()
+        try:
+            version = get_master_data_version(session=session)
+            if refresh or _snapshot is None or _snapshot.version != version:
+                _snapshot = load_master_data_snapshot(session=session, version=version)
+            _snapshot_checked_at = time.time()
+        finally:
+            session.close()
+
+        return _snapshot
+
+def clear_master_data_snapshot():
+    ''' Discards the snapshot, so that the master data is reloaded the next time it is used
+
+    :return:
+    '''
+
+    global _snapshot
+
+    with _snapshot_lock:
+        _snapshot = None
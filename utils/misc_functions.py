@@ -12,6 +12,8 @@ import os
 from Tkinter import Tk
 from tkFileDialog import askopenfilename, askdirectory
 
+from dateutil.relativedelta import relativedelta
+
 import references as r
 from customobjects import error_objects
 from customobjects.database_objects import \
@@ -32,28 +34,37 @@ def convert_dir_path_to_standard_format(folder_path):
         folder_path += "/"
     return folder_path
 
-def delete_table_data_for_period(table, year, month):
-    ''' Deletes all data in a given table object for a specific year and month
+def delete_table_data_for_period(table, year, month, session=None):
+    ''' Deletes all data in a given table object for a specific year and month. In a table partitioned by Period
+        only the partition of the period is read. The partition isn't truncated, as TRUNCATE PARTITION commits
+        implicitly and would end the caller's transaction
 
     :param table: Sqlalchemy ORM table object of table where data should be deleted from
     :param year: Year of the period to delete
     :param month: Month of the period to delete
+    :param session: Session to delete the data in. If given, the caller is responsible for committing the deletion
+                    (e.g. together with the replacement data), otherwise the deletion is committed immediately
     :return:
     '''
 
     date_to_delete = datetime.datetime(year=year, month=month, day=1)
     check_period_is_locked(year=year, month=month)
-    try:
+
+    is_own_session = session is None
+    if is_own_session:
         session = db_sessionmaker()
+    try:
         session.query(table).filter(table.Period==date_to_delete).delete()
     except AttributeError, e:
         raise error_objects.MasterDataIncompleteError(e.message
                                                       + "\n(relevant table must have column named 'Period' "
                                                         "for the function to work)")
     else:
-        session.commit()
+        if is_own_session:
+            session.commit()
     finally:
-        session.close()
+        if is_own_session:
+            session.close()
 
 def get_filename_from_gui():
     ''' Prompts the user to select a file using a GUI and returns the filepath
@@ -93,6 +104,70 @@ def get_datetime_of_last_day_of_month(year, month):
     last_day = last_day + datetime.timedelta(days=-1)
     return last_day
 
+def convert_period_string_to_year_month(period_string):
+    ''' Converts a period entered by the user (e.g. "2017.3" or "2017-03") into a (year, month) tuple
+
+    :param period_string: String representation of the period in the format YYYY.MM or YYYY-MM
+    :return: Tuple of integers (year, month)
+    '''
+
+    separator = "." if "." in period_string else "-"
+    try:
+        year, month = [int(value) for value in period_string.split(separator)]
+    except ValueError:
+        raise error_objects.PeriodNotFoundError("Period '{}' not recognised: periods must be in the format YYYY.MM"
+                                                .format(period_string))
+    return year, month
+
+def get_periods_in_range(from_year, from_month, to_year, to_month):
+    ''' Returns a list of (year, month) tuples for every period between two periods (inclusive)
+
+    :param from_year: Year of the first period in the range
+    :param from_month: Month of the first period in the range
+    :param to_year: Year of the last period in the range
+    :param to_month: Month of the last period in the range
+    :return: Chronologically ordered list of (year, month) tuples
+    '''
+
+    for year, month in [(from_year, from_month), (to_year, to_month)]:
+        if year not in r.AVAILABLE_PERIODS_YEARS or month not in r.AVAILABLE_PERIODS_MONTHS:
+            raise error_objects.PeriodNotFoundError("Period {}.{} is not included in range of valid inputs"
+                                                    .format(year, month))
+
+    current_period = datetime.datetime(year=from_year, month=from_month, day=1)
+    last_period = datetime.datetime(year=to_year, month=to_month, day=1)
+    if current_period > last_period:
+        raise error_objects.PeriodNotFoundError("Period {}.{} is after period {}.{}"
+                                                .format(from_year, from_month, to_year, to_month))
+
+    periods = []
+    while current_period <= last_period:
+        periods.append((current_period.year, current_period.month))
+        current_period = current_period + relativedelta(months=1)
+
+    return periods
+
+def get_consecutive_period_batches(periods, batch_size):
+    ''' Groups periods into batches of consecutive months, e.g. to request several periods in a single
+        multi-period report
+
+    :param periods: List of (year, month) tuples
+    :param batch_size: Maximum number of periods in each batch
+    :return: Chronologically ordered list of batches, each a chronologically ordered list of (year, month) tuples
+    '''
+
+    batches = []
+    previous_period_index = None
+    for year, month in sorted(set(periods)):
+        period_index = year * 12 + month - 1
+        if batches and period_index == previous_period_index + 1 and len(batches[-1]) < batch_size:
+            batches[-1].append((year, month))
+        else:
+            batches.append([(year, month)])
+        previous_period_index = period_index
+
+    return batches
+
 def open_or_create_folder(dir_path):
     ''' If a directory doesn't already exist, that directory is created
 
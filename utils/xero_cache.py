@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Local, compressed record/replay cache of the raw responses returned by the Xero API
+'''
+
+import datetime
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import references as r
+import utils.misc_functions
+
+
+def get_cache_filepath(endpoint, params=None, company_code=None):
+    ''' Returns the location of the cache file for a request, keyed by the organisation, endpoint and parameters
+
+    :param endpoint: Path of the Xero API endpoint (e.g. 'Reports/ProfitAndLoss')
+    :param params: Dictionary of query string parameters sent with the request
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :return: Absolute filepath of the cache file
+    '''
+
+    params_key = json.dumps(params if params else {}, sort_keys=True)
+    params_hash = hashlib.sha1(params_key).hexdigest()
+    file_name = "{}_{}.json.gz".format(endpoint.replace("/", "_"), params_hash)
+    if company_code is not None:
+        file_name = "{}_{}".format(company_code, file_name)
+
+    return os.path.join(r.XERO_CACHE_DIRECTORY, file_name)
+
+def read_cached_response(endpoint, params=None, company_code=None):
+    ''' Returns the raw response text previously recorded for a request, and the time it was retrieved from Xero
+
+    :param endpoint: Path of the Xero API endpoint
+    :param params: Dictionary of query string parameters sent with the request
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :return: Tuple of (raw JSON text of the response, local datetime the response was retrieved from Xero), or None
+             if the request hasn't been recorded
+    '''
+
+    filepath = get_cache_filepath(endpoint=endpoint, params=params, company_code=company_code)
+    if not os.path.isfile(filepath):
+        return None
+
+    with gzip.open(filepath, 'rb') as cache_file:
+        cached_text = cache_file.read().decode('utf-8')
+
+    cached_response = json.loads(cached_text)
+    if not isinstance(cached_response, dict) or set(cached_response.keys()) != set(['FetchedAt', 'Response']):
+        # Responses recorded before the retrieval time was kept in the cache entry were written when they were
+        # retrieved, so the file was last modified at that time
+        return cached_text, datetime.datetime.fromtimestamp(os.path.getmtime(filepath))
+
+    return cached_response['Response'], datetime.datetime.fromtimestamp(cached_response['FetchedAt'])
+
+def _write_file_atomically(filepath, data, open_function=open):
+    ''' Writes data to a file via a temporary file, so that concurrent readers never see a partially written file
+
+    :param filepath: Location of the file to write
+    :param data: Bytes to write
+    :param open_function: Function used to open the file for writing (e.g. gzip.open)
+    :return:
+    '''
+
+    utils.misc_functions.open_or_create_folder(os.path.dirname(filepath))
+    file_handle, temp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    os.close(file_handle)
+    with open_function(temp_filepath, 'wb') as output_file:
+        output_file.write(data)
+    os.rename(temp_filepath, filepath)
+
+def write_cached_response(endpoint, params, response_text, company_code=None, fetched_at=None):
+    ''' Records the raw response text for a request, replacing any previously recorded response. The time the
+        response was retrieved is recorded with it, so that data replayed from the cache is dated when it was
+        retrieved from Xero rather than when it was replayed
+
+    :param endpoint: Path of the Xero API endpoint
+    :param params: Dictionary of query string parameters sent with the request
+    :param response_text: Raw JSON text returned by the API
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :param fetched_at: Local datetime the response was retrieved from Xero (defaults to now)
+    :return:
+    '''
+
+    fetched_at = fetched_at if fetched_at else datetime.datetime.now()
+    data = json.dumps({'FetchedAt': time.mktime(fetched_at.timetuple()) + fetched_at.microsecond / 1000000.0,
+                       'Response': response_text})
+
+    filepath = get_cache_filepath(endpoint=endpoint, params=params, company_code=company_code)
+    _write_file_atomically(filepath=filepath, data=data.encode('utf-8'), open_function=gzip.open)
+
+def get_cost_centre_mapping_filepath(company_code=None):
+    ''' Returns the location of the cached cost centre mapping of an organisation
+
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :return: Absolute filepath of the mapping file
+    '''
+
+    if company_code is None:
+        return r.XERO_COST_CENTRE_MAPPING_FILE
+    file_path, extension = os.path.splitext(r.XERO_COST_CENTRE_MAPPING_FILE)
+    return "{}-{}{}".format(file_path, company_code, extension)
+
+def read_cost_centre_mapping(max_age=r.XERO_COST_CENTRE_MAPPING_TTL, company_code=None):
+    ''' Returns the cached mapping of Xero cost centre names to tracking option IDs
+
+    :param max_age: Age in seconds after which the cached mapping has expired
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :return: Dictionary of {cost centre name: tracking option ID}, or None if there is no cached mapping or it has
+             expired
+    '''
+
+    filepath = get_cost_centre_mapping_filepath(company_code=company_code)
+    if not os.path.isfile(filepath):
+        return None
+
+    with open(filepath, 'rb') as mapping_file:
+        cached_mapping = json.load(mapping_file)
+
+    if time.time() - cached_mapping['CachedAt'] > max_age:
+        return None
+    return cached_mapping['Mapping']
+
+def write_cost_centre_mapping(mapping, company_code=None):
+    ''' Caches the mapping of Xero cost centre names to tracking option IDs
+
+    :param mapping: Dictionary of {cost centre name: tracking option ID}
+    :param company_code: Company code of the Xero organisation (None if only one organisation is set up)
+    :return:
+    '''
+
+    data = json.dumps({'CachedAt': time.time(), 'Mapping': mapping}, sort_keys=True)
+    _write_file_atomically(filepath=get_cost_centre_mapping_filepath(company_code=company_code), data=data)
+
+def invalidate_cost_centre_mapping():
+    ''' Deletes the cached cost centre mappings of all organisations so that they are retrieved from Xero on the
+        next pull
+
+    :return:
+    '''
+
+    file_path, extension = os.path.splitext(r.XERO_COST_CENTRE_MAPPING_FILE)
+    for filepath in glob.glob(file_path + "*" + extension):
+        os.remove(filepath)
+
+def clear_xero_cache():
+    ''' Deletes all recorded Xero responses and the cached cost centre mapping
+
+    :return:
+    '''
+
+    if os.path.isdir(r.XERO_CACHE_DIRECTORY):
+        shutil.rmtree(r.XERO_CACHE_DIRECTORY)
@@ -5,62 +5,586 @@
 Purpose of this module is to extract Xero data via the API and import it into the reporting database
 '''
 
+import _strptime     # Imported up front as the first call to datetime.strptime isn't thread-safe in Python 2
 import datetime
+import functools
+import json
 import pprint
-
-from xero import Xero
+import random
+import threading
+import time
+import urllib
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import bindparam
 from xero.auth import PrivateCredentials
+from xero.constants import XERO_API_URL
+from xero.utils import json_load_object_hook
 
-from customobjects.database_objects import TableXeroExtract
+from customobjects.database_objects import TableXeroExtract, TableXeroExtractChangeLog, TableXeroJournalSync
 import customobjects.error_objects
 import references as r
 import references_private as rp
 import utils.data_integrity
+import utils.master_data
 import utils.misc_functions
+import utils.xero_cache
+import utils.xero_validation
 
+from utils.console_output import util_output
+from utils.db_bulk_write import bulk_insert_rows, iter_chunks
 from utils.db_connect import db_sessionmaker
 
 
-def get_xero_instance():
-    ''' Returns an instance of the xero API connection
+# The credentials, HTTP session and request pool are created once and shared by every request made by the process
+_client_lock = threading.Lock()
+_http_session = None
+_request_pool = None
+
+# Credentials and rate limits are held separately for each Xero organisation, keyed by company code
+_xero_credentials = {}
+_request_schedulers = {}
+_request_scheduler_limits = {'per_minute': r.XERO_RATE_LIMIT_PER_MINUTE, 'per_day': r.XERO_RATE_LIMIT_PER_DAY}
+
+# If set, requests are sent to this API root without OAuth signing (e.g. to the local stand-in in xero_standin.py)
+_api_url_override = None
+
+# Only one thread at a time refreshes the cached cost centre mapping
+_mapping_lock = threading.Lock()
+
+# Order of the values in the row tuples created when parsing Xero reports
+XERO_EXTRACT_COLUMNS = ('DateExtracted', 'ReportName', 'CompanyName', 'CostCentreCode', 'CostCentreName',
+                        'AccountCode', 'AccountName', 'Period', 'Value')
+
+
+class XeroRequestScheduler(object):
+    '''
+    Token bucket scheduler that every Xero API request waits on before it is sent, so that requests from concurrent
+    pulls are spread out to stay within the per-minute and per-day call limits. Rate limited responses pause all
+    requests until the limit resets
+    '''
+
+    def __init__(self, per_minute=r.XERO_RATE_LIMIT_PER_MINUTE, per_day=r.XERO_RATE_LIMIT_PER_DAY,
+                 max_wait=r.XERO_MAX_RATE_LIMIT_WAIT, clock=time.time, sleep=time.sleep):
+
+        self.per_minute = float(per_minute)
+        self.per_day = float(per_day)
+        self.max_wait = max_wait
+        self.clock = clock
+        self.sleep = sleep
+
+        self.lock = threading.Lock()
+        self.minute_tokens = self.per_minute
+        self.day_tokens = self.per_day
+        self.last_refill = clock()
+        self.paused_until = 0.0
+
+        self.counters = {'requests': 0, 'queued': 0, 'throttled': 0, 'retried': 0}
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self.last_refill)
+        self.minute_tokens = min(self.per_minute, self.minute_tokens + elapsed * self.per_minute / 60)
+        self.day_tokens = min(self.per_day, self.day_tokens + elapsed * self.per_day / (24 * 60 * 60))
+        self.last_refill = now
+
+    def _get_wait(self, now):
+        ''' Returns the number of seconds until a request can be sent '''
+
+        wait = self.paused_until - now
+        if self.minute_tokens < 1:
+            wait = max(wait, (1 - self.minute_tokens) * 60 / self.per_minute)
+        if self.day_tokens < 1:
+            wait = max(wait, (1 - self.day_tokens) * 24 * 60 * 60 / self.per_day)
+        return wait
+
+    def acquire(self):
+        ''' Blocks until a request can be sent within the rate limits
+
+        :return:
+        '''
+
+        is_queued = False
+        while True:
+            with self.lock:
+                now = self.clock()
+                self._refill(now)
+                wait = self._get_wait(now)
+                if wait <= 0:
+                    self.minute_tokens -= 1
+                    self.day_tokens -= 1
+                    self.counters['requests'] += 1
+                    return
+                if not is_queued:
+                    self.counters['queued'] += 1
+                    is_queued = True
+
+            if wait > self.max_wait:
+                raise customobjects.error_objects.XeroRateLimitError("Xero API call limit reached: the next request"
+                                                                     " can't be sent for {:.0f} seconds".format(wait))
+            self.sleep(wait)
+
+    def update_limits(self, headers):
+        ''' Reduces the available calls to those Xero reports as remaining in the response headers
+
+        :param headers: Response headers
+        :return:
+        '''
+
+        with self.lock:
+            for header, bucket in [('X-MinLimit-Remaining', 'minute_tokens'), ('X-DayLimit-Remaining', 'day_tokens')]:
+                try:
+                    remaining = float(headers[header])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                setattr(self, bucket, min(getattr(self, bucket), remaining))
+
+    def throttle(self, attempt, retry_after=None):
+        ''' Pauses all requests after a rate limited response. Xero's Retry-After is used if given, otherwise the
+            wait is an exponential backoff. Jitter is added so that waiting requests don't all retry at once
+
+        :param attempt: Number of times the request has already been retried
+        :param retry_after: Seconds Xero asked the client to wait (None if not given)
+        :return: Seconds the requests are paused for
+        '''
+
+        if retry_after is None:
+            wait = random.uniform(0.5, 1.0) * r.XERO_BACKOFF_BASE * 2 ** attempt
+        else:
+            wait = retry_after + random.uniform(0, r.XERO_BACKOFF_BASE)
+
+        if wait > self.max_wait:
+            raise customobjects.error_objects.XeroRateLimitError("Xero API call limit reached: retry after {:.0f}"
+                                                                 " seconds".format(wait))
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, self.clock() + wait)
+            self.minute_tokens = min(self.minute_tokens, 0.0)
+        return wait
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get_counters(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+
+def get_xero_organisations():
+    ''' Returns the Xero organisations that data can be pulled from, keyed by the company code of the organisation
+        in tbl_MASTER_companies. If XERO_ORGANISATIONS isn't defined in references_private, the single organisation
+        set up by CONSUMER_KEY, PRIVATE_KEY_LOCATION and CC_XERO_MAPPING_ID is returned under the company code None
+
+    :return: Dictionary of {company code: dictionary of the organisation's settings}
+    '''
+
+    organisations = getattr(rp, 'XERO_ORGANISATIONS', None)
+    if organisations:
+        return organisations
+
+    return {None: {'CONSUMER_KEY': rp.CONSUMER_KEY,
+                   'PRIVATE_KEY_LOCATION': rp.PRIVATE_KEY_LOCATION,
+                   'CC_XERO_MAPPING_ID': rp.CC_XERO_MAPPING_ID}}
+
+def get_xero_company_codes():
+    ''' Returns the company codes of all the Xero organisations that data can be pulled from
+
+    :return: Sorted list of company codes
+    '''
+
+    return sorted(get_xero_organisations().keys())
+
+def get_xero_company_code(company_code=None):
+    ''' Returns the company code of the organisation requests are made to. If no company code is given, the only
+        organisation that is set up is used
+
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Company code the organisation's settings are held under
+    '''
+
+    organisations = get_xero_organisations()
+    if company_code is None and len(organisations) == 1:
+        company_code = organisations.keys()[0]
+
+    if company_code not in organisations:
+        raise customobjects.error_objects.MasterDataIncompleteError("No Xero organisation is set up for company code"
+                                                                    " {} (organisations are set up for company codes"
+                                                                    " {})".format(company_code,
+                                                                                  get_xero_company_codes()))
+    return company_code
+
+def get_xero_organisation(company_code=None):
+    ''' Returns the settings (consumer key, private key location and cost centre tracking category ID) of a Xero
+        organisation
+
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Dictionary of settings
+    '''
+
+    return get_xero_organisations()[get_xero_company_code(company_code)]
+
+def get_xero_credentials(company_code=None):
+    ''' Returns the credentials used to sign requests to the Xero API. The private key is only read from disk
+        the first time the credentials of an organisation are requested
+
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: PrivateCredentials object
+    '''
+
+    company_code = get_xero_company_code(company_code)
+    organisation = get_xero_organisation(company_code)
+
+    with _client_lock:
+        if company_code not in _xero_credentials:
+            with open(organisation['PRIVATE_KEY_LOCATION']) as keyfile:
+                rsa_key = keyfile.read()
+            _xero_credentials[company_code] = PrivateCredentials(consumer_key=organisation['CONSUMER_KEY'],
+                                                                 rsa_key=rsa_key)
+
+    return _xero_credentials[company_code]
+
+def get_http_session():
+    ''' Returns the HTTP session used for calls to the Xero API. Connections are kept alive and reused
+        between requests rather than re-established for every call
+
+    :return: requests.Session object
+    '''
+    global _http_session
+
+    pool_size = r.XERO_HTTP_POOL_SIZE * len(get_xero_organisations())
+    with _client_lock:
+        if _http_session is None:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            _http_session = requests.Session()
+            _http_session.mount('https://', adapter)
+            _http_session.mount('http://', adapter)
+            _http_session.headers.update({'Accept': 'application/json'})
+
+    return _http_session
+
+def get_request_pool():
+    ''' Returns the pool of worker threads used to issue independent Xero API requests in parallel
+
+    :return: ThreadPool object
+    '''
+    global _request_pool
+
+    pool_size = r.XERO_HTTP_POOL_SIZE * len(get_xero_organisations())
+    with _client_lock:
+        if _request_pool is None:
+            _request_pool = ThreadPool(processes=pool_size)
+
+    return _request_pool
+
+def get_request_scheduler(company_code=None):
+    ''' Returns the scheduler that all Xero API requests to an organisation wait on (Xero applies its call limits
+        to each organisation separately)
+
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: XeroRequestScheduler object
+    '''
+
+    company_code = get_xero_company_code(company_code)
+    with _client_lock:
+        if company_code not in _request_schedulers:
+            _request_schedulers[company_code] = XeroRequestScheduler(**_request_scheduler_limits)
+
+    return _request_schedulers[company_code]
+
+def reset_request_scheduler(per_minute=r.XERO_RATE_LIMIT_PER_MINUTE, per_day=r.XERO_RATE_LIMIT_PER_DAY):
+    ''' Replaces the request schedulers with new schedulers (e.g. with different limits for benchmarks against
+        the local stand-in), which also resets the request counters
+
+    :param per_minute: Maximum number of requests per minute to each organisation
+    :param per_day: Maximum number of requests per day to each organisation
+    :return:
+    '''
+
+    with _client_lock:
+        _request_schedulers.clear()
+        _request_scheduler_limits.update({'per_minute': per_minute, 'per_day': per_day})
+
+def get_request_counters():
+    ''' Returns the number of Xero API requests sent, queued (delayed by the rate limits), throttled (rate limited
+        by Xero) and retried by the process, across all organisations
+
+    :return: Dictionary of counters
+    '''
+
+    with _client_lock:
+        schedulers = _request_schedulers.values()
+
+    counters = {'requests': 0, 'queued': 0, 'throttled': 0, 'retried': 0}
+    for scheduler in schedulers:
+        for name, value in scheduler.get_counters().items():
+            counters[name] += value
+    return counters
+
+def is_rate_limited_response(response):
+    ''' Returns whether Xero rejected a request because a rate limit was exceeded. Xero returns a 429, or a 503
+        with an oauth_problem of rate limit exceeded
+
+    :param response: requests.Response object
+    :return: True/False
+    '''
+
+    if response.status_code == 429:
+        return True
+    return response.status_code == 503 and 'rate limit exceeded' in urllib.unquote(response.text)
+
+def get_retry_after(response):
+    ''' Returns the number of seconds Xero asked the client to wait before retrying
+
+    :param response: requests.Response object
+    :return: Seconds to wait, or None if Xero didn't say
+    '''
+
+    try:
+        return float(response.headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def send_xero_request(url, params=None, auth=None, company_code=None):
+    ''' Sends a GET request once the rate limits allow it, retrying the request if it is rate limited
+
+    :param url: Full URL of the request
+    :param params: Dictionary of query string parameters
+    :param auth: Authentication object used to sign the request
+    :param company_code: Company code of the organisation the request is made to
+    :return: requests.Response object
+    '''
+
+    scheduler = get_request_scheduler(company_code)
+    for attempt in range(r.XERO_MAX_RETRIES + 1):
+        scheduler.acquire()
+        response = get_http_session().get(url, params=params, auth=auth, timeout=r.XERO_REQUEST_TIMEOUT)
+        scheduler.update_limits(response.headers)
+
+        if not is_rate_limited_response(response):
+            response.raise_for_status()
+            return response
+
+        scheduler.count('throttled')
+        if attempt < r.XERO_MAX_RETRIES:
+            scheduler.throttle(attempt=attempt, retry_after=get_retry_after(response))
+            scheduler.count('retried')
+
+    raise customobjects.error_objects.XeroRateLimitError("Xero API request still rate limited after {} retries: {}"
+                                                         .format(r.XERO_MAX_RETRIES, url))
+
+def set_xero_api_url(url):
+    ''' Directs all API requests to a different server, such as the local stand-in used for benchmarks. Requests to
+        the server are not signed and bypass the local Xero cache
+
+    :param url: API root of the server (None restores the Xero API)
+    :return:
+    '''
+    global _api_url_override
+
+    _api_url_override = url
+
+def get_xero_response_text(endpoint, params=None, refresh=False, company_code=None, use_cache=True):
+    ''' Makes a GET request to the Xero API using the shared credentials and HTTP session. Responses are recorded
+        in the local Xero cache and replayed from the cache on subsequent requests with the same parameters
+
+    :param endpoint: Path of the endpoint relative to the API root (e.g. 'Reports/ProfitAndLoss')
+    :param params: Dictionary of query string parameters
+    :param refresh: If True, ignore any cached response and retrieve the data from the API
+    :param use_cache: If False, the response is neither replayed from nor recorded in the local Xero cache (for
+                      data that is only ever read once, such as new journals)
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Tuple of (raw JSON text of the response, local datetime the response was retrieved from Xero)
+    '''
+
+    company_code = get_xero_company_code(company_code)
+
+    api_url_override = _api_url_override
+    if api_url_override:
+        fetched_at = datetime.datetime.now()
+        response = send_xero_request(api_url_override + "/" + endpoint, params=params, company_code=company_code)
+        return response.text, fetched_at
+
+    cached_response = None if (refresh or not use_cache) else \
+        utils.xero_cache.read_cached_response(endpoint=endpoint, params=params, company_code=company_code)
+    if cached_response is not None:
+        return cached_response
+
+    # Data posted in Xero while the request is in progress may not be included, so the response is dated when the
+    # request was made
+    fetched_at = datetime.datetime.now()
+    credentials = get_xero_credentials(company_code)
+    url = credentials.base_url + XERO_API_URL + "/" + endpoint
+
+    response = send_xero_request(url, params=params, auth=credentials.oauth, company_code=company_code)
 
-    :return: xero instance
+    if use_cache:
+        utils.xero_cache.write_cached_response(endpoint=endpoint, params=params, response_text=response.text,
+                                               company_code=company_code, fetched_at=fetched_at)
+
+    return response.text, fetched_at
+
+def xero_api_get(endpoint, params=None, refresh=False, company_code=None, use_cache=True):
+    ''' Makes a GET request to the Xero API (see get_xero_response_text)
+
+    :param endpoint: Path of the endpoint relative to the API root (e.g. 'Reports/ProfitAndLoss')
+    :param params: Dictionary of query string parameters
+    :param refresh: If True, ignore any cached response and retrieve the data from the API
+    :param use_cache: If False, the response is neither replayed from nor recorded in the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: The decoded JSON response (Xero dates are converted to datetime objects as in pyxero)
+    '''
+
+    response_text, fetched_at = get_xero_response_text(endpoint=endpoint, params=params, refresh=refresh,
+                                                       company_code=company_code, use_cache=use_cache)
+    return json.loads(response_text, object_hook=json_load_object_hook)
+
+def xero_api_get_report(endpoint, params=None, refresh=False, company_code=None):
+    ''' Retrieves a report from the Xero API (see get_xero_response_text), recording the time the report was
+        retrieved from Xero in the report under r.XERO_REPORT_DATE_FETCHED
+
+    :param endpoint: Path of the report endpoint relative to the API root (e.g. 'Reports/ProfitAndLoss')
+    :param params: Dictionary of query string parameters
+    :param refresh: If True, ignore any cached response and retrieve the report from the API
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: A JSON object containing the report
+    '''
+
+    response_text, fetched_at = get_xero_response_text(endpoint=endpoint, params=params, refresh=refresh,
+                                                       company_code=company_code)
+
+    xero_data = json.loads(response_text, object_hook=json_load_object_hook)['Reports'][0]
+    xero_data[r.XERO_REPORT_DATE_FETCHED] = fetched_at
+    return xero_data
+
+def get_xero_report_timestamp(xero_data, timestamp=None):
+    ''' Returns the time recorded as the DateExtracted of the rows of a report. Reports are dated when they were
+        retrieved from Xero, so that data replayed from the local Xero cache isn't treated as including journals
+        posted after it was retrieved
+
+    :param xero_data: Raw Xero output from the API
+    :param timestamp: Time used if the report doesn't record when it was retrieved (defaults to now)
+    :return: Datetime
+    '''
+
+    if xero_data.get(r.XERO_REPORT_DATE_FETCHED):
+        return xero_data[r.XERO_REPORT_DATE_FETCHED]
+    return timestamp if timestamp else datetime.datetime.now()
+
+def get_xero_journal_sync_time(company_name):
+    ''' Returns the time the Xero journals were last applied to the Xero extract table for a company (see
+        utils.xero_journals.sync_xero_journals)
+
+    :param company_name: Name of the company (as named in the Xero reports)
+    :return: Local datetime of the last sync, None if the journals have never been synced
+    '''
+
+    session = db_sessionmaker()
+    journal_sync = session.query(TableXeroJournalSync)\
+        .filter(TableXeroJournalSync.CompanyName == company_name)\
+        .one_or_none()
+    session.close()
+
+    return journal_sync.DateSynced if journal_sync else None
+
+def is_xero_report_older_than_journal_sync(xero_data):
+    ''' Checks whether a report was retrieved from Xero before the journals were last synced for its company. The
+        sync only applies journals it hasn't seen before, so writing such a report (e.g. replayed from the local Xero
+        cache) would remove the journals the sync has already applied without them ever being applied again
+
+    :param xero_data: Raw Xero output from the API
+    :return: Boolean
     '''
-    with open(rp.PRIVATE_KEY_LOCATION) as keyfile:
-        rsa_key = keyfile.read()
 
-    credentials = PrivateCredentials(consumer_key=rp.CONSUMER_KEY, rsa_key=rsa_key)
-    xero = Xero(credentials)
+    date_fetched = xero_data.get(r.XERO_REPORT_DATE_FETCHED)
+    if date_fetched is None:
+        return False
 
-    return xero
+    date_synced = get_xero_journal_sync_time(company_name=xero_data['ReportTitles'][1])
+    return date_synced is not None and date_fetched < date_synced
 
-def get_tracking_categories():
+def get_tracking_categories(refresh=False, company_code=None):
     ''' Returns all tracking categories currently set up in Xero
 
+    :param refresh: If True, retrieve the categories from the API rather than the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
     :return:
     '''
 
-    xero = get_xero_instance()
-    return xero.trackingcategories.all()
+    return xero_api_get('TrackingCategories', refresh=refresh, company_code=company_code)['TrackingCategories']
 
-def get_cost_centre_id_dictionary():
+def get_cost_centre_id_dictionary(categories=None, company_code=None):
     ''' Creates a dictionary of cost centre names and IDs as mapped in Xero
 
+    :param categories: Tracking categories previously retrieved from Xero (retrieved from the API if not given)
+    :param company_code: Company code of the organisation the categories are retrieved from if not given
     :return:
     '''
 
-    categories = get_tracking_categories()
+    if categories is None:
+        categories = get_tracking_categories(company_code=company_code)
     cost_centres = [d for d in categories if d['Name']==r.XERO_DATA_COSTCENTRES][0]
     options = cost_centres['Options']
     output_dict = {a['Name']:a['TrackingOptionID'] for a in options}
     return output_dict
 
-def print_tracking_categories():
+def get_master_xero_cost_centre_codes():
+    ''' Returns the Xero tracking option IDs that cost centres are mapped to in the master data
+
+    :return: Set of Xero cost centre codes
+    '''
+
+    return set(utils.master_data.get_master_data_snapshot().cost_centres_by_xero_code.keys())
+
+def get_cost_centre_mapping(refresh=False, required_names=None, company_code=None):
+    ''' Returns the mapping of Xero cost centre names to tracking option IDs. The mapping is re-used from the local
+        mapping cache until it expires, or until it no longer covers the master data cost centres or the cost
+        centres in a report, at which point it is retrieved from Xero again
+
+    :param refresh: If True, retrieve the mapping from Xero even if the cached mapping is still valid
+    :param required_names: Cost centre names that must be included in the mapping (e.g. the columns of a report)
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Dictionary of {cost centre name: tracking option ID}
+    '''
+
+    company_code = get_xero_company_code(company_code)
+
+    # The master data doesn't record which organisation a cost centre belongs to, so each organisation's mapping
+    # can only be checked against the master data when there is a single organisation
+    master_codes = get_master_xero_cost_centre_codes() if len(get_xero_organisations()) == 1 else set()
+    required_names = set(required_names if required_names else []) - set([r.XERO_DATA_COSTCENTRES_UNASSIGNED])
+
+    def get_missing_cost_centres(mapping):
+        return sorted(master_codes - set(mapping.values())), sorted(required_names - set(mapping.keys()))
+
+    with _mapping_lock:
+        mapping = None if refresh else utils.xero_cache.read_cost_centre_mapping(company_code=company_code)
+        if mapping is not None and not any(get_missing_cost_centres(mapping)):
+            return mapping
+
+        mapping = get_cost_centre_id_dictionary(categories=get_tracking_categories(refresh=True,
+                                                                                   company_code=company_code))
+        utils.xero_cache.write_cost_centre_mapping(mapping, company_code=company_code)
+
+    missing_codes, missing_names = get_missing_cost_centres(mapping)
+    if missing_codes or missing_names:
+        raise customobjects.error_objects.MasterDataIncompleteError("Cost centres are missing from the Xero tracking"
+                                                                    " category '{}' (XeroCodes in {}: {}; cost centres"
+                                                                    " in the report: {})"
+                                                                    .format(r.XERO_DATA_COSTCENTRES,
+                                                                            r.TBL_MASTER_COSTCENTRES,
+                                                                            missing_codes, missing_names))
+    return mapping
+
+def print_tracking_categories(company_code=None):
     ''' Utility function to return all tracking categories currently set up in Xero
 
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
     :return:
     '''
-    pprint.pprint(get_tracking_categories())
+    pprint.pprint(get_tracking_categories(refresh=True, company_code=company_code))
 
 def get_to_from_date_range(year, month):
     ''' Calculates the to and from dates for each reporting period, taking into account leap years, months of different lengths, etc
@@ -83,56 +607,170 @@ def get_to_from_date_range(year, month):
 
     return from_date, to_date
 
-def get_xero_profit_and_loss_data(year, month):
+def get_xero_profit_and_loss_data(year, month, refresh=False, company_code=None):
     ''' Retrieves Profit & Loss data from Xero for a specific period
 
     :param year:
     :param month:
+    :param refresh: If True, retrieve the report from the API rather than the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
     :return: A JSON object containing the Profit & Loss account split by cost centre
     '''
 
-    xero = get_xero_instance()
-
     # Define the to- and from-dates in the YYYY-MM-DD format required by the xero api
     from_date, to_date = get_to_from_date_range(year=year, month=month)
-    from_date.strftime('%Y-%m-%d')
-    to_date.strftime('%Y-%m-%d')
 
     # Retrieve the data from xero
-    xero_data = xero.reports.get(
-        'ProfitAndLoss',
+    return xero_api_get_report(
+        'Reports/ProfitAndLoss',
         params={
-            'fromDate': from_date,
-            'toDate': to_date,
-            'trackingCategoryID': rp.CC_XERO_MAPPING_ID,
+            'fromDate': from_date.strftime('%Y-%m-%d'),
+            'toDate': to_date.strftime('%Y-%m-%d'),
+            'trackingCategoryID': get_xero_organisation(company_code)['CC_XERO_MAPPING_ID'],
         },
+        refresh=refresh,
+        company_code=company_code,
     )
-    return xero_data[0]
 
-def get_xero_balancesheet_data(year, month):
+def get_xero_balancesheet_data(year, month, refresh=False, company_code=None):
     ''' Retrieves Balance Sheet data from Xero for a specific period
 
     :param year:
     :param month:
+    :param refresh: If True, retrieve the report from the API rather than the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
     :return: A JSON object containing the Balance Sheet
     '''
 
-    xero = get_xero_instance()
-
     # Define the to- and from-dates in the YYYY-MM-DD format required by the xero api
     from_date, to_date = get_to_from_date_range(year=year, month=month)
-    from_date.strftime('%Y-%m-%d')
-    to_date.strftime('%Y-%m-%d')
 
     # Retrieve the data from xero
-    xero_data = xero.reports.get(
-        'BalanceSheet',
+    return xero_api_get_report(
+        'Reports/BalanceSheet',
         params={
-            'date': to_date,    # Only use to_date in order to capture the balance on the last day of the period
+            'date': to_date.strftime('%Y-%m-%d'),    # Only use to_date in order to capture the balance on the last day of the period
         },
+        refresh=refresh,
+        company_code=company_code,
     )
 
-    return xero_data[0]
+def get_xero_balancesheet_data_for_periods(year, month, period_count, refresh=False, company_code=None):
+    ''' Retrieves the Balance Sheets of several consecutive periods from Xero as a single multi-period report
+
+    :param year: Year of the last period
+    :param month: Month of the last period
+    :param period_count: Number of periods up to and including the last period (at most XERO_REPORT_MAX_PERIODS)
+    :param refresh: If True, retrieve the report from the API rather than the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: A JSON object containing the Balance Sheet with one column per period (latest period first)
+    '''
+
+    from_date, to_date = get_to_from_date_range(year=year, month=month)
+
+    params = {'date': to_date.strftime('%Y-%m-%d')}
+    if period_count > 1:
+        # The comparative periods are the months before the reporting date
+        params.update({'periods': period_count - 1, 'timeframe': 'MONTH'})
+
+    return xero_api_get_report('Reports/BalanceSheet', params=params, refresh=refresh, company_code=company_code)
+
+def get_xero_report_column_periods(xero_data):
+    ''' Returns the period of each balance column in a report from the dates in the column headings
+        (e.g. '31 Dec 2017'). Only columns dated the last day of a month are closing balances of that period, so
+        columns with any other date are left out
+
+    :param xero_data: Raw Xero output from the API
+    :return: Dictionary of {(year, month): column index}
+    '''
+
+    column_periods = {}
+    for row in xero_data['Rows']:
+        if row['RowType'] == "Header":
+            for column, cell in enumerate(row['Cells']):
+                try:
+                    column_date = datetime.datetime.strptime(cell['Value'], '%d %b %Y')
+                except ValueError:
+                    continue    # Columns without a date (the account name, the prior year comparator, etc)
+                if column_date.year not in r.AVAILABLE_PERIODS_YEARS:
+                    continue
+                if column_date == get_to_from_date_range(year=column_date.year, month=column_date.month)[1]:
+                    column_periods.setdefault((column_date.year, column_date.month), column)
+    return column_periods
+
+def _select_report_column(rows, column):
+    ''' Copies the rows of a report, keeping only the first cell (the account name) and one balance column
+
+    :param rows: List of report rows (sections are copied recursively)
+    :param column: Index of the balance column to keep
+    :return: List of report rows
+    '''
+
+    selected_rows = []
+    for row in rows:
+        row = dict(row)
+        if row.get('Cells'):
+            if len(row['Cells']) <= column:
+                raise ValueError("Report row has no balance in column {}: {}".format(column, row['Cells'][0]))
+            row['Cells'] = [row['Cells'][0], row['Cells'][column]]
+        if 'Rows' in row:
+            row['Rows'] = _select_report_column(rows=row['Rows'], column=column)
+        selected_rows.append(row)
+    return selected_rows
+
+def split_xero_balancesheet_periods(xero_data):
+    ''' Splits a multi-period Balance Sheet into one Balance Sheet per period, each in the format returned by
+        get_xero_balancesheet_data
+
+    :param xero_data: Raw Xero output from the API
+    :return: Dictionary of {(year, month): Balance Sheet JSON object}
+    '''
+
+    balance_sheets = {}
+    for period, column in get_xero_report_column_periods(xero_data).items():
+        balance_sheet = dict(xero_data)
+        balance_sheet['Rows'] = _select_report_column(rows=xero_data['Rows'], column=column)
+        balance_sheets[period] = balance_sheet
+    return balance_sheets
+
+def get_xero_balancesheet_data_by_period(periods, refresh=False, company_code=None):
+    ''' Retrieves the Balance Sheets of several periods, requesting each run of consecutive months as a single
+        multi-period report of up to XERO_REPORT_MAX_PERIODS periods
+
+    :param periods: List of (year, month) tuples
+    :param refresh: If True, retrieve the reports from the API rather than the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Dictionary of {(year, month): Balance Sheet JSON object}
+    '''
+
+    balance_sheets = {}
+    for batch in utils.misc_functions.get_consecutive_period_batches(periods=periods,
+                                                                     batch_size=r.XERO_REPORT_MAX_PERIODS):
+        year, month = batch[-1]
+        xero_data = get_xero_balancesheet_data_for_periods(year=year, month=month, period_count=len(batch),
+                                                           refresh=refresh, company_code=company_code)
+        batch_balance_sheets = split_xero_balancesheet_periods(xero_data)
+        balance_sheets.update({period: batch_balance_sheets[period] for period in batch
+                               if period in batch_balance_sheets})
+    return balance_sheets
+
+def get_xero_period_data(year, month, refresh=False, company_code=None):
+    ''' Retrieves the Profit & Loss and Balance Sheet from Xero for a specific period. The two requests are
+        independent of each other so are issued in parallel
+
+    :param year:
+    :param month:
+    :param refresh: If True, retrieve the data from the API rather than the local Xero cache
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Tuple of (Profit & Loss JSON object, Balance Sheet JSON object)
+    '''
+
+    request_kwargs = {'year': year, 'month': month, 'refresh': refresh, 'company_code': company_code}
+    pool = get_request_pool()
+    pnl_request = pool.apply_async(get_xero_profit_and_loss_data, kwds=request_kwargs)
+    bs_request = pool.apply_async(get_xero_balancesheet_data, kwds=request_kwargs)
+
+    return pnl_request.get(), bs_request.get()
 
 def get_list_of_cost_centres(xero_data):
     ''' Returns an ordered list of cost centres in the data
@@ -148,21 +786,66 @@ def get_list_of_cost_centres(xero_data):
                     list_of_cost_centres.append(cost_centre)
     return list_of_cost_centres
 
-def parse_xero_pnl_body_data(xero_data, list_of_cost_centres, cost_centre_dict, year, month):
-    ''' Parses the Profit & Loss (split by Cost Centre) report and imports into the database
+def convert_xero_value(value):
+    ''' Converts the value of a cell in a Xero report to a float (Xero returns numbers as strings and leaves
+        cells without a balance empty)
 
-    :param xero_data:
-    :param list_of_cost_centres:
-    :return:
+    :param value: Value of the report cell
+    :return: Float value of the cell
+    '''
+
+    if value in [None, ""]:
+        return 0.0
+    return float(value)
+
+def get_cost_centre_columns(list_of_cost_centres, cost_centre_dict):
+    ''' Returns the (column index, cost centre code, cost centre name) of each cost centre column in the report
+
+    :param list_of_cost_centres: Ordered list of the cost centres in the report columns
+    :param cost_centre_dict: Dictionary of Xero cost centre names and tracking option IDs
+    :return: List of tuples
+    '''
+
+    # Exclude the first column (the account name) and the last column (the total)
+    cost_centre_columns = []
+    for i in range(1,len(list_of_cost_centres)-1):
+        cost_centre_name = list_of_cost_centres[i]
+
+        # The "Unassigned" cost centre is not included in the dictionary so must be handled separtely.
+        cost_centre_code = None
+        try:
+           cost_centre_code = cost_centre_dict[cost_centre_name]
+        except KeyError, e:
+            if cost_centre_name == r.XERO_DATA_COSTCENTRES_UNASSIGNED:
+                pass
+            else:
+                raise e
+        cost_centre_columns.append((i, cost_centre_code, cost_centre_name))
+    return cost_centre_columns
+
+def iter_xero_pnl_body_rows(xero_data, list_of_cost_centres, cost_centre_dict, year, month, timestamp=None):
+    ''' Parses the Profit & Loss (split by Cost Centre) report, yielding one tuple per non-zero account/cost centre
+        balance with values in the order of XERO_EXTRACT_COLUMNS
+
+    :param xero_data: Raw Xero output from the API
+    :param list_of_cost_centres: Ordered list of the cost centres in the report columns
+    :param cost_centre_dict: Dictionary of Xero cost centre names and tracking option IDs
+    :param year:
+    :param month:
+    :param timestamp: Time the data was extracted, if the report doesn't record when it was retrieved from Xero
+                      (defaults to now)
+    :return: Generator of row tuples
     '''
 
-    timestamp = datetime.datetime.now()
+    timestamp = get_xero_report_timestamp(xero_data=xero_data, timestamp=timestamp)
     period = datetime.datetime(year=year, month=month,day=1)
-    list_of_database_rows = []
 
     report_name = xero_data['ReportID']
     company_name = xero_data['ReportTitles'][1]
 
+    cost_centre_columns = get_cost_centre_columns(list_of_cost_centres=list_of_cost_centres,
+                                                  cost_centre_dict=cost_centre_dict)
+
     for row in xero_data['Rows']:
         if row['RowType'] == "Section":
             for section in row['Rows']:
@@ -172,51 +855,26 @@ def parse_xero_pnl_body_data(xero_data, list_of_cost_centres, cost_centre_dict,
                 except KeyError, e:
                     pass    # Supress KeyErrors to exclude summary or totals rows (don't have 'Attributes' field)
                 else:
-                    # Exclude the first cell (the account name) and the last cell (the total)
-                    for i in range(1,len(list_of_cost_centres)-1):
-                        cost_centre_name = list_of_cost_centres[i]
-
-                        # The "Unassigned" cost centre is not included in the dictionary so must be handled separtely.
-                        cost_centre_code = None
-                        try:
-                           cost_centre_code = cost_centre_dict[cost_centre_name]
-                        except KeyError, e:
-                            if cost_centre_name == r.XERO_DATA_COSTCENTRES_UNASSIGNED:
-                                pass
-                            else:
-                                raise e
-
-                        value = section['Cells'][i]['Value']
-
-                        xero_ledger_entry = TableXeroExtract(
-                                                            DateExtracted = timestamp,
-                                                            ReportName = report_name,
-                                                            CompanyName = company_name,
-                                                            CostCentreCode = cost_centre_code,
-                                                            CostCentreName = cost_centre_name,
-                                                            AccountCode = account_code,
-                                                            AccountName = account_name,
-                                                            Period = period,
-                                                            Value = value,
-                                                            )
-                        list_of_database_rows.append(xero_ledger_entry)
-
-    return list_of_database_rows
+                    for i, cost_centre_code, cost_centre_name in cost_centre_columns:
+                        value = convert_xero_value(section['Cells'][i]['Value'])
+                        if value != 0:
+                            yield (timestamp, report_name, company_name, cost_centre_code, cost_centre_name,
+                                   account_code, account_name, period, value)
 
-def parse_xero_balancesheet_body_data(xero_data, year, month):
-    ''' Parses the Balance Sheet report and creates a list of database rows
+def iter_xero_balancesheet_body_rows(xero_data, year, month, timestamp=None):
+    ''' Parses the Balance Sheet report, yielding one tuple per non-zero account balance with values in the order
+        of XERO_EXTRACT_COLUMNS
 
     :param xero_data: Raw Xero output from the API
     :param year:
     :param month:
-    :return: List of TableXeroExtract row objects populated with data
+    :param timestamp: Time the data was extracted, if the report doesn't record when it was retrieved from Xero
+                      (defaults to now)
+    :return: Generator of row tuples
     '''
 
-    # ToDo: Refactor to combine parsing of Balance Sheet and Income Statement functions
-
-    timestamp = datetime.datetime.now()
+    timestamp = get_xero_report_timestamp(xero_data=xero_data, timestamp=timestamp)
     period = datetime.datetime(year=year, month=month,day=1)
-    list_of_database_rows = []
 
     report_name = xero_data['ReportID']
     company_name = xero_data['ReportTitles'][1]
@@ -232,74 +890,416 @@ def parse_xero_balancesheet_body_data(xero_data, year, month):
                     pass    # Supress KeyErrors to exclude summary or totals rows (don't have 'Attributes' field)
                 else:
                     # Exclude the first cell (the account name) and the last cell (prior year comparator)
-                    value = section['Cells'][1]['Value']
-                    xero_ledger_entry = TableXeroExtract(
-                                                        DateExtracted=timestamp,
-                                                        ReportName=report_name,
-                                                        CompanyName=company_name,
-                                                        CostCentreName=None,
-                                                        AccountCode=account_code,
-                                                        AccountName=account_name,
-                                                        Period=period,
-                                                        Value=value,
-                                                    )
+                    value = convert_xero_value(section['Cells'][1]['Value'])
+                    if value != 0:
+                        yield (timestamp, report_name, company_name, None, None,
+                               account_code, account_name, period, value)
+
+def parse_xero_pnl_body_data(xero_data, list_of_cost_centres, cost_centre_dict, year, month):
+    ''' Parses the Profit & Loss (split by Cost Centre) report into database rows
+
+    :param xero_data:
+    :param list_of_cost_centres:
+    :return: List of TableXeroExtract row objects for the non-zero balances in the report
+    '''
+
+    return [TableXeroExtract(**dict(zip(XERO_EXTRACT_COLUMNS, row)))
+            for row in iter_xero_pnl_body_rows(xero_data=xero_data,
+                                               list_of_cost_centres=list_of_cost_centres,
+                                               cost_centre_dict=cost_centre_dict,
+                                               year=year,
+                                               month=month)]
+
+def parse_xero_balancesheet_body_data(xero_data, year, month):
+    ''' Parses the Balance Sheet report and creates a list of database rows
+
+    :param xero_data: Raw Xero output from the API
+    :param year:
+    :param month:
+    :return: List of TableXeroExtract row objects for the non-zero balances in the report
+    '''
+
+    return [TableXeroExtract(**dict(zip(XERO_EXTRACT_COLUMNS, row)))
+            for row in iter_xero_balancesheet_body_rows(xero_data=xero_data, year=year, month=month)]
+
+def insert_xero_extract_rows(session, rows, chunk_size=r.DB_BULK_INSERT_CHUNK_SIZE):
+    ''' Inserts row tuples into the Xero extract table in batches, using a single multi-row INSERT per batch
+        rather than adding an ORM object per row
+
+    :param session: Session to insert the rows in (the caller is responsible for committing)
+    :param rows: Iterable of row tuples with values in the order of XERO_EXTRACT_COLUMNS
+    :param chunk_size: Number of rows sent to the database per statement
+    :return: Number of rows inserted
+    '''
+
+    return bulk_insert_rows(session=session, table=TableXeroExtract, rows=rows, columns=XERO_EXTRACT_COLUMNS,
+                            chunk_size=chunk_size)
+
+def iter_xero_rows_recording_validation_facts(rows, facts):
+    ''' Passes row tuples through unchanged, adding the balance of each row to the validation facts of its account
+        as it is streamed to the database
+
+    :param rows: Iterable of row tuples with values in the order of XERO_EXTRACT_COLUMNS
+    :param facts: Dictionary of validation facts (see utils.xero_validation.add_xero_validation_fact)
+    :return: Generator of row tuples
+    '''
+
+    for row in rows:
+        values = dict(zip(XERO_EXTRACT_COLUMNS, row))
+        utils.xero_validation.add_xero_validation_fact(facts=facts, report_name=values['ReportName'],
+                                                       company_name=values['CompanyName'],
+                                                       cost_centre_name=values['CostCentreName'],
+                                                       account_code=values['AccountCode'],
+                                                       account_name=values['AccountName'],
+                                                       period=values['Period'], value=values['Value'])
+        yield row
+
+def get_xero_extract_changes(existing_rows, rows):
+    ''' Compares the rows already held in the database for a period against a fresh extract of the period
+
+    :param existing_rows: List of (ID, ReportName, CompanyName, CostCentreCode, AccountCode, Value) tuples already
+                          held in the database for the period
+    :param rows: Iterable of new row tuples with values in the order of XERO_EXTRACT_COLUMNS
+    :return: Tuple of (rows to insert, rows to update, rows to delete). Rows to insert are row tuples, rows to update
+             are (ID, old value, row tuple) and rows to delete are (ID, key, old value)
+    '''
+
+    existing_by_key = {}
+    rows_to_delete = []
+    for row_id, report_name, company_name, cost_centre_code, account_code, value in existing_rows:
+        key = (report_name, company_name, cost_centre_code, account_code)
+        if key in existing_by_key:
+            rows_to_delete.append((row_id, key, value))     # Duplicate rows for the same balance are removed
+        else:
+            existing_by_key[key] = (row_id, value)
+
+    rows_to_insert = []
+    rows_to_update = []
+    for row in rows:
+        values = dict(zip(XERO_EXTRACT_COLUMNS, row))
+        key = (values['ReportName'], values['CompanyName'], values['CostCentreCode'], values['AccountCode'])
+        existing = existing_by_key.pop(key, None)
+        if existing is None:
+            rows_to_insert.append(row)
+        else:
+            row_id, old_value = existing
+            if round(old_value, r.XERO_EXTRACT_VALUE_DECIMALS) != round(values['Value'], r.XERO_EXTRACT_VALUE_DECIMALS):
+                rows_to_update.append((row_id, old_value, row))
+
+    # Any balance not present in the new extract no longer exists in Xero
+    rows_to_delete.extend([(row_id, key, value) for key, (row_id, value) in existing_by_key.items()])
+
+    return rows_to_insert, rows_to_update, rows_to_delete
+
+def delete_xero_extract_rows(session, year, month, company_names, report_names=None):
+    ''' Deletes the Xero extract rows of a period for specific companies, leaving the data pulled from other Xero
+        organisations untouched
+
+    :param session: Session to delete the rows in (the caller is responsible for committing)
+    :param year:
+    :param month:
+    :param company_names: Names of the companies (as named in the Xero reports) to delete the rows of
+    :param report_names: Names of the reports to delete the rows of (defaults to all reports)
+    :return: Number of rows deleted
+    '''
+
+    utils.data_integrity.check_period_is_locked(year=year, month=month)
+    period = datetime.datetime(year=year, month=month, day=1)
+
+    query = session.query(TableXeroExtract)\
+        .filter(TableXeroExtract.Period == period)\
+        .filter(TableXeroExtract.CompanyName.in_(company_names))
+    if report_names is not None:
+        query = query.filter(TableXeroExtract.ReportName.in_(report_names))
+
+    return query.delete(synchronize_session=False)
 
-                    list_of_database_rows.append(xero_ledger_entry)
+def sync_xero_extract_rows(session, year, month, rows, company_names, chunk_size=r.DB_BULK_INSERT_CHUNK_SIZE):
+    ''' Applies a fresh extract of a period to the Xero extract table by inserting new balances, updating changed
+        balances and deleting balances no longer in Xero, leaving unchanged rows untouched. Each change is recorded
+        in the Xero extract changelog table
 
-    return list_of_database_rows
+    :param session: Session to apply the changes in (the caller is responsible for committing)
+    :param year:
+    :param month:
+    :param rows: Iterable of row tuples with values in the order of XERO_EXTRACT_COLUMNS
+    :param company_names: Names of the companies in the extract (rows of other companies are left untouched)
+    :param chunk_size: Number of rows sent to the database per statement
+    :return: Tuple of the number of rows (inserted, updated, deleted)
+    '''
 
-def pull_xero_data_to_database(year, month):
-    ''' Pulls data via the Xero API and imports it into the database
+    period = datetime.datetime(year=year, month=month, day=1)
+    date_changed = datetime.datetime.now()
+    extract_table = TableXeroExtract.__table__
+
+    existing_rows = session.query(TableXeroExtract.ID,
+                                  TableXeroExtract.ReportName,
+                                  TableXeroExtract.CompanyName,
+                                  TableXeroExtract.CostCentreCode,
+                                  TableXeroExtract.AccountCode,
+                                  TableXeroExtract.Value)\
+        .filter(TableXeroExtract.Period == period)\
+        .filter(TableXeroExtract.CompanyName.in_(company_names))\
+        .all()
+
+    rows_to_insert, rows_to_update, rows_to_delete = get_xero_extract_changes(existing_rows=existing_rows, rows=rows)
+
+    change_log = []
+    for row in rows_to_insert:
+        values = dict(zip(XERO_EXTRACT_COLUMNS, row))
+        change_log.append({'ChangeType': r.XERO_CHANGE_INSERTED, 'OldValue': None, 'NewValue': values['Value'],
+                           'ReportName': values['ReportName'], 'CompanyName': values['CompanyName'],
+                           'CostCentreCode': values['CostCentreCode'], 'AccountCode': values['AccountCode']})
+    for row_id, old_value, row in rows_to_update:
+        values = dict(zip(XERO_EXTRACT_COLUMNS, row))
+        change_log.append({'ChangeType': r.XERO_CHANGE_UPDATED, 'OldValue': old_value, 'NewValue': values['Value'],
+                           'ReportName': values['ReportName'], 'CompanyName': values['CompanyName'],
+                           'CostCentreCode': values['CostCentreCode'], 'AccountCode': values['AccountCode']})
+    for row_id, (report_name, company_name, cost_centre_code, account_code), old_value in rows_to_delete:
+        change_log.append({'ChangeType': r.XERO_CHANGE_DELETED, 'OldValue': old_value, 'NewValue': None,
+                           'ReportName': report_name, 'CompanyName': company_name,
+                           'CostCentreCode': cost_centre_code, 'AccountCode': account_code})
+
+    insert_xero_extract_rows(session=session, rows=rows_to_insert, chunk_size=chunk_size)
+
+    update_statement = extract_table.update()\
+        .where(extract_table.c.ID == bindparam('row_id'))\
+        .values(Value=bindparam('new_value'), DateExtracted=bindparam('date_extracted'))
+    for chunk in iter_chunks(rows_to_update, chunk_size):
+        session.execute(update_statement, [{'row_id': row_id,
+                                            'new_value': row[XERO_EXTRACT_COLUMNS.index('Value')],
+                                            'date_extracted': row[XERO_EXTRACT_COLUMNS.index('DateExtracted')]}
+                                           for row_id, old_value, row in chunk])
+
+    for chunk in iter_chunks(rows_to_delete, chunk_size):
+        session.execute(extract_table.delete().where(extract_table.c.ID.in_([row_id for row_id, key, value in chunk])))
+
+    for log_entry in change_log:
+        log_entry.update({'DateChanged': date_changed, 'Period': period})
+    bulk_insert_rows(session=session, table=TableXeroExtractChangeLog, rows=change_log, chunk_size=chunk_size)
+
+    return len(rows_to_insert), len(rows_to_update), len(rows_to_delete)
+
+def check_xero_row_counts(year, month, pnl_row_count, bs_row_count):
+    ''' Raises a TableEmptyForPeriodError if either report returned no data (data should exist for all periods
+        in Xero)
 
     :param year:
     :param month:
+    :param pnl_row_count: Number of rows parsed from the Income Statement
+    :param bs_row_count: Number of rows parsed from the Balance Sheet
     :return:
     '''
 
+    if not pnl_row_count or not bs_row_count:
+        raise customobjects.error_objects.TableEmptyForPeriodError("No data exists in Xero for period {}.{}"
+                                                                   " ({} records returned for Income Statement,"
+                                                                   " {} records returned for Balance Sheet)"
+                                                                   .format(year, month, pnl_row_count, bs_row_count))
+
+def get_xero_extract_rows(year, month, refresh=False, company_code=None, bs_xero_data=None, timestamp=None):
+    ''' Retrieves the Income Statement and Balance Sheet of a period from Xero and parses them into rows of the
+        Xero extract table
+
+    :param year:
+    :param month:
+    :param refresh: If True, retrieve the data from the API rather than replaying it from the local Xero cache
+    :param company_code: Company code of the Xero organisation to pull (optional if only one organisation is set up)
+    :param bs_xero_data: Balance Sheet of the period already retrieved from Xero, retrieved from the API if not given
+    :param timestamp: Time the data was extracted, used for reports that don't record when they were retrieved from
+                      Xero (defaults to now)
+    :return: Tuple of (names of the companies in the reports, generator of Income Statement row tuples, generator
+             of Balance Sheet row tuples), with row values in the order of XERO_EXTRACT_COLUMNS
+    '''
+
+    # Pull the Income Statement data and Balance Sheet data from the API
+    if bs_xero_data is None:
+        pnl_xero_data, bs_xero_data = get_xero_period_data(year=year, month=month, refresh=refresh,
+                                                           company_code=company_code)
+    else:
+        pnl_xero_data = get_xero_profit_and_loss_data(year=year, month=month, refresh=refresh,
+                                                      company_code=company_code)
+
+    # Reports retrieved before the journals were last synced don't include the journals the sync has applied, so
+    # they are retrieved from the API again rather than replayed from the local Xero cache
+    if not refresh and (is_xero_report_older_than_journal_sync(xero_data=pnl_xero_data)
+                        or is_xero_report_older_than_journal_sync(xero_data=bs_xero_data)):
+        pnl_xero_data, bs_xero_data = get_xero_period_data(year=year, month=month, refresh=True,
+                                                           company_code=company_code)
+
+    company_names = list(set([pnl_xero_data['ReportTitles'][1], bs_xero_data['ReportTitles'][1]]))
+
+    # Retrieve the Cost Centres that the data is mapped against
+    list_of_costcentres = get_list_of_cost_centres(xero_data=pnl_xero_data) # Used for the Income Statement only
+    cost_centre_id_mapping = get_cost_centre_mapping(required_names=list_of_costcentres[1:-1],
+                                                     company_code=company_code)
+
+    timestamp = timestamp if timestamp else datetime.datetime.now()
+    pnl_data_rows = iter_xero_pnl_body_rows(xero_data=pnl_xero_data,
+                                            list_of_cost_centres=list_of_costcentres,
+                                            cost_centre_dict=cost_centre_id_mapping,
+                                            year=year,
+                                            month=month,
+                                            timestamp=timestamp)
+
+    bs_data_rows = iter_xero_balancesheet_body_rows(xero_data=bs_xero_data,
+                                                    year=year,
+                                                    month=month,
+                                                    timestamp=timestamp)
+
+    return company_names, pnl_data_rows, bs_data_rows
+
+def pull_xero_data_to_database(year, month, refresh=False, incremental=False, company_code=None, bs_xero_data=None):
+    ''' Pulls data via the Xero API and imports it into the database. Only the data of the company being pulled
+        is replaced, so organisations can be pulled independently of each other
+
+    :param year:
+    :param month:
+    :param refresh: If True, retrieve the data from the API rather than replaying it from the local Xero cache
+    :param incremental: If True, only the balances that have changed since the last pull are written to the database
+                        (the data is always retrieved from the API, as a replayed response can't have changed)
+    :param company_code: Company code of the Xero organisation to pull (optional if only one organisation is set up)
+    :param bs_xero_data: Balance Sheet of the period already retrieved from Xero (e.g. split from a multi-period
+                         report), retrieved from the API if not given
+    :return: Tuple of the number of rows (inserted, updated, deleted) if incremental, otherwise None
+    '''
+
+    # An incremental pull compares the latest data in Xero against the last pull, which would be compared against
+    # itself if it were replayed from the local Xero cache
+    refresh = refresh or incremental
+
     # Check that the period exists and is valid
     utils.data_integrity.master_data_integrity_check_actuals(year=year, month=month,
                                                              check_balance_sheet=False, check_unassigned_balances=False)
 
-    # Pull both the Income Statement data and Balance Sheet data from the API
-    pnl_xero_data = get_xero_profit_and_loss_data(year=year, month=month)
-    bs_xero_data = get_xero_balancesheet_data(year=year, month=month)
+    company_names, pnl_data_rows, bs_data_rows = get_xero_extract_rows(year=year, month=month, refresh=refresh,
+                                                                       company_code=company_code,
+                                                                       bs_xero_data=bs_xero_data)
 
-    # Retrieve the Cost Centres that the data is mapped against
-    list_of_costcentres = get_list_of_cost_centres(xero_data=pnl_xero_data) # Used for the Income Statement only
-    cost_centre_id_mapping = get_cost_centre_id_dictionary()
+    # The validation facts of the period are collected as the rows are parsed, so the checks of later stages don't
+    # have to scan the extract again
+    validation_facts = {}
+    pnl_data_rows = iter_xero_rows_recording_validation_facts(rows=pnl_data_rows, facts=validation_facts)
+    bs_data_rows = iter_xero_rows_recording_validation_facts(rows=bs_data_rows, facts=validation_facts)
 
+    change_counts = None
+    session = db_sessionmaker()
     try:
-        session = db_sessionmaker()
-        #pnl_data_rows = parse_xero_pnl_body_data(xero_data=pnl_xero_data, list_of_cost_centres=list_of_costcentres,
-        #                                         year=year, month=month)
-        pnl_data_rows = parse_xero_pnl_body_data(xero_data=pnl_xero_data,
-                                                 list_of_cost_centres=list_of_costcentres,
-                                                 cost_centre_dict=cost_centre_id_mapping,
-                                                 year=year,
-                                                 month=month)
-
-        bs_data_rows = parse_xero_balancesheet_body_data(xero_data=bs_xero_data,
-                                                         year=year,
-                                                         month=month)
-
-        # Data should exist for all periods in Xero
-        if not pnl_data_rows or not bs_data_rows:
-            raise customobjects.error_objects.TableEmptyForPeriodError("No data exists in Xero for period {}.{}"
-                                                                       " ({} records returned for Income Statement,"
-                                                                       " {} records returned for Balance Sheet)"
-                                                                       .format(year, month, len(pnl_data_rows), len(bs_data_rows)))
-
-        utils.misc_functions.delete_table_data_for_period(table=TableXeroExtract, year=year, month=month)
-
-        for data_row in pnl_data_rows:
-            if data_row.Value != 0:
-                session.add(data_row)
-
-        for data_row in bs_data_rows:
-            if data_row.Value != 0:
-                session.add(data_row)
-
+        if incremental:
+            # The comparison needs the complete extract, so it is checked before any changes are made
+            pnl_data_rows = list(pnl_data_rows)
+            bs_data_rows = list(bs_data_rows)
+            check_xero_row_counts(year=year, month=month,
+                                  pnl_row_count=len(pnl_data_rows), bs_row_count=len(bs_data_rows))
+            utils.data_integrity.check_period_is_locked(year=year, month=month)
+
+            change_counts = sync_xero_extract_rows(session=session, year=year, month=month,
+                                                   rows=pnl_data_rows + bs_data_rows, company_names=company_names)
+        else:
+            # The old data is deleted and the new rows streamed into the table in the same transaction, so the
+            # period is left untouched if the new data turns out to be empty
+            delete_xero_extract_rows(session=session, year=year, month=month, company_names=company_names)
+
+            pnl_row_count = insert_xero_extract_rows(session=session, rows=pnl_data_rows)
+            bs_row_count = insert_xero_extract_rows(session=session, rows=bs_data_rows)
+            check_xero_row_counts(year=year, month=month, pnl_row_count=pnl_row_count, bs_row_count=bs_row_count)
+
+        utils.xero_validation.write_xero_validation_facts(session=session, facts=validation_facts,
+                                                          periods=[datetime.datetime(year=year, month=month, day=1)],
+                                                          company_names=company_names)
+    except Exception:
+        session.rollback()
+        raise
+    else:
         session.commit()
+    finally:
+        session.close()
+
+    return change_counts
+
+def _get_xero_balancesheet_batch(task, refresh=False):
+    ''' Retrieves the Balance Sheets of a batch of consecutive periods for one organisation as a single multi-period
+        report. If the report can't be retrieved or read, the Balance Sheets are retrieved with each period's pull
+        instead
+
+    :param task: Tuple of (company code, list of (year, month) tuples)
+    :param refresh: If True, retrieve the report from the API rather than the local Xero cache
+    :return: Tuple of (company code, dictionary of {(year, month): Balance Sheet JSON object})
+    '''
+
+    company_code, periods = task
+    try:
+        return company_code, get_xero_balancesheet_data_by_period(periods=periods, refresh=refresh,
+                                                                  company_code=company_code)
+    except (requests.RequestException, customobjects.error_objects.XeroRateLimitError, KeyError, ValueError), e:
+        util_output("Balance Sheets for {}.{} to {}.{} will be retrieved for each period ({}: {})"
+                    .format(periods[0][0], periods[0][1], periods[-1][0], periods[-1][1], type(e).__name__, e))
+        return company_code, {}
+
+def _pull_xero_data_for_period(task, refresh=False, incremental=False, balance_sheets=None):
+    ''' Pulls a single period of Xero data for one organisation into the database, capturing any error so that
+        one failed pull doesn't abort the other periods and organisations being pulled
+
+    :param task: Tuple of (company code, year, month)
+    :param refresh: If True, retrieve the data from the API rather than the local Xero cache
+    :param incremental: If True, only the balances that have changed since the last pull are written
+    :param balance_sheets: Dictionary of {(company code, year, month): Balance Sheet JSON object} already retrieved
+    :return: Tuple of (company code, year, month, error message), where the error message is None if the pull
+             succeeded
+    '''
+
+    company_code, year, month = task
+    bs_xero_data = balance_sheets.get(task) if balance_sheets else None
+    try:
+        pull_xero_data_to_database(year=year, month=month, refresh=refresh, incremental=incremental,
+                                   company_code=company_code, bs_xero_data=bs_xero_data)
+    except Exception, e:
+        return company_code, year, month, "{}: {}".format(type(e).__name__, e)
+    else:
+        return company_code, year, month, None
+
+def pull_xero_data_to_database_for_periods(periods, max_workers=r.XERO_MAX_CONCURRENT_PERIODS, refresh=False,
+                                           incremental=False, company_codes=None, batch_balance_sheets=True):
+    ''' Pulls data via the Xero API for several periods and organisations concurrently. Each period is written to
+        the database as soon as its data has been retrieved
+
+    :param periods: List of (year, month) tuples to pull
+    :param max_workers: Maximum number of periods retrieved from each Xero organisation at the same time
+    :param refresh: If True, retrieve the data from the API rather than the local Xero cache
+    :param incremental: If True, only the balances that have changed since the last pull are written (the data is
+                        always retrieved from the API)
+    :param company_codes: Company codes of the Xero organisations to pull (defaults to the only organisation)
+    :param batch_balance_sheets: If True, the Balance Sheets of consecutive periods are retrieved up front as
+                                 multi-period reports rather than with one request per period
+    :return: Generator of (company code, year, month, error message) tuples in the order the pulls complete
+    '''
+
+    refresh = refresh or incremental    # See pull_xero_data_to_database
 
+    # Each period of each organisation is pulled as a separate task. Periods are interleaved across organisations
+    # so that every organisation is pulled from the start, each within its own Xero rate limits
+    company_codes = company_codes if company_codes else [None]
+    tasks = [(company_code, year, month) for year, month in periods for company_code in company_codes]
+
+    pool = ThreadPool(processes=max(1, min(max_workers * len(company_codes), len(tasks))))
+    try:
+        balance_sheets = {}
+        if batch_balance_sheets and len(periods) > 1:
+            # The Profit & Loss is split into cost centre columns, so can't be combined with comparative periods
+            # and is still requested for each period. Any Balance Sheet missing from the batches is requested with
+            # its period
+            batch_tasks = [(company_code, batch) for company_code in company_codes
+                           for batch in utils.misc_functions.get_consecutive_period_batches(
+                               periods=periods, batch_size=r.XERO_REPORT_MAX_PERIODS)]
+            get_batch = functools.partial(_get_xero_balancesheet_batch, refresh=refresh)
+            for company_code, company_balance_sheets in pool.imap_unordered(get_batch, batch_tasks):
+                balance_sheets.update({(company_code, year, month): balance_sheet
+                                       for (year, month), balance_sheet in company_balance_sheets.items()})
+
+        pull_period = functools.partial(_pull_xero_data_for_period, refresh=refresh, incremental=incremental,
+                                        balance_sheets=balance_sheets)
+        for result in pool.imap_unordered(pull_period, tasks):
+            yield result
     finally:
-        session.close()
\ No newline at end of file
+        pool.close()
+        pool.join()
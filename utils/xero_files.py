@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to import Xero reports previously exported to files (e.g. the history of a newly
+onboarded entity) into the reporting database without calling the Xero API
+'''
+
+import calendar
+import datetime
+import functools
+import json
+import multiprocessing
+import os
+import re
+
+from xero.utils import json_load_object_hook
+
+from customobjects.database_objects import TableChartOfAccounts, TableCostCentres
+import customobjects.error_objects
+import references as r
+import utils.data_integrity
+import utils.misc_functions
+import utils.xero_connect
+import utils.xero_validation
+from utils.db_connect import db_sessionmaker
+
+# Exported reports must be named after the report and period, e.g. ProfitAndLoss-2017-03.json
+XERO_REPORT_FILE_PATTERN = re.compile(r'^({}|{})-(\d{{4}})-(\d{{1,2}})\.(json|csv)$'
+                                      .format(r.XERO_DATA_INCOMESTATEMENT, r.XERO_DATA_BALANCESHEET))
+
+
+def get_xero_report_files(directory):
+    ''' Returns the exported Xero report files in a directory
+
+    :param directory: Path of the directory containing the exported reports
+    :return: Chronologically ordered list of (filepath, report name, year, month) tuples, files that aren't named
+             in the format {report name}-{YYYY}-{MM}.json or .csv are ignored
+    '''
+
+    report_files = []
+    for file_name in os.listdir(directory):
+        match = XERO_REPORT_FILE_PATTERN.match(file_name)
+        if match:
+            report_name, year, month, extension = match.groups()
+            report_files.append((os.path.join(directory, file_name), report_name, int(year), int(month)))
+
+    return sorted(report_files, key=lambda report_file: (report_file[2], report_file[3], report_file[1]))
+
+def get_xero_account_name_mapping():
+    ''' Returns the mapping of Xero account names to Xero account codes from the Chart of Accounts (reports
+        exported to CSV only contain the account names)
+
+    :return: Dictionary of {Xero account name: Xero account code}
+    '''
+
+    session = db_sessionmaker()
+    query = session.query(TableChartOfAccounts.XeroName, TableChartOfAccounts.XeroCode)\
+        .filter(TableChartOfAccounts.XeroCode != None)\
+        .all()
+    session.close()
+
+    account_mapping = {r.XERO_CURRENT_YEAR_EARNINGS_NAME: r.XERO_CURRENT_YEAR_EARNINGS_ACCOUNT}
+    account_mapping.update({xero_name: xero_code for xero_name, xero_code in query})
+    return account_mapping
+
+def get_xero_cost_centre_name_mapping():
+    ''' Returns the mapping of Xero cost centre names to tracking option IDs from the master data, used in place of
+        the tracking categories retrieved from Xero
+
+    :return: Dictionary of {Xero cost centre name: tracking option ID}
+    '''
+
+    session = db_sessionmaker()
+    query = session.query(TableCostCentres.XeroName, TableCostCentres.XeroCode)\
+        .filter(TableCostCentres.XeroCode != None)\
+        .all()
+    session.close()
+
+    return {xero_name: xero_code for xero_name, xero_code in query}
+
+def convert_exported_value(value):
+    ''' Converts a balance in a report exported from Xero to the format returned by the API (e.g. "(1,234.50)" to
+        "-1234.50")
+
+    :param value: Value of the cell in the exported report
+    :return: String value of the cell (empty if the cell has no balance)
+    '''
+
+    value = value.strip().replace(",", "")
+    if value.startswith("(") and value.endswith(")"):
+        value = "-" + value[1:-1]
+    return value
+
+def read_xero_report_json_file(filepath):
+    ''' Reads a report exported from the Xero API in JSON format
+
+    :param filepath:
+    :return: The report in the format returned by the Xero API
+    '''
+
+    with open(filepath, 'rb') as report_file:
+        xero_data = json.load(report_file, object_hook=json_load_object_hook)
+
+    # The file may hold the full API response or only the report
+    if 'Reports' in xero_data:
+        xero_data = xero_data['Reports'][0]
+    return xero_data
+
+def read_xero_report_csv_file(filepath, report_name, account_mapping, company_name=None):
+    ''' Reads a report exported from Xero in CSV format (the report titles, a row of column headings and then one
+        row per account grouped in sections) and converts it to the format returned by the Xero API
+
+    :param filepath:
+    :param report_name: Name of the report (e.g. ProfitAndLoss)
+    :param account_mapping: Dictionary of {Xero account name: Xero account code}
+    :param company_name: Name of the company, used if the report titles don't include it
+    :return: The report in the format returned by the Xero API
+    '''
+
+    file_as_lists = utils.misc_functions.open_csv_file_as_list(filepath)
+
+    report_titles = []
+    header_cells = None
+    sections = []
+    for row in file_as_lists:
+        if not any([cell.strip() for cell in row]):
+            continue
+
+        if header_cells is None:
+            if row[0].strip() == "" and len(row) > 1:
+                header_cells = [{'Value': cell.strip()} for cell in row]
+            else:
+                report_titles.append(row[0].strip())
+
+        elif not any([cell.strip() for cell in row[1:]]):
+            sections.append({'RowType': 'Section', 'Title': row[0].strip(), 'Rows': []})
+
+        else:
+            if not sections:
+                sections.append({'RowType': 'Section', 'Title': '', 'Rows': []})
+
+            account_name = row[0].strip()
+            cells = [{'Value': account_name}] + [{'Value': convert_exported_value(cell)} for cell in row[1:]]
+            if account_name in account_mapping:
+                cells[0]['Attributes'] = [{'Value': account_mapping[account_name], 'Id': 'account'}]
+                sections[-1]['Rows'].append({'RowType': 'Row', 'Cells': cells})
+            elif account_name.startswith("Total ") or account_name in r.XERO_REPORT_SUMMARY_ROWS:
+                sections[-1]['Rows'].append({'RowType': 'SummaryRow', 'Cells': cells})
+            else:
+                raise customobjects.error_objects.MasterDataIncompleteError(
+                    "Account '{}' in {} is not mapped to a XeroCode in {}"
+                    .format(account_name, filepath, TableChartOfAccounts.__tablename__))
+
+    if header_cells is None:
+        raise customobjects.error_objects.TableEmptyForPeriodError("No column headings found in {}".format(filepath))
+
+    if company_name is None:
+        if len(report_titles) < 2:
+            raise customobjects.error_objects.MasterDataIncompleteError(
+                "The company name isn't included in the titles of {}".format(filepath))
+        company_name = report_titles[1]
+
+    return {'ReportID': report_name,
+            'ReportTitles': [report_titles[0] if report_titles else report_name, company_name] + report_titles[2:],
+            'Rows': [{'RowType': 'Header', 'Cells': header_cells}] + sections}
+
+def get_xero_report_file_export_time(filepath, xero_data):
+    ''' Returns the time a report was exported from Xero, so that the journals posted after the export are still
+        applied by the next journal sync (see utils.xero_journals.get_journal_deltas)
+
+    :param filepath:
+    :param xero_data: The report in the format returned by the Xero API
+    :return: Local datetime the report was generated by Xero (for reports exported from the API), otherwise the time
+             the file was last modified
+    '''
+
+    updated_date = xero_data.get('UpdatedDateUTC')
+    if isinstance(updated_date, datetime.datetime):
+        return datetime.datetime.fromtimestamp(calendar.timegm(updated_date.timetuple()))
+    return datetime.datetime.fromtimestamp(os.path.getmtime(filepath))
+
+def parse_xero_report_file(report_file, account_mapping, cost_centre_mapping, company_name=None, timestamp=None):
+    ''' Reads an exported Xero report and parses it into Xero extract rows with the same parsing as the reports
+        retrieved from the API
+
+    :param report_file: Tuple of (filepath, report name, year, month)
+    :param account_mapping: Dictionary of {Xero account name: Xero account code} (used for CSV files only)
+    :param cost_centre_mapping: Dictionary of {Xero cost centre name: tracking option ID}
+    :param company_name: Name of the company, used if a CSV file's titles don't include it
+    :param timestamp: Time recorded as the DateExtracted of the rows (defaults to the time the report was exported)
+    :return: Tuple of (company name, list of row tuples with values in the order of XERO_EXTRACT_COLUMNS)
+    '''
+
+    filepath, report_name, year, month = report_file
+
+    if filepath.endswith(".csv"):
+        xero_data = read_xero_report_csv_file(filepath=filepath, report_name=report_name,
+                                              account_mapping=account_mapping, company_name=company_name)
+    else:
+        xero_data = read_xero_report_json_file(filepath=filepath)
+
+    # The rows are dated when the report was exported rather than when it is imported, as the report doesn't
+    # include any journals posted since
+    xero_data[r.XERO_REPORT_DATE_FETCHED] = timestamp if timestamp else \
+        get_xero_report_file_export_time(filepath=filepath, xero_data=xero_data)
+
+    if report_name == r.XERO_DATA_INCOMESTATEMENT:
+        list_of_cost_centres = utils.xero_connect.get_list_of_cost_centres(xero_data=xero_data)
+        missing_cost_centres = [cost_centre_name for cost_centre_name in list_of_cost_centres[1:-1]
+                                if cost_centre_name not in cost_centre_mapping
+                                and cost_centre_name != r.XERO_DATA_COSTCENTRES_UNASSIGNED]
+        if missing_cost_centres:
+            raise customobjects.error_objects.MasterDataIncompleteError(
+                "Cost centres in {} are not mapped to a XeroCode in {}: {}"
+                .format(filepath, TableCostCentres.__tablename__, sorted(missing_cost_centres)))
+
+        rows = utils.xero_connect.iter_xero_pnl_body_rows(xero_data=xero_data,
+                                                          list_of_cost_centres=list_of_cost_centres,
+                                                          cost_centre_dict=cost_centre_mapping,
+                                                          year=year,
+                                                          month=month,
+                                                          timestamp=timestamp)
+    else:
+        rows = utils.xero_connect.iter_xero_balancesheet_body_rows(xero_data=xero_data, year=year, month=month,
+                                                                   timestamp=timestamp)
+
+    return xero_data['ReportTitles'][1], list(rows)
+
+def _parse_xero_report_file(report_file, **kwargs):
+    ''' Parses an exported Xero report in a worker process, capturing any error so that one invalid file doesn't
+        abort the import of the other files
+
+    :param report_file: Tuple of (filepath, report name, year, month)
+    :param kwargs: Arguments passed to parse_xero_report_file
+    :return: Tuple of (report file, company name, list of row tuples, error message), where the error message is
+             None if the file was parsed
+    '''
+
+    try:
+        company_name, rows = parse_xero_report_file(report_file=report_file, **kwargs)
+    except Exception, e:
+        return report_file, None, None, "{}: {}".format(type(e).__name__, e)
+    else:
+        return report_file, company_name, rows, None
+
+def write_xero_report_rows(report_name, company_name, year, month, rows):
+    ''' Replaces the rows of one report of a period for a company in the Xero extract table, leaving the other
+        report and the data of other companies untouched
+
+    :param report_name: Name of the report (e.g. ProfitAndLoss)
+    :param company_name: Name of the company (as named in the Xero reports)
+    :param year:
+    :param month:
+    :param rows: List of row tuples with values in the order of XERO_EXTRACT_COLUMNS
+    :return: Number of rows inserted
+    '''
+
+    utils.data_integrity.master_data_integrity_check_actuals(year=year, month=month,
+                                                             check_balance_sheet=False, check_unassigned_balances=False)
+    if not rows:
+        raise customobjects.error_objects.TableEmptyForPeriodError("No data in the {} report for period {}.{}"
+                                                                   .format(report_name, year, month))
+
+    session = db_sessionmaker()
+    try:
+        utils.xero_connect.delete_xero_extract_rows(session=session, year=year, month=month,
+                                                    company_names=[company_name], report_names=[report_name])
+        validation_facts = {}
+        row_count = utils.xero_connect.insert_xero_extract_rows(
+            session=session, rows=utils.xero_connect.iter_xero_rows_recording_validation_facts(
+                rows=rows, facts=validation_facts))
+        utils.xero_validation.write_xero_validation_facts(session=session, facts=validation_facts,
+                                                          periods=[datetime.datetime(year=year, month=month, day=1)],
+                                                          company_names=[company_name], report_names=[report_name])
+    except Exception:
+        session.rollback()
+        raise
+    else:
+        session.commit()
+    finally:
+        session.close()
+
+    return row_count
+
+def import_xero_report_files(directory, company_name=None, workers=r.XERO_REPORT_FILE_WORKERS):
+    ''' Imports a directory of reports previously exported from Xero into the Xero extract table. The files are
+        parsed in parallel worker processes and each report is written to the database as soon as it is parsed
+
+    :param directory: Path of the directory containing the exported reports
+    :param company_name: Name of the company, used if the titles of a CSV file don't include it
+    :param workers: Number of files parsed at the same time
+    :return: Generator of (filepath, year, month, number of rows, error message) tuples in the order the files are
+             parsed, where the error message is None if the file was imported
+    '''
+
+    report_files = get_xero_report_files(directory=directory)
+    if not report_files:
+        return
+
+    parse_file = functools.partial(_parse_xero_report_file,
+                                   account_mapping=get_xero_account_name_mapping(),
+                                   cost_centre_mapping=get_xero_cost_centre_name_mapping(),
+                                   company_name=company_name)
+
+    pool = multiprocessing.Pool(processes=max(1, min(workers, len(report_files))))
+    try:
+        for report_file, file_company_name, rows, error_message in pool.imap_unordered(parse_file, report_files):
+            filepath, report_name, year, month = report_file
+            if error_message is None:
+                try:
+                    row_count = write_xero_report_rows(report_name=report_name, company_name=file_company_name,
+                                                       year=year, month=month, rows=rows)
+                except Exception, e:
+                    error_message = "{}: {}".format(type(e).__name__, e)
+            yield filepath, year, month, (row_count if error_message is None else 0), error_message
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,420 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to keep the Xero extract up to date between full pulls by applying the journals posted
+in Xero since the last sync (e.g. late postings into closed months) to the balances already in the database
+'''
+
+import datetime
+import time
+
+from sqlalchemy import bindparam, func
+
+from customobjects.database_objects import TableXeroExtract, TableXeroExtractChangeLog, TableXeroJournalSync, \
+    TablePeriods
+import customobjects.error_objects
+import references as r
+import utils.xero_connect
+import utils.xero_validation
+
+from utils.db_bulk_write import bulk_insert_rows, iter_chunks
+from utils.db_connect import db_sessionmaker
+from utils.xero_connect import insert_xero_extract_rows
+
+
+def get_xero_organisation_details(company_code=None):
+    ''' Returns the details of a Xero organisation (name, financial year end, etc)
+
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Dictionary in the format returned by the Xero Organisation endpoint
+    '''
+
+    return utils.xero_connect.xero_api_get('Organisation', refresh=True,
+                                           company_code=company_code)['Organisations'][0]
+
+def get_xero_journals(offset, company_code=None):
+    ''' Returns a page of the journals posted in Xero. Journals are never changed once posted (corrections are
+        posted as new journals), so they are not recorded in the local Xero cache
+
+    :param offset: Only journals with a journal number greater than the offset are returned
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: List of journals in journal number order (at most XERO_JOURNALS_PAGE_SIZE)
+    '''
+
+    return utils.xero_connect.xero_api_get('Journals', params={'offset': offset}, company_code=company_code,
+                                           use_cache=False)['Journals']
+
+def iter_xero_journals(offset=0, company_code=None):
+    ''' Returns every journal posted in Xero after a given journal number, requesting one page at a time
+
+    :param offset: Journal number of the last journal already processed
+    :param company_code: Company code of the organisation (optional if only one organisation is set up)
+    :return: Generator of journals in journal number order
+    '''
+
+    while True:
+        journals = get_xero_journals(offset=offset, company_code=company_code)
+        for journal in journals:
+            yield journal
+        if len(journals) < r.XERO_JOURNALS_PAGE_SIZE:
+            break
+        offset = max([journal['JournalNumber'] for journal in journals])
+
+def convert_local_time_to_utc(timestamp):
+    ''' Converts a local time (as recorded in the DateExtracted column) to UTC for comparison with the creation
+        time of Xero journals
+
+    :param timestamp: Local datetime
+    :return: UTC datetime
+    '''
+
+    return datetime.datetime.utcfromtimestamp(time.mktime(timestamp.timetuple()))\
+        .replace(microsecond=timestamp.microsecond)
+
+def get_financial_year(period, financial_year_end_month):
+    ''' Returns the calendar year that the financial year containing a period ends in
+
+    :param period: Datetime of the period
+    :param financial_year_end_month: Last month of the financial year (1-12)
+    :return:
+    '''
+
+    return period.year + (1 if period.month > financial_year_end_month else 0)
+
+def get_journal_line_value(journal_line):
+    ''' Converts the net amount of a journal line (debits positive, credits negative) to the sign used in the Xero
+        reports, which show the balances of both debit and credit accounts as positive
+
+    :param journal_line: Journal line as returned by the Xero Journals endpoint
+    :return: Float
+    '''
+
+    if journal_line['AccountType'] in r.XERO_CREDIT_ACCOUNT_TYPES:
+        return -journal_line['NetAmount']
+    return journal_line['NetAmount']
+
+def is_journal_line_pnl(journal_line):
+    ''' Returns whether a journal line is posted to an Income Statement account (rather than a Balance Sheet account)
+
+    :param journal_line: Journal line as returned by the Xero Journals endpoint
+    :return: Boolean
+    '''
+
+    account_type = journal_line['AccountType']
+    if account_type in r.XERO_PNL_ACCOUNT_TYPES:
+        return True
+    if account_type in r.XERO_BALANCESHEET_ACCOUNT_TYPES:
+        return False
+    raise customobjects.error_objects.MasterDataIncompleteError("Unknown Xero account type {} on journal line for"
+                                                                " account {}".format(account_type,
+                                                                                     journal_line['AccountName']))
+
+def get_journal_line_cost_centre(journal_line):
+    ''' Returns the cost centre a journal line is tracked against
+
+    :param journal_line: Journal line as returned by the Xero Journals endpoint
+    :return: Tuple of (cost centre code, cost centre name), the code is None if the line is unassigned
+    '''
+
+    for tracking_category in journal_line.get('TrackingCategories', []):
+        if tracking_category['Name'] == r.XERO_DATA_COSTCENTRES:
+            return tracking_category['TrackingOptionID'], tracking_category['Option']
+    return None, r.XERO_DATA_COSTCENTRES_UNASSIGNED
+
+def _add_journal_delta(deltas, key, value, account_name, cost_centre_name):
+    ''' Adds a value to the running total of a balance in a dictionary of journal deltas
+
+    :param deltas: Dictionary of {key: [value, account name, cost centre name]}
+    :param key: Tuple of (report name, cost centre code, account code, period)
+    :param value:
+    :param account_name:
+    :param cost_centre_name:
+    :return:
+    '''
+
+    if key in deltas:
+        deltas[key][0] += value
+    else:
+        deltas[key] = [value, account_name, cost_centre_name]
+
+def get_journal_deltas(journals, extracted_periods, financial_year_end_month):
+    ''' Aggregates journal lines into changes to the balances held in the Xero extract table. A journal only
+        changes the periods that were extracted before it was created, so journals already included in the last
+        pull of a period are skipped. Income Statement lines change the balance of the journal's period, Balance
+        Sheet lines change the closing balance of the journal's period and every later period. The earnings of
+        Income Statement lines are added to the Current Year Earnings of later periods in the same financial
+        year, and Balance Sheets in later financial years (where Xero moves the earnings into Retained Earnings)
+        are left unchanged and returned as stale
+
+    :param journals: List of journals as returned by the Xero Journals endpoint
+    :param extracted_periods: Dictionary of {(report name, period): UTC time the period was last extracted}
+    :param financial_year_end_month: Last month of the organisation's financial year (1-12)
+    :return: Tuple of (dictionary of {(report name, cost centre code, account code, period):
+             [change in value, account name, cost centre name]}, set of stale Balance Sheet periods)
+    '''
+
+    balance_sheet_periods = sorted([period for report_name, period in extracted_periods
+                                    if report_name == r.XERO_DATA_BALANCESHEET])
+
+    deltas = {}
+    stale_periods = set()
+    for journal in journals:
+        journal_period = datetime.datetime(year=journal['JournalDate'].year, month=journal['JournalDate'].month,
+                                           day=1)
+        created = journal['CreatedDateUTC']
+
+        pnl_extracted = extracted_periods.get((r.XERO_DATA_INCOMESTATEMENT, journal_period))
+        is_pnl_missing_journal = pnl_extracted is not None and pnl_extracted < created
+        balance_sheets_missing_journal = [period for period in balance_sheet_periods
+                                          if period >= journal_period
+                                          and extracted_periods[(r.XERO_DATA_BALANCESHEET, period)] < created]
+
+        earnings = 0.0
+        for journal_line in journal['JournalLines']:
+            value = get_journal_line_value(journal_line)
+            if is_journal_line_pnl(journal_line):
+                earnings -= journal_line['NetAmount']
+                if is_pnl_missing_journal:
+                    cost_centre_code, cost_centre_name = get_journal_line_cost_centre(journal_line)
+                    _add_journal_delta(deltas,
+                                       (r.XERO_DATA_INCOMESTATEMENT, cost_centre_code, journal_line['AccountID'],
+                                        journal_period),
+                                       value, journal_line['AccountName'], cost_centre_name)
+            else:
+                for period in balance_sheets_missing_journal:
+                    _add_journal_delta(deltas,
+                                       (r.XERO_DATA_BALANCESHEET, None, journal_line['AccountID'], period),
+                                       value, journal_line['AccountName'], None)
+
+        if round(earnings, r.XERO_EXTRACT_VALUE_DECIMALS) != 0:
+            journal_financial_year = get_financial_year(journal_period, financial_year_end_month)
+            for period in balance_sheets_missing_journal:
+                if get_financial_year(period, financial_year_end_month) == journal_financial_year:
+                    _add_journal_delta(deltas,
+                                       (r.XERO_DATA_BALANCESHEET, None, r.XERO_CURRENT_YEAR_EARNINGS_ACCOUNT, period),
+                                       earnings, r.XERO_CURRENT_YEAR_EARNINGS_NAME, None)
+                else:
+                    stale_periods.add(period)
+
+    # Stale Balance Sheets must be pulled again in full, so none of the journals are applied to them
+    deltas = {key: delta for key, delta in deltas.items()
+              if not (key[0] == r.XERO_DATA_BALANCESHEET and key[3] in stale_periods)}
+
+    return deltas, stale_periods
+
+def exclude_locked_period_deltas(deltas, locked_periods):
+    ''' Removes the changes to locked periods from a dictionary of journal deltas, as locked periods can't be changed
+
+    :param deltas: Dictionary of changes as returned by get_journal_deltas
+    :param locked_periods: Collection of the datetimes of the locked periods
+    :return: Tuple of (dictionary of the changes to unlocked periods, set of the locked periods that had changes)
+    '''
+
+    locked_periods = set(locked_periods)
+    changed_locked_periods = set([key[3] for key in deltas if key[3] in locked_periods])
+    deltas = {key: delta for key, delta in deltas.items() if key[3] not in locked_periods}
+
+    return deltas, changed_locked_periods
+
+def get_locked_periods(session, periods):
+    ''' Returns the periods that are locked for changes
+
+    :param session:
+    :param periods: List of the datetimes of the periods to check
+    :return: Set of the datetimes of the locked periods
+    '''
+
+    if not periods:
+        return set()
+
+    return set([period for (period,) in session.query(TablePeriods.Period)
+                .filter(TablePeriods.Period.in_(periods))
+                .filter(TablePeriods.IsLocked == 1)
+                .all()])
+
+def get_extracted_periods(session, company_name):
+    ''' Returns the periods of each report held in the Xero extract table for a company, and when each was last
+        extracted
+
+    :param session:
+    :param company_name: Name of the company (as named in the Xero reports)
+    :return: Dictionary of {(report name, period): UTC time the period was last extracted}
+    '''
+
+    query = session.query(TableXeroExtract.ReportName,
+                          TableXeroExtract.Period,
+                          func.max(TableXeroExtract.DateExtracted))\
+        .filter(TableXeroExtract.CompanyName == company_name)\
+        .group_by(TableXeroExtract.ReportName, TableXeroExtract.Period)\
+        .all()
+
+    return {(report_name, period): convert_local_time_to_utc(date_extracted)
+            for report_name, period, date_extracted in query}
+
+def apply_journal_deltas(session, company_name, deltas, timestamp, chunk_size=r.DB_BULK_INSERT_CHUNK_SIZE):
+    ''' Applies changes in value to the balances in the Xero extract table. New balances are inserted, changed
+        balances are updated and balances that net to nil are deleted (as they are left out of the Xero reports).
+        Each change is recorded in the Xero extract changelog table, and the validation facts of the changed periods
+        are recorded again
+
+    :param session: Session to apply the changes in (the caller is responsible for committing)
+    :param company_name: Name of the company (as named in the Xero reports)
+    :param deltas: Dictionary of changes as returned by get_journal_deltas
+    :param timestamp: Time recorded as the DateExtracted of the changed balances
+    :param chunk_size: Number of rows sent to the database per statement
+    :return: Tuple of the number of rows (inserted, updated, deleted)
+    '''
+
+    periods = list(set([period for report_name, cost_centre_code, account_code, period in deltas]))
+    if not periods:
+        return 0, 0, 0
+
+    extract_table = TableXeroExtract.__table__
+
+    existing_rows = session.query(TableXeroExtract.ID,
+                                  TableXeroExtract.ReportName,
+                                  TableXeroExtract.CostCentreCode,
+                                  TableXeroExtract.AccountCode,
+                                  TableXeroExtract.Period,
+                                  TableXeroExtract.Value)\
+        .filter(TableXeroExtract.CompanyName == company_name)\
+        .filter(TableXeroExtract.Period.in_(periods))\
+        .all()
+    existing_by_key = {(report_name, cost_centre_code, account_code, period): (row_id, value)
+                       for row_id, report_name, cost_centre_code, account_code, period, value in existing_rows}
+
+    rows_to_insert = []
+    rows_to_update = []
+    rows_to_delete = []
+    change_log = []
+    for key, (delta, account_name, cost_centre_name) in sorted(deltas.items()):
+        if round(delta, r.XERO_EXTRACT_VALUE_DECIMALS) == 0:
+            continue
+
+        report_name, cost_centre_code, account_code, period = key
+        log_entry = {'DateChanged': timestamp, 'ReportName': report_name, 'CompanyName': company_name,
+                     'CostCentreCode': cost_centre_code, 'AccountCode': account_code, 'Period': period}
+
+        existing = existing_by_key.get(key)
+        if existing is None:
+            rows_to_insert.append((timestamp, report_name, company_name, cost_centre_code, cost_centre_name,
+                                   account_code, account_name, period, delta))
+            log_entry.update({'ChangeType': r.XERO_CHANGE_INSERTED, 'OldValue': None, 'NewValue': delta})
+        else:
+            row_id, old_value = existing
+            new_value = old_value + delta
+            if round(new_value, r.XERO_EXTRACT_VALUE_DECIMALS) == 0:
+                rows_to_delete.append(row_id)
+                log_entry.update({'ChangeType': r.XERO_CHANGE_DELETED, 'OldValue': old_value, 'NewValue': None})
+            else:
+                rows_to_update.append((row_id, new_value))
+                log_entry.update({'ChangeType': r.XERO_CHANGE_UPDATED, 'OldValue': old_value, 'NewValue': new_value})
+        change_log.append(log_entry)
+
+    insert_xero_extract_rows(session=session, rows=rows_to_insert, chunk_size=chunk_size)
+
+    update_statement = extract_table.update()\
+        .where(extract_table.c.ID == bindparam('row_id'))\
+        .values(Value=bindparam('new_value'), DateExtracted=bindparam('date_extracted'))
+    for chunk in iter_chunks(rows_to_update, chunk_size):
+        session.execute(update_statement, [{'row_id': row_id, 'new_value': new_value, 'date_extracted': timestamp}
+                                           for row_id, new_value in chunk])
+
+    for chunk in iter_chunks(rows_to_delete, chunk_size):
+        session.execute(extract_table.delete().where(extract_table.c.ID.in_(chunk)))
+
+    bulk_insert_rows(session=session, table=TableXeroExtractChangeLog, rows=change_log, chunk_size=chunk_size)
+
+    # The balances are changed in place, so the validation facts of the changed periods are recorded again
+    utils.xero_validation.refresh_xero_validation_facts(session=session, periods=periods, company_names=[company_name])
+
+    return len(rows_to_insert), len(rows_to_update), len(rows_to_delete)
+
+def get_journal_sync_mark(company_name):
+    ''' Returns the number of the last Xero journal applied to the Xero extract table for a company
+
+    :param company_name: Name of the company (as named in the Xero reports)
+    :return: Journal number (0 if the journals have never been synced)
+    '''
+
+    session = db_sessionmaker()
+    journal_sync = session.query(TableXeroJournalSync)\
+        .filter(TableXeroJournalSync.CompanyName == company_name)\
+        .one_or_none()
+    session.close()
+
+    return journal_sync.LastJournalNumber if journal_sync else 0
+
+def set_journal_sync_mark(session, company_name, last_journal_number, timestamp):
+    ''' Records the number of the last Xero journal applied to the Xero extract table for a company
+
+    :param session: Session to record the journal number in (the caller is responsible for committing)
+    :param company_name: Name of the company (as named in the Xero reports)
+    :param last_journal_number:
+    :param timestamp: Time of the sync
+    :return:
+    '''
+
+    journal_sync = session.query(TableXeroJournalSync)\
+        .filter(TableXeroJournalSync.CompanyName == company_name)\
+        .one_or_none()
+    if journal_sync is None:
+        journal_sync = TableXeroJournalSync(CompanyName=company_name)
+        session.add(journal_sync)
+
+    journal_sync.LastJournalNumber = last_journal_number
+    journal_sync.DateSynced = timestamp
+
+def sync_xero_journals(company_code=None):
+    ''' Applies the journals posted in Xero since the last sync to the balances already held in the Xero extract
+        table, so that late postings into previously pulled periods are picked up without pulling every affected
+        period again. The changes and the number of the last journal applied are committed in one transaction
+
+    :param company_code: Company code of the Xero organisation to sync (optional if only one organisation is set up)
+    :return: Dictionary of the company name, number of new journals, number of rows inserted, updated and
+             deleted, the list of stale Balance Sheet periods that must be pulled again in full, and the list of
+             locked periods whose changes were not applied
+    '''
+
+    # Journals created after the sync starts are only picked up by the next sync, so the changed balances are
+    # recorded as extracted at the start of the sync
+    timestamp = datetime.datetime.now()
+
+    organisation = get_xero_organisation_details(company_code=company_code)
+    company_name = organisation['Name']
+
+    last_journal_number = get_journal_sync_mark(company_name=company_name)
+    journals = list(iter_xero_journals(offset=last_journal_number, company_code=company_code))
+
+    results = {'company_name': company_name, 'journals': len(journals), 'inserted': 0, 'updated': 0, 'deleted': 0,
+               'stale_periods': [], 'locked_periods': []}
+    if not journals:
+        return results
+
+    session = db_sessionmaker()
+    try:
+        extracted_periods = get_extracted_periods(session=session, company_name=company_name)
+        deltas, stale_periods = get_journal_deltas(journals=journals, extracted_periods=extracted_periods,
+                                                   financial_year_end_month=organisation['FinancialYearEndMonth'])
+
+        # The journals are still marked as applied, so the locked periods must be pulled again once unlocked
+        locked_periods = get_locked_periods(session=session, periods=list(set([key[3] for key in deltas])))
+        deltas, locked_periods = exclude_locked_period_deltas(deltas=deltas, locked_periods=locked_periods)
+
+        inserted, updated, deleted = apply_journal_deltas(session=session, company_name=company_name,
+                                                          deltas=deltas, timestamp=timestamp)
+        set_journal_sync_mark(session=session, company_name=company_name,
+                              last_journal_number=max([journal['JournalNumber'] for journal in journals]),
+                              timestamp=timestamp)
+    except Exception:
+        session.rollback()
+        raise
+    else:
+        session.commit()
+    finally:
+        session.close()
+
+    results.update({'inserted': inserted, 'updated': updated, 'deleted': deleted,
+                    'stale_periods': sorted(stale_periods), 'locked_periods': sorted(locked_periods)})
+    return results
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Local stand-in for the Xero API that serves synthetic reports and journals, used to benchmark the extraction process
+and test the journal sync without network access or touching the real Xero organisation
+'''
+
+import BaseHTTPServer
+import datetime
+import json
+import random
+import SocketServer
+import threading
+import time
+import urlparse
+
+import numpy as np
+
+import references as r
+import utils.xero_connect
+from utils.db_connect import db_sessionmaker
+
+STANDIN_COMPANY_NAME = "Stand-in Company Ltd"
+
+
+def get_standin_account_id(report_name, index):
+    ''' Returns a deterministic Xero-style account ID for a synthetic account
+
+    :param report_name: Name of the report the account appears in
+    :param index: Position of the account in the report
+    :return: GUID-formatted string
+    '''
+
+    prefix = "00000001" if report_name == r.XERO_DATA_INCOMESTATEMENT else "00000002"
+    return "{}-0000-0000-0000-{:012d}".format(prefix, index)
+
+def get_standin_cost_centres(cost_centre_count):
+    ''' Returns the synthetic cost centre tracking options
+
+    :param cost_centre_count: Number of cost centres
+    :return: List of (cost centre name, tracking option ID) tuples
+    '''
+
+    return [("Cost Centre {:04d}".format(i), "00000003-0000-0000-0000-{:012d}".format(i))
+            for i in range(cost_centre_count)]
+
+def create_standin_tracking_categories(cost_centre_count):
+    ''' Creates a TrackingCategories response containing the synthetic cost centres
+
+    :param cost_centre_count: Number of cost centres
+    :return: Dictionary in the format returned by the Xero API
+    '''
+
+    options = [{'Name': name, 'TrackingOptionID': option_id, 'Status': 'ACTIVE'}
+               for name, option_id in get_standin_cost_centres(cost_centre_count)]
+
+    return {'TrackingCategories': [{'Name': r.XERO_DATA_COSTCENTRES,
+                                    'TrackingCategoryID': "00000004-0000-0000-0000-000000000000",
+                                    'Status': 'ACTIVE',
+                                    'Options': options}]}
+
+def _get_standin_value(generator, density):
+    ''' Returns a random balance formatted as Xero formats report cells (empty if the cell has no balance)
+
+    :param generator: random.Random instance
+    :param density: Proportion of cells with a balance
+    :return: String value of the cell
+    '''
+
+    if generator.random() >= density:
+        return ""
+    return "{:.2f}".format(generator.uniform(-10000, 10000))
+
+def create_standin_profit_and_loss(from_date, account_count, cost_centre_count, density):
+    ''' Creates a Profit & Loss report split by cost centre with random balances. The balances are seeded by
+        the period so that repeated requests for the same period return the same report
+
+    :param from_date: First day of the period (YYYY-MM-DD)
+    :param account_count: Number of accounts in the report
+    :param cost_centre_count: Number of cost centres in the report
+    :param density: Proportion of account/cost centre cells with a balance
+    :return: Dictionary in the format returned by the Xero API
+    '''
+
+    generator = random.Random(r.XERO_DATA_INCOMESTATEMENT + from_date)
+    column_names = [name for name, option_id in get_standin_cost_centres(cost_centre_count)]
+    column_names.append(r.XERO_DATA_COSTCENTRES_UNASSIGNED)
+
+    account_rows = []
+    column_totals = [0.0] * len(column_names)
+    for i in range(account_count):
+        values = [_get_standin_value(generator, density) for column in column_names]
+        for column, value in enumerate(values):
+            column_totals[column] += float(value) if value else 0.0
+
+        cells = [{'Value': "Account {:05d}".format(i),
+                  'Attributes': [{'Value': get_standin_account_id(r.XERO_DATA_INCOMESTATEMENT, i), 'Id': 'account'}]}]
+        cells.extend([{'Value': value} for value in values])
+        cells.append({'Value': "{:.2f}".format(sum([float(value) for value in values if value]))})
+        account_rows.append({'RowType': 'Row', 'Cells': cells})
+
+    summary_cells = [{'Value': 'Total'}] + [{'Value': "{:.2f}".format(total)} for total in column_totals]
+    summary_cells.append({'Value': "{:.2f}".format(sum(column_totals))})
+    account_rows.append({'RowType': 'SummaryRow', 'Cells': summary_cells})
+
+    header_cells = [{'Value': ''}] + [{'Value': name} for name in column_names] + [{'Value': 'Total'}]
+
+    return {'Reports': [{'ReportID': r.XERO_DATA_INCOMESTATEMENT,
+                         'ReportName': 'Profit and Loss',
+                         'ReportType': r.XERO_DATA_INCOMESTATEMENT,
+                         'ReportTitles': ['Profit & Loss', STANDIN_COMPANY_NAME, from_date],
+                         'Rows': [{'RowType': 'Header', 'Cells': header_cells},
+                                  {'RowType': 'Section', 'Title': 'Operating Expenses', 'Rows': account_rows}]}]}
+
+def get_standin_balance_sheet_dates(date, periods):
+    ''' Returns the reporting dates of the columns of a multi-period Balance Sheet (the month ends before the
+        reporting date)
+
+    :param date: Reporting date (YYYY-MM-DD)
+    :param periods: Number of comparative periods
+    :return: List of datetimes, latest first
+    '''
+
+    column_dates = [datetime.datetime(*[int(value) for value in date.split('-')])]
+    for i in range(periods):
+        column_dates.append(column_dates[-1].replace(day=1) - datetime.timedelta(days=1))
+    return column_dates
+
+def create_standin_balance_sheet(date, account_count, density, periods=0):
+    ''' Creates a Balance Sheet report with random balances. Each column is seeded by its reporting date, so a
+        period's balances are the same whether it is requested alone or as a comparative period
+
+    :param date: Reporting date (YYYY-MM-DD)
+    :param account_count: Number of accounts in the report
+    :param density: Proportion of accounts with a balance
+    :param periods: Number of comparative monthly periods (0 returns the prior year comparator instead)
+    :return: Dictionary in the format returned by the Xero API
+    '''
+
+    column_dates = get_standin_balance_sheet_dates(date=date, periods=periods)
+    if not periods:
+        column_dates.append(column_dates[0] - datetime.timedelta(days=365))
+
+    columns = []
+    for column_date in column_dates:
+        generator = random.Random(r.XERO_DATA_BALANCESHEET + column_date.strftime('%Y-%m-%d'))
+        columns.append([_get_standin_value(generator, density) for i in range(account_count)])
+
+    account_rows = []
+    for i in range(account_count):
+        cells = [{'Value': "Account {:05d}".format(i),
+                  'Attributes': [{'Value': get_standin_account_id(r.XERO_DATA_BALANCESHEET, i), 'Id': 'account'}]}]
+        cells.extend([{'Value': column[i]} for column in columns])
+        account_rows.append({'RowType': 'Row', 'Cells': cells})
+
+    header_cells = [{'Value': ''}] + [{'Value': column_date.strftime('%d %b %Y')} for column_date in column_dates]
+    if not periods:
+        header_cells[-1] = {'Value': 'Prior Year'}
+
+    return {'Reports': [{'ReportID': r.XERO_DATA_BALANCESHEET,
+                         'ReportName': 'Balance Sheet',
+                         'ReportType': r.XERO_DATA_BALANCESHEET,
+                         'ReportTitles': ['Balance Sheet', STANDIN_COMPANY_NAME, date],
+                         'Rows': [{'RowType': 'Header', 'Cells': header_cells},
+                                  {'RowType': 'Section', 'Title': 'Assets', 'Rows': account_rows}]}]}
+
+def format_xero_date(value):
+    ''' Formats a datetime as Xero formats dates in JSON responses
+
+    :param value: UTC datetime
+    :return: String (e.g. /Date(1488326400000+0000)/)
+    '''
+
+    milliseconds = int((value - datetime.datetime(year=1970, month=1, day=1)).total_seconds() * 1000)
+    return "/Date({}+0000)/".format(milliseconds)
+
+def create_standin_organisation():
+    ''' Creates an Organisation response for the stand-in company (with a December financial year end)
+
+    :return: Dictionary in the format returned by the Xero API
+    '''
+
+    return {'Organisations': [{'Name': STANDIN_COMPANY_NAME, 'FinancialYearEndDay': 31, 'FinancialYearEndMonth': 12}]}
+
+def create_standin_journal_line(account_id, account_name, account_type, net_amount, cost_centre=None):
+    ''' Creates a journal line in the format returned by the Xero Journals endpoint
+
+    :param account_id: Xero account ID (e.g. from get_standin_account_id)
+    :param account_name:
+    :param account_type: Xero account type (e.g. 'EXPENSE', 'CURRLIAB')
+    :param net_amount: Amount of the line, debits positive and credits negative
+    :param cost_centre: Tuple of (cost centre name, tracking option ID) the line is tracked against (optional)
+    :return: Dictionary
+    '''
+
+    tracking_categories = []
+    if cost_centre:
+        tracking_categories.append({'Name': r.XERO_DATA_COSTCENTRES,
+                                    'Option': cost_centre[0],
+                                    'TrackingCategoryID': "00000004-0000-0000-0000-000000000000",
+                                    'TrackingOptionID': cost_centre[1]})
+
+    return {'AccountID': account_id, 'AccountName': account_name, 'AccountType': account_type,
+            'NetAmount': net_amount, 'TrackingCategories': tracking_categories}
+
+def add_standin_journal(server, journal_date, journal_lines, created_date=None):
+    ''' Posts a journal to a stand-in server, numbered after the journals already posted
+
+    :param server: XeroStandInServer object
+    :param journal_date: Datetime the journal is dated (determines the period it is posted in)
+    :param journal_lines: List of journal lines (see create_standin_journal_line)
+    :param created_date: UTC datetime the journal was created (defaults to now)
+    :return: Journal number
+    '''
+
+    created_date = created_date if created_date else datetime.datetime.utcnow()
+    with server.request_lock:
+        journal_number = len(server.journals) + 1
+        server.journals.append({'JournalNumber': journal_number,
+                                'JournalDate': format_xero_date(journal_date),
+                                'CreatedDateUTC': format_xero_date(created_date),
+                                'JournalLines': journal_lines})
+    return journal_number
+
+
+class XeroStandInRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Handles GET requests to the stand-in server using the settings held on the server object
+    '''
+
+    def do_GET(self):
+
+        settings = self.server.settings
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        if settings['latency']:
+            time.sleep(settings['latency'])
+
+        with self.server.request_lock:
+            self.server.request_count += 1
+            is_rate_limited = settings['rate_limit_every'] and \
+                              self.server.request_count % settings['rate_limit_every'] == 0
+
+        if is_rate_limited:
+            self._send_response(429, "oauth_problem=rate%20limit%20exceeded", content_type='text/plain',
+                                headers={'Retry-After': '1'})
+        elif url.path.endswith('/Reports/ProfitAndLoss'):
+            self._send_json(create_standin_profit_and_loss(from_date=params.get('fromDate', ''),
+                                                           account_count=settings['account_count'],
+                                                           cost_centre_count=settings['cost_centre_count'],
+                                                           density=settings['density']))
+        elif url.path.endswith('/Reports/BalanceSheet'):
+            self._send_json(create_standin_balance_sheet(date=params.get('date', ''),
+                                                         account_count=settings['account_count'],
+                                                         density=settings['density'],
+                                                         periods=int(params.get('periods', 0))))
+        elif url.path.endswith('/TrackingCategories'):
+            self._send_json(create_standin_tracking_categories(cost_centre_count=settings['cost_centre_count']))
+        elif url.path.endswith('/Organisation'):
+            self._send_json(create_standin_organisation())
+        elif url.path.endswith('/Journals'):
+            offset = int(params.get('offset', 0))
+            with self.server.request_lock:
+                journals = [journal for journal in self.server.journals if journal['JournalNumber'] > offset]
+            self._send_json({'Journals': journals[:r.XERO_JOURNALS_PAGE_SIZE]})
+        else:
+            self._send_response(404, "Endpoint {} is not provided by the stand-in".format(url.path),
+                                content_type='text/plain')
+
+    def _send_json(self, data):
+        self._send_response(200, json.dumps(data), content_type='application/json')
+
+    def _send_response(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers if headers else {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # Requests aren't logged to the console
+
+
+class XeroStandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    Multi-threaded HTTP server so that concurrent requests from the extraction are served concurrently
+    '''
+
+    daemon_threads = True
+
+
+def create_standin_server(port=0, account_count=r.XERO_STANDIN_ACCOUNTS, cost_centre_count=r.XERO_STANDIN_COST_CENTRES,
+                          density=r.XERO_STANDIN_DENSITY, latency=0.0, rate_limit_every=0):
+    ''' Creates a stand-in Xero API server on localhost. Journals are served from the server's journals list, to
+        which journals can be posted with add_standin_journal
+
+    :param port: Port to listen on (0 picks a free port)
+    :param account_count: Number of accounts in each synthetic report
+    :param cost_centre_count: Number of cost centres in the synthetic Profit & Loss
+    :param density: Proportion of report cells with a balance
+    :param latency: Seconds to wait before responding to each request
+    :param rate_limit_every: Respond to every n-th request with a 429 (0 disables rate limiting)
+    :return: XeroStandInServer object (the API root is get_standin_url(server))
+    '''
+
+    server = XeroStandInServer(('127.0.0.1', port), XeroStandInRequestHandler)
+    server.settings = {'account_count': account_count,
+                       'cost_centre_count': cost_centre_count,
+                       'density': density,
+                       'latency': latency,
+                       'rate_limit_every': rate_limit_every}
+    server.request_lock = threading.Lock()
+    server.request_count = 0
+    server.journals = []        # Journals posted with add_standin_journal
+    return server
+
+def get_standin_url(server):
+    ''' Returns the API root of a stand-in server
+
+    :param server: XeroStandInServer object
+    :return:
+    '''
+
+    return "http://{}:{}/api.xro/2.0".format(*server.server_address)
+
+def start_standin_server(**kwargs):
+    ''' Creates a stand-in Xero API server and serves requests from a background thread
+
+    :param kwargs: Settings passed to create_standin_server
+    :return: XeroStandInServer object (stop it with server.shutdown())
+    '''
+
+    server = create_standin_server(**kwargs)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return server
+
+def benchmark_xero_extraction(year, month, iterations, insert_rows=True,
+                              rate_limit_per_minute=r.XERO_RATE_LIMIT_PER_MINUTE, **kwargs):
+    ''' Times the stages of the Xero extraction (fetch, parse, insert) against a stand-in server. Rows are inserted
+        in a transaction that is rolled back, so the database is left unchanged
+
+    :param year: Year of the period to extract
+    :param month: Month of the period to extract
+    :param iterations: Number of times the extraction is run
+    :param insert_rows: If True, the parsed rows are inserted into the Xero extract table (and rolled back)
+    :param rate_limit_per_minute: Per-minute call limit applied by the request scheduler during the benchmark
+    :param kwargs: Settings passed to create_standin_server
+    :return: Dictionary of {stage: list of timings in seconds}, plus the number of rows, failed iterations and
+             the request scheduler counters
+    '''
+
+    server = start_standin_server(**kwargs)
+    utils.xero_connect.set_xero_api_url(get_standin_url(server))
+    utils.xero_connect.reset_request_scheduler(per_minute=rate_limit_per_minute)
+
+    # The stand-in serves a single organisation, so the requests are made as the first organisation that is set up
+    company_code = utils.xero_connect.get_xero_company_codes()[0]
+
+    results = {'fetch': [], 'parse': [], 'insert': [], 'total': [], 'rows': 0, 'failed': []}
+    try:
+        for iteration in range(iterations):
+            try:
+                start_time = time.time()
+                pnl_xero_data, bs_xero_data = utils.xero_connect.get_xero_period_data(year=year, month=month,
+                                                                                     refresh=True,
+                                                                                     company_code=company_code)
+                tracking_categories = utils.xero_connect.get_tracking_categories(refresh=True,
+                                                                                 company_code=company_code)
+                fetch_time = time.time()
+
+                list_of_cost_centres = utils.xero_connect.get_list_of_cost_centres(xero_data=pnl_xero_data)
+                cost_centre_dict = utils.xero_connect.get_cost_centre_id_dictionary(categories=tracking_categories)
+                rows = list(utils.xero_connect.iter_xero_pnl_body_rows(xero_data=pnl_xero_data,
+                                                                       list_of_cost_centres=list_of_cost_centres,
+                                                                       cost_centre_dict=cost_centre_dict,
+                                                                       year=year,
+                                                                       month=month))
+                rows.extend(utils.xero_connect.iter_xero_balancesheet_body_rows(xero_data=bs_xero_data,
+                                                                                year=year,
+                                                                                month=month))
+                parse_time = time.time()
+
+                if insert_rows:
+                    session = db_sessionmaker()
+                    try:
+                        utils.xero_connect.insert_xero_extract_rows(session=session, rows=rows)
+                    finally:
+                        session.rollback()
+                        session.close()
+                insert_time = time.time()
+
+            except Exception, e:
+                results['failed'].append("{}: {}".format(type(e).__name__, e))
+            else:
+                results['fetch'].append(fetch_time - start_time)
+                results['parse'].append(parse_time - fetch_time)
+                results['insert'].append(insert_time - parse_time)
+                results['total'].append(insert_time - start_time)
+                results['rows'] = len(rows)
+    finally:
+        results['requests'] = utils.xero_connect.get_request_counters()
+        utils.xero_connect.set_xero_api_url(None)
+        utils.xero_connect.reset_request_scheduler()
+        server.shutdown()
+        server.server_close()
+
+    return results
+
+def summarise_timings(timings):
+    ''' Returns summary statistics of a list of timings
+
+    :param timings: List of timings in seconds
+    :return: Dictionary of the mean, median, 95th percentile and maximum timing
+    '''
+
+    if not timings:
+        return {'mean': None, 'p50': None, 'p95': None, 'max': None}
+    timings = np.array(timings)
+    return {'mean': timings.mean(),
+            'p50': np.percentile(timings, 50),
+            'p95': np.percentile(timings, 95),
+            'max': timings.max()}
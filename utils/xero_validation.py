@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Purpose of this module is to record validation facts of the Xero data as it is written to the Xero extract table.
+For each account in each report of a period the total balance and the balance not assigned to a cost centre are
+recorded, so the data integrity checks of later stages read these facts rather than scanning the Xero extract again
+'''
+
+import datetime
+
+from customobjects.database_objects import TableXeroExtract, TableXeroValidation
+import references_private as rp
+from utils.db_bulk_write import bulk_insert_rows
+
+# Columns of tbl_DATA_validation_xero, in the order the rows are inserted
+XERO_VALIDATION_COLUMNS = ('DateChecked', 'Period', 'ReportName', 'CompanyName', 'AccountCode', 'AccountName', 'Value',
+                           'UnassignedValue')
+
+
+def add_xero_validation_fact(facts, report_name, company_name, cost_centre_name, account_code, account_name, period,
+                             value):
+    ''' Adds the balance of a row of Xero data to the validation facts of its account
+
+    :param facts: Dictionary of {(period, report name, company name, account code): [account name, total balance,
+                  unassigned balance]} the balance is added to
+    :param report_name:
+    :param company_name:
+    :param cost_centre_name: Name of the cost centre the balance is assigned to in Xero (None for the Balance Sheet)
+    :param account_code:
+    :param account_name:
+    :param period:
+    :param value:
+    :return:
+    '''
+
+    fact = facts.setdefault((period, report_name, company_name, account_code), [account_name, 0.0, 0.0])
+    fact[1] += value
+    if cost_centre_name == rp.XERO_UNASSIGNED_CC:
+        fact[2] += value
+
+def write_xero_validation_facts(session, facts, periods, company_names, report_names=None):
+    ''' Replaces the validation facts of the Xero data of periods for specific companies
+
+    :param session: Session to write the facts in (the caller is responsible for committing)
+    :param facts: Dictionary of facts built by add_xero_validation_fact
+    :param periods: Datetimes of the periods to replace the facts of
+    :param company_names: Names of the companies (as named in the Xero reports) to replace the facts of
+    :param report_names: Names of the reports to replace the facts of (defaults to all reports)
+    :return: Number of facts written
+    '''
+
+    query = session.query(TableXeroValidation)\
+        .filter(TableXeroValidation.Period.in_(periods))\
+        .filter(TableXeroValidation.CompanyName.in_(company_names))
+    if report_names is not None:
+        query = query.filter(TableXeroValidation.ReportName.in_(report_names))
+    query.delete(synchronize_session=False)
+
+    date_checked = datetime.datetime.now()
+    rows = [(date_checked, period, report_name, company_name, account_code, account_name, value, unassigned_value)
+            for (period, report_name, company_name, account_code), (account_name, value, unassigned_value)
+            in sorted(facts.items())]
+
+    return bulk_insert_rows(session=session, table=TableXeroValidation, rows=rows, columns=XERO_VALIDATION_COLUMNS)
+
+def refresh_xero_validation_facts(session, periods, company_names):
+    ''' Records the validation facts of periods from the data already held in the Xero extract table (e.g. after
+        balances have been changed in place by a journal sync)
+
+    :param session: Session to read the Xero data and write the facts in (the caller is responsible for committing)
+    :param periods: Datetimes of the periods to record the facts of
+    :param company_names: Names of the companies (as named in the Xero reports) to record the facts of
+    :return: Number of facts written
+    '''
+
+    xero_rows = session.query(TableXeroExtract.ReportName,
+                              TableXeroExtract.CompanyName,
+                              TableXeroExtract.CostCentreName,
+                              TableXeroExtract.AccountCode,
+                              TableXeroExtract.AccountName,
+                              TableXeroExtract.Period,
+                              TableXeroExtract.Value)\
+        .filter(TableXeroExtract.Period.in_(periods))\
+        .filter(TableXeroExtract.CompanyName.in_(company_names))\
+        .all()
+
+    facts = {}
+    for report_name, company_name, cost_centre_name, account_code, account_name, period, value in xero_rows:
+        add_xero_validation_fact(facts=facts, report_name=report_name, company_name=company_name,
+                                 cost_centre_name=cost_centre_name, account_code=account_code,
+                                 account_name=account_name, period=period, value=value)
+
+    return write_xero_validation_facts(session=session, facts=facts, periods=periods, company_names=company_names)